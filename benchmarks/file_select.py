@@ -0,0 +1,170 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Benchmark source code file selection
+
+Generates a synthetic source tree and times `copytree` file selection
+(no files are copied) with the compiled FileSelect engine against the
+previous engine, which tested every rule for every file and matched
+glob patterns with `fnmatch.fnmatch`.
+
+The engines may select a different number of files: the previous
+engine counted files towards a rule's `max_matches` even when a later
+rule excluded them.
+
+Usage:
+
+    PYTHONPATH=. python benchmarks/file_select.py [--files N] [--repeat N]
+"""
+
+import argparse
+import fnmatch
+import os
+import shutil
+import tempfile
+import time
+
+from tracker.utils import config
+from tracker.utils import file as filelib
+
+
+class LegacyFileSelect(filelib.FileSelect):
+    """File select evaluating all rules as the previous engine did."""
+
+    def select_file(self, src_root, relpath):
+        rule_results = [
+            (_legacy_test(rule, src_root, relpath), rule)
+            for rule in self.rules
+            if rule.type != "dir"]
+        selected = None
+        for val, _rule in reversed(rule_results):
+            if val is not None:
+                selected = val
+                break
+        return selected is True, rule_results
+
+    def prune_dirs(self, src_root, relroot, dirs):
+        for name in list(dirs):
+            last_rule_result = None
+            relpath = os.path.join(relroot, name)
+            for rule in self.rules:
+                if rule.type != "dir":
+                    continue
+                rule_result = _legacy_test(rule, src_root, relpath)
+                if rule_result is not None:
+                    last_rule_result = rule_result
+            if last_rule_result is False:
+                dirs.remove(name)
+
+
+def _legacy_test(rule, src_root, relpath):
+    fullpath = os.path.join(src_root, relpath)
+    tests = [
+        lambda: (rule.max_matches is None
+                 or rule._matches < rule.max_matches),
+        lambda: any(fnmatch.fnmatch(relpath, p) for p in rule.patterns),
+        lambda: _legacy_test_type(rule, fullpath),
+        lambda: _legacy_test_size(rule, fullpath),
+    ]
+    for test in tests:
+        if not test():
+            return None
+    rule._matches += 1
+    return rule.result
+
+
+def _legacy_test_type(rule, path):
+    if rule.type is None:
+        return True
+    if rule.type == "dir":
+        return rule._test_dir(path)
+    is_text = filelib.safe_is_text_file(path)
+    return is_text if rule.type == "text" else not is_text
+
+
+def _legacy_test_size(rule, path):
+    if rule.size_gt is None and rule.size_lt is None:
+        return True
+    size = filelib.safe_filesize(path)
+    if size is None:
+        return True
+    if rule.size_gt and size > rule.size_gt:
+        return True
+    if rule.size_lt and size < rule.size_lt:
+        return True
+    return False
+
+
+class CountHandler(filelib.FileCopyHandler):
+
+    copied = 0
+
+    def copy(self, _path, _rule_results):
+        CountHandler.copied += 1
+
+
+def _rules():
+    # Base rules with source code exclusions typical of a project.
+    return filelib.base_sourcecode_select_rules() + [
+        filelib.exclude(["*.log", "*.tmp", "*.ckpt", "data/*"]),
+        filelib.exclude(["*.h5", "*.npy", "*.pkl"]),
+    ]
+
+
+def generate_tree(root, files):
+    exts = [".py", ".txt", ".log", ".tmp", ".npy", ".md", ".sh", ""]
+    per_dir = 100
+    for i in range(files):
+        dir = os.path.join(root, "pkg%03d" % (i // (per_dir * 10)),
+                           "mod%03d" % ((i // per_dir) % 10))
+        if i % per_dir == 0:
+            os.makedirs(dir)
+        path = os.path.join(dir, "file%06d%s" % (i, exts[i % len(exts)]))
+        with open(path, "w") as f:
+            f.write("x = %i\n" % i)
+
+
+def time_select(select_cls, src, repeat):
+    best = None
+    for _ in range(repeat):
+        select = select_cls(src, _rules())
+        CountHandler.copied = 0
+        t0 = time.time()
+        filelib.copytree("unused", select, handler_cls=CountHandler)
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, CountHandler.copied
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--files", type=int, default=100000)
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="tracker-bench-")
+    try:
+        config.set_tracker_home(os.path.join(tmp, "home"))
+        os.makedirs(config.get_tracker_home())
+        src = os.path.join(tmp, "src")
+        print("Generating %i files in %s" % (args.files, src))
+        generate_tree(src, args.files)
+        # Warm the text file cache for both engines
+        time_select(filelib.FileSelect, src, 1)
+        legacy, legacy_n = time_select(LegacyFileSelect, src, args.repeat)
+        compiled, compiled_n = time_select(
+            filelib.FileSelect, src, args.repeat)
+        print("legacy:   %.3fs (%i selected)" % (legacy, legacy_n))
+        print("compiled: %.3fs (%i selected)" % (compiled, compiled_n))
+        print("speedup:  %.1fx" % (legacy / compiled))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
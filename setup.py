@@ -30,6 +30,8 @@ requirements = [
     # 'astor>=0.8.0',
     # 'werkzeug>=0.15.6',
     'daemonize',
+    'numpy',
+    'ply',
     'psutil>=5.6.3',
     'tabview>=1.4.3',
 ]
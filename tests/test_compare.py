@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from tracker import run as runlib
+from tracker import run_index
+from tracker.commands import compare_impl
+from tracker.utils import config
+from tracker.utils import scalarlog
+
+
+class Args(object):
+
+    extra_cols = False
+    cols = None
+    strict_cols = None
+    skip_op_cols = False
+    skip_core = False
+    top = None
+    min = None
+    max = None
+    table = False
+    csv = "-"
+    workers = None
+    where = None
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+@pytest.fixture
+def runs(tmpdir):
+    config.set_tracker_home(str(tmpdir))
+    exp_dir = os.path.join(str(tmpdir), "experiments", "mnist")
+    for i, (lr, losses) in enumerate([
+            (0.1, [0.9, 0.5]),
+            (0.01, [0.8, 0.2, 0.4]),
+            (0.001, [0.7])]):
+        run_id = "%i" % i * 32
+        run = runlib.Run(run_id, os.path.join(exp_dir, run_id))
+        run.init_skeleton()
+        run.write_attr("parameters", {"lr": {"value": lr}})
+        run.write_attr("exit_status", 0)
+        with scalarlog.ScalarLogWriter(run.path) as writer:
+            for step, loss in enumerate(losses):
+                writer.add_scalar("loss", loss, step)
+    yield
+    run_index.index().close()
+    config.set_tracker_home(None)
+
+
+def test_csv(runs, capsys):
+    compare_impl.main(Args(
+        skip_core=True, cols=".run,min loss step", min="loss"))
+    assert capsys.readouterr().out.splitlines() == [
+        "lr,loss,run,loss step",
+        "0.01,0.4,11111111,1",
+        "0.1,0.5,00000000,1",
+        "0.001,0.7,22222222,0",
+    ]
+
+
+def test_table(runs, capsys):
+    compare_impl.main(Args(csv=None, table=True, top=1))
+    header, row = capsys.readouterr().out.splitlines()
+    assert header.split() == [
+        "run", "operation", "started", "time", "status", "label", "lr",
+        "loss"]
+    assert row.startswith("22222222 ")
+    assert row.split()[-3:] == ["completed", "0.001", "0.7"]
+
+
+def test_sorted_csv(runs, capsys):
+    compare_impl.main(Args(
+        strict_cols="=lr,min loss as best", max="best", top=2))
+    assert capsys.readouterr().out.splitlines() == [
+        "lr,best",
+        "0.001,0.7",
+        "0.1,0.5",
+    ]
+
+
+def test_sorted_indices_missing_last():
+    import numpy as np
+    col = np.array([3, None, 1, "2"], dtype=object)
+    assert list(compare_impl.sorted_indices(col)) == [2, 3, 0, 1]
+    assert list(compare_impl.sorted_indices(col, True)) == [0, 3, 2, 1]
+    assert list(compare_impl.sorted_indices(col, True, top=2)) == [0, 3]
+
+
+def test_flag_cols_skip_scalars(runs, capsys, tmpdir):
+    compare_impl.main(Args(strict_cols="=lr", min="lr"))
+    assert capsys.readouterr().out.splitlines() == [
+        "lr", "0.001", "0.01", "0.1"]
+    assert not tmpdir.join(
+        "experiments", "mnist", "0" * 32, ".tracker", "scalars.cache").exists()
+
+
+def test_tabview_reloads_changed_runs(runs, monkeypatch, tmpdir):
+    loaded = []
+    load_runs = compare_impl._load_runs
+
+    def counting_load_runs(runs, cols, args):
+        loaded.extend(run.short_id for run in runs)
+        return load_runs(runs, cols, args)
+
+    monkeypatch.setattr(compare_impl, "_load_runs", counting_load_runs)
+    data = compare_impl._TabviewData(Args(
+        csv=None, cols="=lr,.label", skip_core=True, skip_op_cols=True))
+
+    provider, _logs = data.get()
+    assert provider.header == ["lr", "label"]
+    assert provider[1:] == [["0.01", ""], ["0.1", ""]]
+    assert provider[0] == ["0.001", ""]
+    assert sorted(loaded) == ["00000000", "11111111", "22222222"]
+
+    del loaded[:]
+    run_dir = tmpdir.join("experiments", "mnist", "0" * 32)
+    runlib.Run("0" * 32, str(run_dir)).write_attr("label", "best")
+    provider, _logs = data.get()
+    assert list(provider) == [
+        ["0.001", ""], ["0.01", ""], ["0.1", "best"]]
+    assert loaded == ["00000000"]
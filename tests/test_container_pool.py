@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from tracker import container_pool
+from tracker import run as runlib
+
+DOCKER = """#!/bin/sh
+echo "$@" >> %(log)s
+case "$1" in
+  run) echo "c$$";;
+  image) [ "$3" = "local" ];;
+esac
+"""
+
+
+def _docker(tmpdir):
+    log = os.path.join(str(tmpdir), "docker.log")
+    path = os.path.join(str(tmpdir), "docker")
+    with open(path, "w") as f:
+        f.write(DOCKER % {"log": log})
+    os.chmod(path, 0o755)
+    return path, log
+
+
+def _calls(log):
+    with open(log) as f:
+        return [line.split()[:2] for line in f]
+
+
+def test_pool(tmpdir):
+    docker, log = _docker(tmpdir)
+    pool = container_pool.ContainerPool("busybox", "/runs-dir", docker)
+    pool.start([None, None])
+    assert _calls(log) == [["run", "-d"], ["run", "-d"]]
+    with open(log) as f:
+        assert "--user %i:%i " % (os.getuid(), os.getgid()) in f.readline()
+    c1, c2 = pool.acquire(), pool.acquire()
+    assert c1 != c2
+    # Released containers are reused, others are removed
+    pool.release(c1)
+    pool.release(c2, reuse=False)
+    assert pool.acquire() == c1
+    c3 = pool.acquire("device=0")
+    assert c3 not in (c1, c2)
+    pool.close()
+    assert _calls(log)[2:] == [
+        ["rm", "-f"], ["run", "-d"], ["rm", "-f"]]
+    with open(log) as f:
+        lines = f.read().splitlines()
+    assert lines[2] == "rm -f %s" % c2
+    assert lines[-1] == "rm -f %s" % " ".join(sorted([c1, c3]))
+
+
+def test_exec_cmd():
+    run = runlib.Run("a" * 32, os.path.join("/home", "a" * 32))
+    assert container_pool.exec_cmd("c1", run, "./train.py --lr 1") == (
+        "docker exec -e PYTHONUNBUFFERED=1 -w /runs/%s/.tracker/sourcecode "
+        "c1 ./train.py --lr 1" % run.id)
+
+
+def test_pull_images(tmpdir):
+    docker, log = _docker(tmpdir)
+    failed = container_pool.pull_images(["local", "remote", "local"], docker)
+    assert failed == []
+    assert sorted(_calls(log)) == [
+        ["image", "inspect"], ["image", "inspect"], ["pull", "remote"]]
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from tracker import early_stopping
+from tracker import run as runlib
+from tracker.utils import scalarlog
+
+
+def test_successive_halving():
+    stopper = early_stopping.RungStopper(
+        "loss", min_step=1, reduction_factor=2, min_trials=2)
+    assert stopper.report("a", 1, 0.5) is None
+    # Worse than half the trials at step 1
+    assert stopper.report("b", 1, 0.9) == (1, 0.9, 0.7)
+    assert stopper.report("c", 1, 0.1) is None
+    # Rungs passed between reports are each recorded with the best
+    # value at the rung step - 0.5 for a at step 2
+    assert stopper.report("a", 4, 0.4) is None
+    assert stopper.report("c", 2, 0.05) is None
+    assert stopper.report("c", 3, 0.01) is None
+    assert stopper._rungs[2] == [0.5, 0.05]
+    # Rungs before the first value are recorded with it
+    assert stopper.report("d", 2, 0.6) == (1, 0.6, 0.55)
+
+
+def test_report_values():
+    stopper = early_stopping.RungStopper(
+        "loss", min_step=1, reduction_factor=2, min_trials=2)
+    # A single poll that covers rungs at steps 1, 2 and 4
+    assert stopper.report_values(
+        "a", [(1, 0.9), (2, 0.8), (3, 0.2), (4, 0.3)]) is None
+    assert stopper._rungs == {1: [0.9], 2: [0.8], 4: [0.2]}
+    assert stopper.report_values("b", [(1, 0.5), (2, 0.85)]) is None
+    # b's value at step 4 counts rather than its later best
+    assert stopper.report_values("b", [(3, 0.35), (5, 0.1)]) == (
+        4, 0.35, pytest.approx(0.275))
+    assert stopper.report_values("c", [(2, 0.7)]) is None
+    assert stopper._rungs[1] == [0.9, 0.5, 0.7]
+
+
+def test_median_max():
+    stopper = early_stopping.RungStopper(
+        "acc", mode="max", method="median", min_step=2, min_trials=3)
+    assert stopper.report("a", 1, 0.1) is None
+    assert stopper.report("a", 2, 0.5) is None
+    assert stopper.report("b", 2, 0.7) is None
+    assert stopper.report("c", 3, 0.6) is None
+    assert stopper.report("d", 2, 0.4) == (2, 0.4, 0.55)
+
+
+def test_for_config():
+    assert early_stopping.for_config(None) is None
+    stopper = early_stopping.for_config({
+        "metric": "loss", "method": "median", "min-step": 5})
+    assert stopper.metric == "loss"
+    assert stopper.keep == 0.5
+    assert stopper.min_trials == 3
+    assert stopper.rung_step(2) == 45
+    for config in (
+            {"mode": "min"},
+            {"metric": "loss", "mode": "lowest"},
+            {"metric": "loss", "method": "hyperband"},
+            {"metric": "loss", "reduction-factor": 1},
+            {"metric": "loss", "min-step": "1"}):
+        with pytest.raises(early_stopping.EarlyStoppingError):
+            early_stopping.for_config(config)
+
+
+def test_monitor(tmpdir):
+    stopper = early_stopping.RungStopper(
+        "loss", reduction_factor=2, min_trials=2)
+    monitor = early_stopping.TrialMonitor(stopper, interval=60)
+    stopped = []
+    try:
+        for run_id, loss in (("a" * 32, 0.2), ("b" * 32, 0.4)):
+            run = runlib.Run(run_id, os.path.join(str(tmpdir), run_id))
+            run.init_skeleton()
+            with scalarlog.ScalarLogWriter(run.tracker_path()) as writer:
+                writer.add_scalar("loss", loss, 1)
+            monitor.watch(run, lambda run=run: stopped.append(run.id))
+        monitor.check()
+    finally:
+        monitor.close()
+    assert stopped == ["b" * 32]
+    assert run.get("early_stopped") == {
+        "metric": "loss", "step": 1, "value": 0.4,
+        "cutoff": pytest.approx(0.3)}
+
+
+def test_metric_series(tmpdir):
+    run_dir = str(tmpdir)
+    series = early_stopping._MetricSeries(run_dir, "loss")
+    assert series.read() == []
+    with scalarlog.ScalarLogWriter(os.path.join(run_dir, "train")) as writer:
+        writer.add_scalar("loss", 0.5)
+        writer.add_scalar("acc", 0.1)
+        writer.add_scalar("loss", 0.4)
+    assert series.read() == [(1, 0.5), (2, 0.4)]
+    with scalarlog.ScalarLogWriter(os.path.join(run_dir, "train")) as writer:
+        writer.add_scalar("loss", 0.3, 10)
+    assert series.read() == [(10, 0.3)]
+    assert series.read() == []
+    assert series.prefix == "train"
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import os
+
+import pytest
+
+from tracker.utils import blobs
+from tracker.utils import config
+from tracker.utils import file as filelib
+from tracker.utils import statcache
+
+
+@pytest.fixture
+def tracker_home(tmpdir):
+    config.set_tracker_home(str(tmpdir.mkdir("home")))
+    yield tmpdir
+    config.set_tracker_home(None)
+
+
+@pytest.fixture
+def src(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("train.py").write("print('train')\n")
+    src.mkdir("pkg").join("model.py").write("x = 1\n")
+    src.mkdir("__pycache__").join("model.cpython-37.pyc").write("x")
+    return str(src)
+
+
+def copy_to_store(src, dest, store):
+    select = filelib.FileSelect(src, filelib.base_sourcecode_select_rules())
+    handler = filelib.copytree(
+        dest, select,
+        handler_cls=functools.partial(filelib.BlobCopyHandler, store=store))
+    return handler.finish()
+
+
+def test_blob_copy(tracker_home, src, mocker):
+    store = blobs.BlobStore()
+    dest1 = str(tracker_home.join("run1"))
+    dest2 = str(tracker_home.join("run2"))
+
+    files1 = copy_to_store(src, dest1, store)
+    assert sorted(files1) == [os.path.join("pkg", "model.py"), "train.py"]
+    assert all(store.has(digest) for digest in files1.values())
+
+    add = mocker.spy(store, "add")
+    files2 = copy_to_store(src, dest2, store)
+    assert files2 == files1
+    assert add.call_count == 0
+    with open(os.path.join(dest2, "train.py")) as f:
+        assert f.read() == "print('train')\n"
+
+
+def test_chmod_plus_x_breaks_hardlink(tmpdir):
+    target = tmpdir.join("target")
+    target.write("#!/bin/sh\n")
+    link = str(tmpdir.join("link"))
+    os.link(str(target), link)
+
+    filelib.chmod_plus_x(link)
+
+    assert os.access(link, os.X_OK)
+    assert not os.access(str(target), os.X_OK)
+    assert os.stat(link).st_nlink == 1
+
+
+@pytest.mark.parametrize("content, is_text", [
+    (b"", True),
+    (b"#!/bin/sh\necho hello\n", True),
+    (u"æøå 日本語\n".encode("utf-8"), True),
+    (u"日本語".encode("utf-8") * 200, True),
+    (b"ELF\x00\x01\x02\x03", False),
+    (b"\x01\x02\x03\x04\x05\x06" * 100, False),
+    (b"\xff\xfe\x80\x81" * 100, False),
+])
+def test_is_text_file(tmpdir, content, is_text):
+    path = tmpdir.join("LICENSE")
+    path.write_binary(content)
+    assert filelib.is_text_file(str(path)) is is_text
+
+
+def test_is_text_file_cache(tracker_home, mocker):
+    path = tracker_home.join("Makefile")
+    path.write("all:\n")
+    sample = mocker.spy(filelib, "_is_text_sample")
+
+    assert filelib.safe_is_text_file(str(path))
+    assert filelib.safe_is_text_file(str(path))
+    assert sample.call_count == 1
+
+    path.write_binary(b"\x00" * 10)
+    assert not filelib.safe_is_text_file(str(path))
+    assert sample.call_count == 2
+
+
+def test_is_text_file_cache_detect_encoding(tracker_home, mocker):
+    path = tracker_home.join("LICENSE")
+    path.write_binary(b"\xff\xfe\x80\x81" * 100)
+    cache = statcache.cache("text_files")
+    mocker.patch.object(
+        filelib, "_decodable_with_detected_encoding", return_value=True)
+
+    assert not filelib.is_text_file(str(path), cache=cache)
+    assert filelib.is_text_file(
+        str(path), detect_encoding=True, cache=cache)
+    assert not filelib.is_text_file(str(path), cache=cache)
+
+
+def test_select_file_last_rule_wins(tmpdir):
+    tmpdir.join("a.py").write("")
+    tmpdir.join("a.log").write("")
+    select = filelib.FileSelect(str(tmpdir), [
+        filelib.include("*", max_matches=1),
+        filelib.exclude(["*.log", "*.tmp"]),
+    ])
+
+    selected, results = select.select_file(str(tmpdir), "a.log")
+    assert selected is False
+    assert [result for result, _rule in results] == [False]
+
+    # Excluded files don't count towards max_matches of earlier rules
+    assert select.select_file(str(tmpdir), "a.py")[0] is True
+    assert select.select_file(str(tmpdir), "b.py")[0] is False
+
+
+def test_files_digest(tracker_home, src):
+    dest = str(tracker_home.join("run"))
+    files = copy_to_store(src, dest, blobs.BlobStore())
+
+    md5 = filelib.files_digest(dest)
+    assert len(md5) == 32
+    assert filelib.files_digest(dest, "blake2b") == \
+        filelib.manifest_digest(files)
+    with pytest.raises(ValueError):
+        filelib.files_digest(dest, "sha0")
+    assert filelib.files_digest(str(tracker_home.mkdir("empty"))) is None
+
+
+def test_files_digest_rewritten(tracker_home):
+    run_dir = tracker_home.mkdir("run")
+    path = run_dir.join("train.py")
+    path.write("print(1)\n")
+    st = os.stat(str(path))
+    first = filelib.files_digest(str(run_dir), "blake2b")
+
+    # Rewrite in place with the same size and mtime, as when source
+    # code is copied again into a reused run directory
+    path.write("print(2)\n")
+    os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert filelib.files_digest(str(run_dir), "blake2b") != first
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+
+from tracker.utils import query
+
+
+def test_compile_plan():
+    select = query.parse_colspec(
+        ".run, =lr, loss, min loss step as best, attr:label")
+    plan = query.compile_plan(select)
+    assert plan.attrs == {"run", "label"}
+    assert plan.flags == {"lr"}
+    assert plan.scalars == {"loss": {(None, False), ("min", True)}}
+    assert plan.needs_scalars
+
+    assert not query.compile_plan(query.parse_colspec("=lr")).needs_scalars
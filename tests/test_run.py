@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+import pytest
+
+from tracker import run as runlib
+from tracker import run_index
+from tracker.utils import config
+
+
+@pytest.fixture
+def run_dir(tmpdir):
+    config.set_tracker_home(str(tmpdir))
+    yield os.path.join(str(tmpdir), "experiments", "mnist", "d" * 32)
+    run_index.index().close()
+    config.set_tracker_home(None)
+
+
+def test_packed_attrs(run_dir):
+    run = runlib.Run(os.path.basename(run_dir), run_dir)
+    run.init_skeleton(packed=True)
+    run.write_attr("parameters", {"lr": {"value": 0.01}})
+    run.write_attr("cmd", "docker run", raw=True)
+
+    assert run.packed
+    assert not os.path.exists(run.tracker_path("attrs"))
+    assert run.attr_names() == ["cmd", "id", "initialized", "parameters"]
+
+    reread = runlib.Run(run.id, run_dir)
+    assert reread["parameters"] == {"lr": {"value": 0.01}}
+    assert reread["cmd"] == "docker run"
+    assert reread.get("exit_status") is None
+
+    run.del_attr("cmd")
+    assert not runlib.Run(run.id, run_dir).has_attr("cmd")
+
+
+def test_packed_attrs_threads(run_dir):
+    run = runlib.Run(os.path.basename(run_dir), run_dir)
+    run.init_skeleton(packed=True)
+
+    def write(i):
+        for j in range(20):
+            run.write_attr("attr-%i-%i" % (i, j), j)
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    reread = runlib.Run(run.id, run_dir)
+    assert len(reread.attr_names()) == 2 + 4 * 20
+
+
+def test_del_attr_index(run_dir):
+    run = runlib.Run(os.path.basename(run_dir), run_dir)
+    run.init_skeleton(packed=True)
+    where = (
+        "id IN (SELECT run_id FROM run_attrs "
+        "WHERE name = 'label' AND value_text = 'best')")
+    run.write_attr("label", "best")
+    assert run_index.index().select(where) == [(run.id, run_dir)]
+    run.del_attr("label")
+    assert run_index.index().select(where) == []
+
+
+def test_pack_attrs(run_dir):
+    run = runlib.Run(os.path.basename(run_dir), run_dir)
+    run.init_skeleton(packed=False)
+    run.write_attr("exit_status", 0)
+    initialized = run["initialized"]
+
+    assert not run.packed
+    assert run.pack_attrs()
+    assert not run.pack_attrs()
+
+    reread = runlib.Run(run.id, run_dir)
+    assert reread.packed
+    assert not os.path.exists(run.tracker_path("attrs"))
+    assert reread["initialized"] == initialized
+    assert reread.status == "completed"
+
+
+def test_status_resolver(run_dir):
+    from tracker.utils import pid as pidlib
+
+    run = runlib.Run(os.path.basename(run_dir), run_dir)
+    run.init_skeleton()
+    with open(run.tracker_path("LOCK"), "w") as f:
+        f.write("1234")
+
+    running = runlib.RunStatusResolver(pidlib.ProcessTable({1234: 1}))
+    stopped = runlib.RunStatusResolver(pidlib.ProcessTable({}))
+    assert running.status(run) == "running"
+    assert stopped.status(run) == "terminated"
+    assert running.run_for_pid([run], 1234) is run
+    assert running.run_for_pid([run], 1) is run
+    assert stopped.run_for_pid([run], 1) is None
+
+
+def test_run_loader():
+    loader = runlib.RunLoader(lambda x: x * 2, workers=2)
+    assert loader.load_all(range(20)) == [x * 2 for x in range(20)]
+    assert sorted(loader.iter_loaded([3, 1])) == [(0, 6), (1, 2)]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+
+import pytest
+
+from tracker import run as runlib
+from tracker import run_changes
+from tracker import run_index
+from tracker.utils import config
+from tracker.utils import inotify
+
+
+@pytest.fixture
+def exp_dir(tmpdir):
+    config.set_tracker_home(str(tmpdir))
+    yield os.path.join(str(tmpdir), "experiments", "mnist")
+    run_index.index().close()
+    config.set_tracker_home(None)
+
+
+def _init_run(exp_dir, run_id):
+    run = runlib.Run(run_id, os.path.join(exp_dir, run_id))
+    run.init_skeleton()
+    return run
+
+
+def _check_changes(exp_dir, use_inotify):
+    run_a = _init_run(exp_dir, "a" * 32)
+    run_b = _init_run(exp_dir, "b" * 32)
+    detector = run_changes.RunChangeDetector(use_inotify=use_inotify)
+    assert detector.polling != use_inotify
+    assert detector.runs() == {run_a.path, run_b.path}
+    assert detector.changes() == (set(), set(), set())
+
+    run_c = _init_run(exp_dir, "c" * 32)
+    run_a.write_attr("label", "new")
+    shutil.rmtree(run_b.path)
+    assert detector.changes() == ({run_c.path}, {run_b.path}, {run_a.path})
+    assert detector.changes() == (set(), set(), set())
+
+    run_c.write_attr("exit_status", 0)
+    assert detector.changes() == (set(), set(), {run_c.path})
+    detector.close()
+
+
+def test_poll_changes(exp_dir):
+    _check_changes(exp_dir, use_inotify=False)
+
+
+@pytest.mark.skipif(not inotify.available(), reason="requires inotify")
+def test_inotify_changes(exp_dir):
+    _check_changes(exp_dir, use_inotify=True)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from tracker import run as runlib
+from tracker import run_filter
+from tracker import run_index
+from tracker.utils import config
+from tracker.utils import scalarlog
+
+
+@pytest.fixture
+def runs(tmpdir):
+    config.set_tracker_home(str(tmpdir))
+    exp_dir = os.path.join(str(tmpdir), "experiments", "mnist")
+    for i, (lr, opt, acc, exit_status) in enumerate([
+            (0.1, "sgd", 0.8, 0),
+            (0.001, "adam", 0.95, 0),
+            (0.005, "adam", 0.85, 1)]):
+        run_id = "%i" % i * 32
+        run = runlib.Run(run_id, os.path.join(exp_dir, run_id))
+        run.init_skeleton()
+        run.write_attr("parameters", {
+            "lr": {"value": lr},
+            "opt": {"value": opt},
+        })
+        with scalarlog.ScalarLogWriter(run.path) as writer:
+            writer.add_scalar("accuracy", acc / 2, 1)
+            writer.add_scalar("accuracy", acc, 2)
+        run.write_attr("exit_status", exit_status)
+        run.write_attr("stopped", 1)
+        run_index.safe_update_run(run, exit_status=exit_status, stopped=1)
+        run_index.safe_index_scalars(run)
+    yield
+    run_index.index().close()
+    config.set_tracker_home(None)
+
+
+def _filter(s):
+    return [run.short_id[0] for run in run_filter.filter_runs(s)]
+
+
+def test_filter(runs):
+    assert _filter("=lr < 0.01") == ["1", "2"]
+    assert _filter("status = completed and =lr < 0.01") == ["1"]
+    assert _filter("max accuracy > 0.9") == ["1"]
+    assert _filter("last accuracy step = 2 and =opt = sgd") == ["0"]
+    assert _filter("not (=opt = adam) or exit_status != 0") == ["0", "2"]
+    assert _filter("run = 2") == ["2"]
+    assert _filter("run = 0000") == ["0"]
+    assert _filter("run = 01") == []
+    assert _filter("run != 01") == ["0", "1", "2"]
+    assert _filter("=missing = 1") == []
+    assert _filter("") == ["0", "1", "2"]
+
+
+def test_pushdown(runs):
+    def candidates(s):
+        sql, params, exact = run_filter.to_sql(run_filter.parse(s))
+        rows = run_index.index().select(sql, params)
+        return [run_id[0] for run_id, _path in rows], exact
+
+    assert candidates("=opt = adam and max accuracy > 0.9") == (["1"], False)
+    assert candidates("not =opt = adam") == (["0"], True)
+    assert candidates("not max accuracy > 0.9") == (["0", "1", "2"], False)
+    assert candidates("status = running or =lr = 0.1") == (
+        ["0", "1", "2"], False)
+    assert candidates("run = 011") == ([], True)
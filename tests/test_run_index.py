@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from tracker import run as runlib
+from tracker import run_index
+from tracker.utils import config
+from tracker.utils import scalarlog
+
+
+@pytest.fixture
+def tracker_home(tmpdir):
+    config.set_tracker_home(str(tmpdir))
+    yield tmpdir
+    run_index.index().close()
+    config.set_tracker_home(None)
+
+
+def init_run(tracker_home, experiment, run_id):
+    run_dir = os.path.join(
+        str(tracker_home), "experiments", experiment, run_id)
+    run = runlib.Run(run_id, run_dir)
+    run.init_skeleton()
+    return run
+
+
+def test_init_skeleton_adds_run(tracker_home):
+    run = init_run(tracker_home, "mnist", "a" * 32)
+
+    assert run_index.index().find("aaaaaaaa") == [(run.id, run.path)]
+    assert run_index.index().run_ids(["mnist"]) == [run.id]
+    assert run_index.index().run_ids(["other"]) == []
+
+
+def test_find_prefix(tracker_home):
+    for run_id in ("ab" + "0" * 30, "ab" + "f" * 30, "ac" + "0" * 30):
+        init_run(tracker_home, "mnist", run_id)
+
+    index = run_index.index()
+    assert [x[0][:3] for x in index.find("ab")] == ["ab0", "abf"]
+    assert [x[0][:3] for x in index.find("ac")] == ["ac0"]
+    assert index.find("ad") == []
+
+
+def test_update_run(tracker_home):
+    run = init_run(tracker_home, "mnist", "b" * 32)
+    run_index.safe_update_run(run, exit_status=0, stopped=123)
+
+    row = run_index.index()._db().execute(
+        "SELECT exit_status, stopped FROM runs WHERE id = ?",
+        (run.id,)).fetchone()
+    assert row == (0, 123)
+
+
+def test_rebuild(tracker_home):
+    run = init_run(tracker_home, "mnist", "c" * 32)
+    index = run_index.index()
+    index.remove(run.id)
+    assert not index.built
+
+    assert index.rebuild() == 1
+    assert index.built
+    assert index.run_ids() == [run.id]
+
+
+def test_lazy_scalars(tracker_home):
+    run = init_run(tracker_home, "mnist", "d" * 32)
+    with scalarlog.ScalarLogWriter(run.path) as writer:
+        writer.add_scalar("loss", 0.5, 1)
+    run.write_attr("stopped", 123)
+
+    # Building the index for lookups doesn't read run scalars
+    index = run_index.ensure_built()
+    assert index.built and not index.scalars_built
+    assert index.scalar_tags() == []
+    assert not os.path.exists(run.tracker_path("scalars.cache"))
+
+    assert run_index.ensure_scalars() is index
+    assert index.scalars_built
+    assert index.scalar_tags() == ["loss"]
+
+
+def test_run_experiment(tracker_home):
+    run_dir = os.path.join(str(tracker_home), "experiments", "mnist", "x")
+    assert run_index.run_experiment(run_dir) == "mnist"
+    assert run_index.run_experiment("/tmp/somewhere/x") is None
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import threading
+
+from tracker import run as runlib
+from tracker import run_output
+from tracker.utils import scalarcache
+from tracker.utils import summary
+
+SCRIPT = """
+import sys
+import threading
+for i in range(%i):
+    sys.stdout.write("line %%i\\n" %% i)
+sys.stdout.flush()
+sys.stderr.write("error\\n")
+"""
+
+
+def _capture(run, lines, scalars=None):
+    proc = subprocess.Popen(
+        [sys.executable, "-c", SCRIPT % lines],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    output = run_output.RunOutput(run, quiet=True, scalars=scalars)
+    output.open(proc)
+    proc.wait()
+    output.wait()
+
+
+def test_capture(tmpdir):
+    run = runlib.Run("a" * 32, os.path.join(str(tmpdir), "a" * 32))
+    run.init_skeleton()
+    _capture(run, 200)
+    reader = run_output.OutputReader(run)
+    lines = list(reader.lines())
+    assert lines == ["line %i" % i for i in range(200)] + ["error"]
+    assert os.path.getsize(run.tracker_path("output.index")) == 3 * 8
+    assert list(reader.lines(130, 133)) == ["line 130", "line 131", "line 132"]
+    assert list(reader.lines(200)) == ["error"]
+    assert reader.line_offset(201) is None
+
+    # Output of restarted runs is appended and indexed from the end of
+    # the previous output.
+    _capture(run, 100)
+    assert os.path.getsize(run.tracker_path("output.index")) == 4 * 8
+    assert list(reader.lines(255, 257)) == ["line 54", "line 55"]
+    assert list(reader.lines(300)) == ["line 99", "error"]
+
+
+def test_capture_scalars(tmpdir):
+    run = runlib.Run("a" * 32, os.path.join(str(tmpdir), "a" * 32))
+    run.init_skeleton()
+    scalars = summary.OutputScalars(
+        [{"step": r"line (\step)"}, {"line": r"line (\value)"}],
+        run.tracker_path())
+    _capture(run, 200, scalars)
+    cache = scalarcache.for_run(run.path)
+    assert cache.get("line", "count") == 200
+    assert cache.get("line", "last") == 199
+    assert cache.get("line", "last", step=True) == 199
+
+
+def _start(script):
+    return subprocess.Popen(
+        [sys.executable, "-c", script],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+
+
+def test_interleave_lines(tmpdir):
+    run = runlib.Run("a" * 32, os.path.join(str(tmpdir), "a" * 32))
+    run.init_skeleton()
+    proc = _start(
+        "import sys, time\n"
+        "sys.stdout.write('a'); sys.stdout.flush(); time.sleep(0.2)\n"
+        "sys.stderr.write('error\\n'); sys.stderr.flush(); time.sleep(0.2)\n"
+        "sys.stdout.write('b\\n')\n")
+    output = run_output.RunOutput(run, quiet=True)
+    output.open(proc)
+    proc.wait()
+    assert output.wait()
+    assert list(run_output.OutputReader(run).lines()) == ["error", "ab"]
+
+
+def test_on_close(tmpdir):
+    run = runlib.Run("a" * 32, os.path.join(str(tmpdir), "a" * 32))
+    run.init_skeleton()
+    # A child process holds stdout open after the run process exits
+    proc = _start(
+        "import subprocess\n"
+        "subprocess.Popen(['sh', '-c', 'sleep 0.5; echo late'])\n")
+    output = run_output.RunOutput(run, quiet=True)
+    output.open(proc)
+    proc.wait()
+    assert not output.wait(0.1)
+    closed = threading.Event()
+    output.on_close(closed.set)
+    assert closed.wait(10)
+    assert list(run_output.OutputReader(run).lines()) == ["late"]
+    called = []
+    output.on_close(lambda: called.append(1))
+    assert called == [1]
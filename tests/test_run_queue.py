@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+
+import pytest
+
+from tracker import operation as oplib
+from tracker import run as runlib
+from tracker import run_index
+from tracker import run_queue
+from tracker.utils import config
+
+
+@pytest.fixture
+def exp_dir(tmpdir):
+    config.set_tracker_home(str(tmpdir))
+    yield os.path.join(str(tmpdir), "experiments", "mnist")
+    run_index.index().close()
+    config.set_tracker_home(None)
+
+
+def _stage_run(exp_dir, run_id, cmd):
+    run = runlib.Run(run_id, os.path.join(exp_dir, run_id))
+    run.init_skeleton()
+    run.write_attr("opdef", "train")
+    run.write_attr("cmd", cmd)
+    return run
+
+
+def test_queue(exp_dir):
+    run_a = _stage_run(exp_dir, "a" * 32, "echo a")
+    run_b = _stage_run(exp_dir, "b" * 32, "echo b")
+    run_queue.enqueue(run_a)
+    run_queue.enqueue(run_b)
+    assert [run.id for run in run_queue.queued()] == [run_a.id, run_b.id]
+    assert run_a.status == "pending"
+
+    claim = run_queue.claim()
+    assert claim.run.id == run_a.id
+    assert run_a.status == "running"
+    assert [run.id for run in run_queue.queued()] == [run_b.id]
+
+    exit_status = oplib.Operation.for_staged_run(claim.run).run_staged()
+    run_queue.complete(claim)
+    assert exit_status == 0
+    assert run_a.status == "completed"
+    with open(run_a.tracker_path("output")) as f:
+        assert f.read() == "a\n"
+    assert os.listdir(run_queue.claimed_dir()) == []
+
+
+def test_recover(exp_dir):
+    run = _stage_run(exp_dir, "a" * 32, "echo a")
+    run_queue.enqueue(run)
+    claim = run_queue.claim()
+    # Simulate a claim by a worker that exited before starting the run.
+    dead_path = claim.path.rsplit(".", 1)[0] + ".%i" % (2 ** 22 + 1)
+    shutil.move(claim.path, dead_path)
+    with open(run.tracker_path("LOCK"), "w") as f:
+        f.write(str(2 ** 22 + 1))
+    assert run.status == "terminated"
+
+    assert run_queue.recover() == 1
+    assert run.status == "pending"
+    assert run_queue.claim().run.id == run.id
+    assert run_queue.claim() is None
+
+
+def test_staged_config(exp_dir, monkeypatch):
+    run = _stage_run(exp_dir, "a" * 32, "docker run --gpus 0,1 img")
+    config = {
+        "environments": [{"executable": "./src/train", "image": "img"}],
+        "parameters": {"lr": {"value": 0.1}},
+        "output-scalars": {"loss": "loss: (\\S+)"},
+    }
+    run.write_attr("opconfig", config)
+    run.write_attr("base_cmd", "docker run")
+    run.write_attr("gpus", "0,1")
+    os.makedirs(run.tracker_path("sourcecode", "src"))
+    open(run.tracker_path("sourcecode", "src", "train"), "w").close()
+
+    op = oplib.Operation.for_staged_run(run)
+    assert op.operation_config == config
+    assert op.parameters == {"lr": {"value": 0.1}}
+
+    # Staged runs are started on the device assigned by the worker
+    monkeypatch.setattr(oplib.Operation, "proc", lambda op: op.cmd)
+    cmd = oplib.Operation.for_staged_run(run, "device=1").run_staged()
+    assert cmd.startswith(
+        "docker run -e PYTHONUNBUFFERED=1 --gpus device=1 -v ")
+    assert cmd.endswith(" img ./src/train --lr 0.1")
+    assert oplib.Operation.for_staged_run(run).run_staged() == \
+        "docker run --gpus 0,1 img"
+
+
+def test_release(exp_dir):
+    run = _stage_run(exp_dir, "a" * 32, "echo a")
+    run_queue.enqueue(run)
+    claim = run_queue.claim()
+    run_queue.release(claim)
+    assert run.status == "pending"
+    assert os.listdir(run_queue.claimed_dir()) == []
+    assert run_queue.claim().run.id == run.id
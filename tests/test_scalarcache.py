@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from tracker.utils import scalarcache
+from tracker.utils import scalarlog
+
+
+def _run_dir(tmpdir):
+    run_dir = str(tmpdir)
+    os.mkdir(os.path.join(run_dir, ".tracker"))
+    return run_dir
+
+
+def test_aggregates(tmpdir):
+    run_dir = _run_dir(tmpdir)
+    with scalarlog.ScalarLogWriter(run_dir) as writer:
+        for step, loss in enumerate([0.5, 0.2, 0.3]):
+            writer.add_scalar("loss", loss, step)
+
+    cache = scalarcache.for_run(run_dir, running=True)
+    assert list(cache.tags()) == [("", "loss")]
+    assert cache.get("loss") == 0.3
+    assert cache.get("loss", "first") == 0.5
+    assert cache.get("loss", "min") == 0.2
+    assert cache.get("loss", "min", step=True) == 1
+    assert cache.get("loss", "max", step=True) == 0
+    assert cache.get("loss", "count") == 3
+    assert abs(cache.get("loss", "avg") - (1.0 / 3)) < 1e-9
+    assert cache.get("#loss") == 0.3
+    assert cache.get("acc") is None
+
+
+def test_incremental_refresh(tmpdir):
+    run_dir = _run_dir(tmpdir)
+    logdir = os.path.join(run_dir, "train")
+    with scalarlog.ScalarLogWriter(logdir) as writer:
+        writer.add_scalar("loss", 0.5, 1)
+    assert scalarcache.for_run(run_dir, running=True).get("train#loss") == 0.5
+
+    with scalarlog.ScalarLogWriter(logdir) as writer:
+        writer.add_scalar("loss", 0.1, 2)
+    cache = scalarcache.for_run(run_dir)
+    assert cache.final
+    assert cache.get("train#loss", "min", step=True) == 2
+    assert cache.get("loss", "count") == 2
+
+    # Stopped runs are read from the cache only.
+    with scalarlog.ScalarLogWriter(logdir) as writer:
+        writer.add_scalar("loss", 0.0, 3)
+    assert scalarcache.for_run(run_dir).get("loss", "count") == 2
+
+
+def test_append_while_reading(tmpdir, monkeypatch):
+    run_dir = _run_dir(tmpdir)
+    with scalarlog.ScalarLogWriter(run_dir) as writer:
+        writer.add_scalar("loss", 0.5, 1)
+
+    # A record appended after the log is counted but before it's read
+    records = scalarlog.ScalarLogReader.records
+
+    def records_after_append(reader, start=0):
+        with scalarlog.ScalarLogWriter(run_dir) as writer:
+            writer.add_scalar("loss", 0.2, 2)
+        return records(reader, start)
+
+    monkeypatch.setattr(
+        scalarlog.ScalarLogReader, "records", records_after_append)
+    assert scalarcache.for_run(run_dir, running=True).get("loss") == 0.2
+    monkeypatch.undo()
+
+    cache = scalarcache.for_run(run_dir, running=True)
+    assert cache.get("loss", "count") == 2
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from tracker.utils import scalarlog
+from tracker.utils import summary
+
+
+def test_write_read(tmpdir):
+    logdir = str(tmpdir)
+    with scalarlog.ScalarLogWriter(logdir) as writer:
+        writer.add_scalar("loss", 0.5, 1)
+        writer.add_scalars({"loss": 0.25, "acc": 0.9}, step=2)
+
+    reader = scalarlog.ScalarLogReader(logdir)
+    assert reader.tags() == ["loss", "acc"]
+    assert list(reader) == [
+        ("loss", 0.5, 1),
+        ("acc", 0.9, 2),
+        ("loss", 0.25, 2),
+    ]
+
+    records = reader.records(start=1)
+    assert list(records["step"]) == [2, 2]
+    assert reader.records(start=3).shape == (0,)
+
+
+def test_append_truncates_partial_record(tmpdir):
+    logdir = str(tmpdir)
+    with scalarlog.ScalarLogWriter(logdir) as writer:
+        writer.add_scalar("loss", 1.0, 1)
+    with open(tmpdir.join(scalarlog.SCALARS_FILE), "ab") as f:
+        f.write(b"\x01\x02")
+
+    with scalarlog.ScalarLogWriter(logdir) as writer:
+        writer.add_scalar("loss", 2.0, 2)
+
+    assert list(scalarlog.ScalarLogReader(logdir)) == [
+        ("loss", 1.0, 1),
+        ("loss", 2.0, 2),
+    ]
+
+
+def test_output_scalars(tmpdir):
+    output = summary.OutputScalars([{"loss": r"loss=(\value)"}], str(tmpdir))
+    output.write("step 1")
+    output.write(b"loss=0.75")
+    output.close()
+
+    assert list(scalarlog.ScalarLogReader(str(tmpdir))) == [
+        ("loss", 0.75, 0)]
+
+
+def test_output_scalars_lines(tmpdir):
+    config = [
+        {"step": r"step (\step)"},
+        {"loss": r"loss=(\value)"},
+        r"(\key): (\value)",
+        {"x": r"(a)\1 (\value)"},
+    ]
+    lines = [
+        "step 1 loss=0.5",
+        "acc: 0.25 and aa 3",
+        "no scalars here",
+        "step 2",
+        b"loss=0.25 acc: 0.75",
+    ]
+    patterns = summary._init_patterns(config)
+    matcher = summary._LineMatcher(patterns)
+    for line in lines:
+        assert matcher.match(line) == summary._match_line(line, patterns)
+
+    output = summary.OutputScalars(config, str(tmpdir), ignore=["x"])
+    output.write_lines(lines)
+    output.close()
+    assert list(scalarlog.ScalarLogReader(str(tmpdir))) == [
+        ("loss", 0.5, 1),
+        ("a", 3.0, 1),
+        ("acc", 0.25, 1),
+        ("acc", 0.75, 2),
+        ("loss", 0.25, 2),
+    ]
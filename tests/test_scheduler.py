@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+
+from tracker import scheduler
+
+
+def test_trial_scheduler(tmpdir):
+    slots = scheduler.DeviceSlots(
+        ["0", "1"], os.path.join(str(tmpdir), "slots.json"))
+    in_use = set()
+    lock = threading.Lock()
+    overlaps = []
+
+    def run_trial(n, device):
+        with lock:
+            if device in in_use:
+                overlaps.append(device)
+            in_use.add(device)
+        time.sleep(0.2)
+        with lock:
+            in_use.remove(device)
+        return n * 10
+
+    start = time.time()
+    results = scheduler.TrialScheduler(run_trial, 2, slots).run(range(4))
+    assert results == [0, 10, 20, 30]
+    assert not overlaps
+    assert time.time() - start < 0.7
+    assert slots.held() == {}
+
+
+def test_device_slots_shared(tmpdir):
+    path = os.path.join(str(tmpdir), "slots.json")
+    # Device 0 is held by a live process and device 1 by a process
+    # that no longer exists.
+    with open(path, "w") as f:
+        json.dump({"0": {"pid": os.getppid()}, "1": {"pid": 2 ** 22 + 1}}, f)
+    slots = scheduler.DeviceSlots(["0", "1"], path)
+    assert slots.acquire(timeout=0) == "1"
+    assert slots.acquire(timeout=0.1) is None
+    slots.release("1")
+    assert slots.held() == {"0": os.getppid()}
+
+
+def test_parse_devices():
+    assert scheduler.parse_devices(None) == []
+    assert scheduler.parse_devices("0, 2,3") == ["0", "2", "3"]
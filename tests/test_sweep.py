@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from tracker import sweep
+
+PARAMETERS = {
+    "batch_size": {"value": [32, 64]},
+    "epochs": {"value": 10, "description": "Epochs"},
+    "dropout": {"min": 0.1, "max": 0.3, "step": 0.1},
+}
+
+
+def test_grid():
+    trials = sweep.trials(PARAMETERS)
+    assert trials == [
+        {"batch_size": 32, "dropout": 0.1},
+        {"batch_size": 32, "dropout": 0.2},
+        {"batch_size": 32, "dropout": 0.3},
+        {"batch_size": 64, "dropout": 0.1},
+        {"batch_size": 64, "dropout": 0.2},
+        {"batch_size": 64, "dropout": 0.3},
+    ]
+    assert len(sweep.trials(PARAMETERS, count=2)) == 12
+
+
+def test_grid_requires_step():
+    with pytest.raises(sweep.SweepError):
+        sweep.trials({"lr": {"min": 0.001, "max": 0.1}}, "grid")
+
+
+def test_no_sweep():
+    assert sweep.trials({"epochs": {"value": 10}}, count=2) == [{}, {}]
+
+
+@pytest.mark.parametrize("optimizer", ["random", "quasi-random"])
+def test_sampled(optimizer):
+    parameters = {
+        "lr": {"min": 0.0001, "max": 0.1, "distribution": "log-uniform"},
+        "layers": {"min": 1, "max": 4},
+        "batch_size": {"value": [32, 64]},
+    }
+    trials = sweep.trials(parameters, optimizer, 50, seed=1)
+    assert len(trials) == 50
+    assert trials == sweep.trials(parameters, optimizer, 50, seed=1)
+    assert trials != sweep.trials(parameters, optimizer, 50, seed=2)
+    for trial in trials:
+        assert 0.0001 <= trial["lr"] <= 0.1
+        assert trial["layers"] in (1, 2, 3, 4)
+        assert trial["batch_size"] in (32, 64)
+    assert {trial["layers"] for trial in trials} == {1, 2, 3, 4}
+
+
+def test_quasi_random_coverage():
+    # Each eighth of the range gets one of the first eight samples
+    trials = sweep.trials(
+        {"x": {"min": 0.0, "max": 1.0}}, "quasi-random", 8, seed=3)
+    assert sorted(int(trial["x"] * 8) for trial in trials) == list(range(8))
+
+
+def test_trial_parameters():
+    trial = {"batch_size": 64, "dropout": 0.2}
+    assert sweep.trial_parameters(PARAMETERS, trial) == {
+        "batch_size": {"value": 64},
+        "epochs": {"value": 10, "description": "Epochs"},
+        "dropout": {"value": 0.2},
+    }
+
+
+def test_unsupported_optimizer():
+    with pytest.raises(sweep.SweepError):
+        sweep.trials(PARAMETERS, "bayesian")
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+from tracker.utils import tail
+
+WRITER = """
+import sys, time
+with open(sys.argv[1], "a") as f:
+    for i in range(5):
+        f.write("line %i\\n" % i)
+        f.flush()
+        time.sleep(0.05)
+    f.write("x" * 200000)
+"""
+
+
+def _follow(path):
+    proc = subprocess.Popen([sys.executable, "-c", WRITER, path])
+    out = io.StringIO()
+    try:
+        assert tail.follow(path, proc.pid, out, timeout=10)
+    finally:
+        proc.wait()
+    return out.getvalue()
+
+
+def test_follow(tmpdir):
+    path = os.path.join(str(tmpdir), "output")
+    out = _follow(path)
+    assert out == "".join("line %i\n" % i for i in range(5)) + "x" * 200000
+
+
+def test_follow_polling(tmpdir, monkeypatch):
+    monkeypatch.setattr(tail, "_init_inotify", lambda: None)
+    path = os.path.join(str(tmpdir), "output")
+    assert _follow(path).startswith("line 0\nline 1\n")
+
+
+def test_follow_stopped(tmpdir):
+    path = os.path.join(str(tmpdir), "output")
+    with open(path, "w") as f:
+        f.write("done\n")
+    out = io.StringIO()
+    assert tail.follow(path, None, out)
+    assert out.getvalue() == "done\n"
+
+
+def test_follow_timeout(tmpdir):
+    proc = subprocess.Popen(
+        [sys.executable, "-c", "import time; time.sleep(5)"])
+    try:
+        assert not tail.follow(
+            os.path.join(str(tmpdir), "output"), proc.pid, io.StringIO(),
+            timeout=0.2)
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+@pytest.mark.skipif(
+    not tail.inotify.available(), reason="requires inotify")
+def test_remove_watches(tmpdir, monkeypatch):
+    removed = []
+    with tail.Tailer() as tailer:
+        monkeypatch.setattr(tailer._inotify, "rm_watch", removed.append)
+        tailer.add("a", os.path.join(str(tmpdir), "a"))
+        tailer.add("b", os.path.join(str(tmpdir), "b"))
+        tailer.add("c", os.path.join(str(tmpdir.mkdir("sub")), "c"))
+        assert len(tailer._watches) == 2
+        tailer.remove("a")
+        assert len(tailer._watches) == 2
+        assert removed == []
+        tailer.remove("b")
+        tailer.remove("c")
+        assert len(tailer._watches) == 0
+        assert len(removed) == 2
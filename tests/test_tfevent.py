@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import struct
+
+from tracker.utils import tfevent
+
+
+def _record(data):
+    return struct.pack("<QI", len(data), 0) + data + struct.pack("<I", 0)
+
+
+def test_iter_records_resumes_from_offset(tmpdir):
+    path = str(tmpdir.join("events.out.tfevents.1"))
+    with open(path, "wb") as f:
+        f.write(_record(b"a") + _record(b"bc") + _record(b"def")[:-2])
+
+    state = {"offset": 0}
+    records = list(tfevent._iter_records(path, state))
+    assert [data for _offset, data in records] == [b"a", b"bc"]
+
+    state["offset"] = records[-1][0]
+    with open(path, "ab") as f:
+        f.write(_record(b"def")[-2:] + _record(b"g"))
+    assert [
+        data for _offset, data in tfevent._iter_records(path, state)
+    ] == [b"def", b"g"]
+
+
+def test_iter_records_restarts_truncated_file(tmpdir):
+    path = str(tmpdir.join("events.out.tfevents.1"))
+    with open(path, "wb") as f:
+        f.write(_record(b"a"))
+    state = {"offset": 1000}
+    assert [
+        data for _offset, data in tfevent._iter_records(path, state)
+    ] == [b"a"]
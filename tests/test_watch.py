@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from tracker import run as runlib
+from tracker import run_filter
+from tracker import run_index
+from tracker.commands import watch
+from tracker.utils import config
+from tracker.utils import pid as pidlib
+
+WRITER = """
+import sys, time
+with open(sys.argv[1], "w") as f:
+    f.write("first\\nsecond")
+    f.flush()
+    time.sleep(0.2)
+    f.write(" half\\n")
+"""
+
+
+@pytest.fixture
+def exp_dir(tmpdir):
+    config.set_tracker_home(str(tmpdir))
+    exp_dir = os.path.join(str(tmpdir), "experiments", "mnist")
+    os.makedirs(exp_dir)
+    yield exp_dir
+    run_index.index().close()
+    config.set_tracker_home(None)
+
+
+def _start_run(exp_dir, run_id, lr):
+    run = runlib.Run(run_id, os.path.join(exp_dir, run_id))
+    run.init_skeleton()
+    run.write_attr("parameters", {"lr": {"value": lr}})
+    proc = subprocess.Popen(
+        [sys.executable, "-c", WRITER, run.tracker_path("output")])
+    with open(run.tracker_path("LOCK"), "w") as f:
+        f.write(str(proc.pid))
+    return run, proc
+
+
+def _poll_until(watcher, procs):
+    deadline = time.time() + 10
+    while watcher.tailer and time.time() < deadline:
+        watcher.poll(0.1)
+        for proc in procs:
+            proc.poll()
+
+
+def test_watch_runs(exp_dir):
+    run_a, proc_a = _start_run(exp_dir, "a" * 32, 0.1)
+    out = io.StringIO()
+    watcher = watch.RunsWatcher(["mnist"], run_filter.parse("=lr < 1"), out)
+    run_b, proc_b = _start_run(exp_dir, "b" * 32, 0.01)
+    _run_c, proc_c = _start_run(exp_dir, "c" * 32, 10)
+    try:
+        watcher.poll(0)
+        _poll_until(watcher, [proc_a, proc_b, proc_c])
+    finally:
+        watcher.close()
+        for proc in (proc_a, proc_b, proc_c):
+            proc.wait()
+    lines = out.getvalue().splitlines()
+    for run in (run_a, run_b):
+        assert [line for line in lines if line.startswith(run.short_id)] == [
+            "%s | first" % run.short_id,
+            "%s | second half" % run.short_id,
+        ]
+    assert len(lines) == 4
+
+
+def test_attach_reads_procs_once(exp_dir, monkeypatch):
+    snapshot = pidlib.ProcessTable.snapshot
+    snapshots = []
+
+    def counting_snapshot():
+        snapshots.append(1)
+        return snapshot()
+
+    monkeypatch.setattr(
+        pidlib.ProcessTable, "snapshot", counting_snapshot)
+    started = [
+        _start_run(exp_dir, run_id * 32, 0.1) for run_id in "abc"]
+    out = io.StringIO()
+    watcher = watch.RunsWatcher(["mnist"], run_filter.parse("=lr < 1"), out)
+    try:
+        assert len(watcher._runs) == 3
+        assert len(snapshots) == 1
+    finally:
+        watcher.close()
+        for _run, proc in started:
+            proc.wait()
@@ -0,0 +1,26 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Command to manage trial attributes
+"""
+
+import click
+
+from tracker.utils import click_utils
+
+from .attrs_pack import attrs_pack
+
+
+@click.group(cls=click_utils.Group)
+
+def attrs():
+    """Manage how trial attributes are stored.
+    """
+
+
+attrs.add_command(attrs_pack)
@@ -0,0 +1,93 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Command to convert per-file trial attributes into packed attributes
+"""
+
+import logging
+import os
+
+import click
+
+from tracker import run as runlib
+from tracker import run_index
+from tracker.utils import cli
+from tracker.utils import click_utils
+
+log = logging.getLogger(__name__)
+
+
+@click.command("pack")
+@click.argument("runs", metavar="[RUN...]", nargs=-1)
+@click_utils.no_prompt_option
+@click_utils.use_args
+
+def attrs_pack(args):
+    """ Pack per-file trial attributes into a single file.
+
+    Trials store one file per attribute under `.tracker/attrs` by
+    default. Packed trials store all attributes in
+    `.tracker/attrs.json`, which is read once instead of once per
+    attribute.
+
+    If `RUN` is omitted, all trials in Tracker home are packed.
+    Running and pending trials are skipped.
+
+    To pack attributes of new trials, set ``attrs-format`` to
+    ``packed`` under the ``run`` key in ``~/.tracker/tracker.yaml``.
+    """
+    runs, skipped = _split_active_runs(_runs_for_args(args))
+    if skipped:
+        cli.out(
+            "Skipping %i running or pending trial(s)" % len(skipped),
+            err=True)
+    if not runs:
+        cli.out("No trials to pack")
+        return
+    if not args.yes and not _confirm_pack(runs):
+        return
+    packed = 0
+    for run in runs:
+        log.debug("packing attributes for %s", run.id)
+        if run.pack_attrs():
+            packed += 1
+    cli.out("Packed attributes for %i trial(s)" % packed)
+
+
+def _runs_for_args(args):
+    if args.runs:
+        paths = [runlib.run_dir_for_id(run_id) for run_id in args.runs]
+    else:
+        paths = [
+            path for _id, path in run_index.ensure_built().runs()
+            if os.path.isdir(path)
+        ]
+    return [runlib.Run(os.path.basename(path), path) for path in paths]
+
+
+def _split_active_runs(runs):
+    """Returns a tuple of runs that can be packed and active runs.
+
+    Active runs may write attributes to `.tracker/attrs` while it's
+    being removed.
+    """
+    resolver = runlib.RunStatusResolver()
+    inactive, active = [], []
+    for run in runs:
+        if resolver.status(run) in ("running", "pending"):
+            active.append(run)
+        else:
+            inactive.append(run)
+    return inactive, active
+
+
+def _confirm_pack(runs):
+    prompt = (
+        "You are about to pack the attributes of {} trial(s).\n"
+        "Continue?".format(len(runs)))
+    return cli.confirm(prompt, default=True)
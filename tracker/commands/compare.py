@@ -33,6 +33,9 @@ def compare_params(fn):
         click.Option(
             ("--skip-core",), is_flag=True,
             help="Don't show core columns."),
+        click.Option(
+            ("-w", "--where",), metavar="EXPR",
+            help="Only compare trials matching a filter expression."),
         click.Option(
             ("--top",), metavar="N", type=click.IntRange(min=1),
             help="Only show the top N runs."),
@@ -42,6 +45,11 @@ def compare_params(fn):
         click.Option(
             ("--max",), metavar="COLUMN",
             help="Show the highest values for COLUMN first."),
+        click.Option(
+            ("--workers",), metavar="N", type=click.IntRange(min=1),
+            help=(
+                "Number of threads used to load trials. Defaults to "
+                "a number based on available CPUs.")),
         click.Option(
             ("-t", "--table",), is_flag=True,
             help="Show comparison data as a table."),
@@ -74,7 +82,9 @@ def compare(ctx, args):
 
     Compare does not automatically update to display the latest
     available data. If you want to update the list of runs and their
-    status, press ``r`` (for refresh).
+    status, press ``r`` (for refresh). Refresh only reloads runs that
+    were added or changed since the list was last shown, along with
+    runs that are still running.
 
     You may alternative use the `--csv` option to write a CSV file
     containing the compare data. To print the CSV contents to standard
@@ -149,6 +159,22 @@ def compare(ctx, args):
     By default, runs are sorted by start time in ascending order -
     i.e. the most recent runs are listed first.
 
+    ### Filter Runs
+
+    Use `--where` to compare only runs matching a filter expression.
+    A filter expression compares column specs to values using ``=``,
+    ``!=``, ``<``, ``<=``, ``>`` or ``>=`` and combines comparisons
+    with ``and``, ``or``, ``not`` and parentheses. The attributes
+    `run`, `status`, `operation`, `label` and `exit_status` may be
+    used without a leading period.
+
+    For example, to compare completed runs with a learning rate below
+    0.01 and a highest accuracy above 0.9, use ``--where "status =
+    completed and =lr < 0.01 and max accuracy > 0.9"``.
+
+    Numbers are compared numerically and other values as text. Quote
+    values that contain spaces or reserved words.
+
     ### Limit Runs
 
     To limit the results to the top `N` runs, use `--top`.
@@ -7,15 +7,27 @@
 # -*- coding: utf-8 -*-
 
 """ Implementation of compare
+
+Compare data is held in a columnar table - one NumPy object array of
+cell values per column - so that sorting and limiting runs are single
+vectorized operations over a column and output can be written in row
+blocks without materializing a record per run.
 """
 
-# import csv
-# import itertools
+import csv
+import datetime
 import logging
-# import sys
+import os
+import sqlite3
+import sys
 
+from tracker import run as runlib
+from tracker import run_index
 from tracker.utils import cli
 from tracker.utils import config
+from tracker.utils import query
+from tracker.utils import scalarcache
+from tracker.utils import timestamp
 
 log = logging.getLogger(__name__)
 
@@ -36,6 +48,11 @@ NO_RUNS_CAPTION = "no runs"
 
 NO_TABLE_CLIP_WIDTH = pow(10, 10)
 
+# Number of rows formatted and written at a time
+ROW_BLOCK_SIZE = 1024
+
+TABLE_COL_SPACING = 2
+
 
 def main(args):
     _validate_args(args)
@@ -51,6 +68,8 @@ def main(args):
 def _validate_args(args):
     if args.csv and args.table:
         cli.error("--table and --csv cannot both be specified")
+    if args.min and args.max:
+        cli.error("--min and --max cannot both be specified")
 
 
 def _maybe_apply_strict_cols(args):
@@ -63,16 +82,524 @@ def _maybe_apply_strict_cols(args):
 
 
 def _write_csv(args):
-    # TODO
-    raise NotImplementedError
+    table = _compare_table(args)
+    if args.csv == "-":
+        _write_csv_rows(table, sys.stdout)
+    else:
+        with open(args.csv, "w", newline="") as f:
+            _write_csv_rows(table, f)
+        cli.out("Wrote %i trial(s) to %s" % (len(table), args.csv), err=True)
+
+
+def _write_csv_rows(table, f):
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(table.headers)
+    for rows in table.iter_row_blocks(_format_val):
+        writer.writerows(rows)
 
 
 def _print_table(args):
-    # TODO
-    raise NotImplementedError
+    table = _compare_table(args)
+    if not len(table):
+        cli.out(NO_RUNS_CAPTION, err=True)
+        return
+    widths = table.col_widths(_format_val)
+    last = len(widths) - 1
+    for row in [table.headers] + _table_rows(table):
+        cli.out("".join(
+            val if i == last else val.ljust(widths[i] + TABLE_COL_SPACING)
+            for i, val in enumerate(row)).rstrip())
+
+
+def _table_rows(table):
+    rows = []
+    for block in table.iter_row_blocks(_format_val):
+        rows.extend(block)
+    return rows
 
 
 def _tabview(args):
     config.set_log_output(True)
-    # TODO
-    raise NotImplementedError
+    from tracker import tabviewer
+    tabviewer.view_runs(
+        _TabviewData(args).get,
+        _tabview_detail,
+        [])
+
+
+class _TabviewData(object):
+    """Provides compare data to the viewer.
+
+    Unless runs are sorted by a column, which needs the values of all
+    runs, rows are provided to the viewer a page at a time in start
+    order so the viewer is shown without waiting for all runs to be
+    loaded. Rows are kept between refreshes and are only reloaded for
+    runs that changed on disk since the previous refresh, as reported
+    by a `run_changes.RunChangeDetector`, and for runs that are
+    running.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self._headers = None
+        self._rows = {}
+        self._changes = None
+
+    def get(self):
+        if self.args.min or self.args.max:
+            table = _compare_table(self.args)
+            return [table.headers] + _table_rows(table), []
+        from tracker import tabviewer
+        self._apply_changes()
+        runs = _runs(self.args, latest_first=True)
+        if self.args.top:
+            runs = runs[:self.args.top]
+        cols = _tabview_cols(self.args)
+        headers = _headers(cols)
+        if headers != self._headers:
+            self._headers = headers
+            self._rows = {}
+        provider = tabviewer.RowProvider(
+            headers, len(runs),
+            lambda start, end: self._load_rows(runs[start:end], cols))
+        return provider, []
+
+    def _apply_changes(self):
+        from tracker import run_changes
+        if self._changes is None:
+            self._changes = run_changes.RunChangeDetector(
+                _project_experiments())
+            return
+        changes = self._changes.changes()
+        log.debug(
+            "%i run(s) added, %i removed, %i modified since last refresh",
+            len(changes.added), len(changes.removed), len(changes.modified))
+        for path in changes.removed | changes.modified:
+            self._rows.pop(os.path.basename(path), None)
+
+    def _load_rows(self, runs, cols):
+        stale = [
+            run for run in runs
+            if run.id not in self._rows or _is_locked(run)
+        ]
+        if stale:
+            table = _build_table(_load_runs(stale, cols, self.args), cols)
+            for run, row in zip(stale, _table_rows(table)):
+                self._rows[run.id] = row
+        return [self._rows[run.id] for run in runs]
+
+
+def _tabview_cols(args):
+    core_cols, user_cols = _parsed_cols(args)
+    op_cols = _indexed_op_cols() if not args.skip_op_cols else []
+    return _join_cols(core_cols, op_cols, user_cols)
+
+
+def _indexed_op_cols():
+    """Returns operation columns for runs in the run index.
+
+    Scalars of runs that haven't stopped aren't indexed, so their
+    tags are read from their scalar caches.
+    """
+    experiments = _project_experiments()
+    index = run_index.ensure_scalars()
+    tags = set(index.scalar_tags("", experiments))
+    for _id, path in index.unstopped_runs(experiments):
+        tags.update(
+            tag for prefix, tag in scalarcache.ScalarCache(path).tags()
+            if not prefix)
+    return (
+        [query.Flag(name) for name in index.flag_names(experiments)]
+        + [query.Scalar(tag) for tag in sorted(tags)])
+
+
+def _headers(cols):
+    headers = []
+    for col in cols:
+        if col.header not in headers:
+            headers.append(col.header)
+    return headers
+
+
+def _is_locked(run):
+    """Returns True if run has a process lock and may be changing."""
+    return (
+        os.path.exists(run.tracker_path("LOCK"))
+        or os.path.exists(run.tracker_path("LOCK.remote")))
+
+
+def _tabview_detail(data, y, x):
+    try:
+        header = data[0][x]
+        val = data[y][x]
+    except IndexError:
+        return None
+    return val, header
+
+
+###################################################################
+# Table
+###################################################################
+
+class CompareTable(object):
+    """Columnar table of compare data.
+
+    `headers` is a list of column headers and `columns` a list of
+    NumPy object arrays of cell values, one per header. Missing
+    values are None.
+    """
+
+    def __init__(self, headers, columns):
+        self.headers = headers
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def col(self, header):
+        try:
+            return self.columns[self.headers.index(header)]
+        except ValueError:
+            raise KeyError(header)
+
+    def take(self, indices):
+        """Returns a new table with the rows at indices."""
+        return CompareTable(
+            self.headers,
+            [col[indices] for col in self.columns])
+
+    def iter_row_blocks(self, format_val):
+        """Yields lists of formatted rows of up to ROW_BLOCK_SIZE rows."""
+        for start in range(0, len(self), ROW_BLOCK_SIZE):
+            end = start + ROW_BLOCK_SIZE
+            cols = [
+                [format_val(val) for val in col[start:end]]
+                for col in self.columns
+            ]
+            yield list(zip(*cols))
+
+    def col_widths(self, format_val):
+        import numpy as np
+        widths = [len(header) for header in self.headers]
+        for i, col in enumerate(self.columns):
+            if len(col):
+                formatted = np.array(
+                    [format_val(val) for val in col], dtype=str)
+                widths[i] = max(widths[i], int(np.char.str_len(
+                    formatted).max()))
+        return widths
+
+
+def sorted_indices(col, descending=False, top=None):
+    """Returns row indices that sort col.
+
+    Numeric columns are sorted numerically and other columns by their
+    string values. Missing values are always sorted last. If `top` is
+    specified, only the indices of the first `top` rows are returned,
+    which are selected with a partial sort.
+    """
+    import numpy as np
+    missing = np.array([val is None for val in col], dtype=bool)
+    keys = _sort_keys(col, missing)
+    if descending:
+        keys = _negate_keys(keys)
+    if top is not None and top < len(col):
+        # Missing values sort last, so select the top rows among
+        # present values before sorting them.
+        present = np.flatnonzero(~missing)
+        if top < len(present):
+            part = present[np.argpartition(keys[present], top - 1)[:top]]
+            return part[np.argsort(keys[part], kind="stable")]
+        order = np.lexsort((keys, missing))
+        return order[:top]
+    return np.lexsort((keys, missing))
+
+
+def _sort_keys(col, missing):
+    import numpy as np
+    present = col[~missing]
+    try:
+        vals = np.array(present, dtype=float)
+    except (TypeError, ValueError):
+        keys = np.empty(len(col), dtype=object)
+        keys[~missing] = [str(val) for val in present]
+        keys[missing] = ""
+        return keys.astype(str)
+    else:
+        keys = np.zeros(len(col), dtype=float)
+        keys[~missing] = vals
+        return keys
+
+
+def _negate_keys(keys):
+    import numpy as np
+    if keys.dtype.kind == "f":
+        return -keys
+    # Strings can't be negated - replace them with their descending rank.
+    _uniq, inverse = np.unique(keys, return_inverse=True)
+    return -inverse
+
+
+def _compare_table(args):
+    core_cols, user_cols = _parsed_cols(args)
+    runs = _load_runs(_runs(args), core_cols + user_cols, args)
+    cols = _cols_for_args(args, core_cols, user_cols, runs)
+    table = _build_table(runs, cols)
+    return _sort_table(table, runs, args)
+
+
+def _runs(args, latest_first=False):
+    experiments = _project_experiments()
+    if args.where:
+        runs = _filtered_runs(args.where, experiments, args.workers)
+        if latest_first:
+            runs.sort(
+                key=lambda run: run.get("initialized") or 0, reverse=True)
+        return runs
+    try:
+        paths = [
+            path for _id, path in run_index.ensure_built().runs(
+                experiments, latest_first)
+            if os.path.isdir(path)
+        ]
+    except sqlite3.Error as e:
+        log.warning("cannot read run index: %s", e)
+        paths = runlib._get_all_run_dirs(experiments or [])
+    return [runlib.Run(os.path.basename(path), path) for path in paths]
+
+
+def _filtered_runs(where, experiments, workers):
+    from tracker import run_filter
+    try:
+        return run_filter.filter_runs(where, experiments, workers)
+    except query.ParseError as e:
+        cli.error("invalid --where expression %r: %s" % (where, e))
+
+
+def _project_experiments():
+    try:
+        return config.get_project_config().get("experiments")
+    except KeyError:
+        return None
+
+
+def _parsed_cols(args):
+    """Returns a tuple of core columns and columns specified by args."""
+    core_cols = []
+    if not args.skip_core:
+        core_cols.extend(_parse_cols(BASE_COLS))
+    if args.extra_cols:
+        core_cols.extend(_parse_cols(EXTRA_COLS))
+    user_cols = _parse_cols(args.cols) if args.cols else []
+    return core_cols, user_cols
+
+
+def _parse_cols(colspec):
+    try:
+        return query.parse_colspec(colspec).cols
+    except query.ParseError as e:
+        cli.error("invalid column spec %r: %s" % (colspec, e))
+
+
+###################################################################
+# Run loading
+###################################################################
+
+# Run attributes read for attribute columns that aren't stored under
+# their column name
+_ATTR_COL_SOURCES = {
+    "run": (),
+    "operation": ("opdef",),
+    "started": ("initialized",),
+    "time": ("initialized", "stopped"),
+    "status": (),
+    "sourcecode": ("sourcecode_digest",),
+}
+
+
+class _LoadedRun(object):
+
+    def __init__(self, run, status, attrs, scalars):
+        self.run = run
+        self.status = status
+        self.attrs = attrs
+        self.scalars = scalars
+
+
+def _load_runs(runs, cols, args):
+    """Returns a list of _LoadedRun for runs.
+
+    Only the values needed for cols, operation columns and sorting
+    are read. Status is resolved only when it's shown or when scalars
+    are read, and scalars are read only when there's a scalar column.
+    Runs are loaded by a `RunLoader` so per-run reads of attributes,
+    status and scalars are done concurrently.
+    """
+    plan = query.compile_plan(cols)
+    attr_names = _plan_attr_names(plan, args)
+    with_scalars = plan.needs_scalars or not args.skip_op_cols
+    with_status = with_scalars or "status" in plan.attrs
+    resolver = runlib.RunStatusResolver()
+
+    def load(run):
+        status = resolver.status(run) if with_status else None
+        attrs = {name: run.get(name) for name in attr_names}
+        scalars = (
+            scalarcache.for_run(run.path, status == "running")
+            if with_scalars else None)
+        return _LoadedRun(run, status, attrs, scalars)
+
+    return runlib.RunLoader(load, args.workers).load_all(runs)
+
+
+def _plan_attr_names(plan, args):
+    names = set()
+    for name in plan.attrs:
+        names.update(_ATTR_COL_SOURCES.get(name, (name,)))
+    if plan.flags or not args.skip_op_cols:
+        names.add("parameters")
+    if not args.min and not args.max:
+        # Used for the default sort order
+        names.add("initialized")
+    return names
+
+
+###################################################################
+# Columns
+###################################################################
+
+def _cols_for_args(args, core_cols, user_cols, runs):
+    op_cols = _op_cols(runs) if not args.skip_op_cols else []
+    return _join_cols(core_cols, op_cols, user_cols)
+
+
+def _join_cols(core_cols, op_cols, user_cols):
+    return core_cols + op_cols + user_cols or _parse_cols(MIN_COLS)
+
+
+def _op_cols(runs):
+    """Returns flag and scalar columns logged by runs.
+
+    Flags are listed first followed by root scalars, each in sorted
+    order.
+    """
+    flags = set()
+    tags = set()
+    for loaded in runs:
+        flags.update(loaded.attrs.get("parameters") or {})
+        tags.update(
+            tag for prefix, tag in loaded.scalars.tags() if not prefix)
+    return (
+        [query.Flag(name) for name in sorted(flags)]
+        + [query.Scalar(tag) for tag in sorted(tags)])
+
+
+def _build_table(runs, cols):
+    """Returns a CompareTable of runs for cols.
+
+    Columns with the same header are merged by taking the first
+    non-null value from left to right.
+    """
+    import numpy as np
+    headers = []
+    columns = []
+    for col in cols:
+        vals = np.empty(len(runs), dtype=object)
+        vals[:] = [_col_val(col, loaded) for loaded in runs]
+        header = col.header
+        if header in headers:
+            merged = columns[headers.index(header)]
+            missing = np.equal(merged, None)
+            merged[missing] = vals[missing]
+        else:
+            headers.append(header)
+            columns.append(vals)
+    return CompareTable(headers, columns)
+
+
+def _col_val(col, loaded):
+    if isinstance(col, query.Attr):
+        return _attr_val(col.name, loaded)
+    elif isinstance(col, query.Flag):
+        return _flag_val(col.name, loaded)
+    elif isinstance(col, query.Scalar):
+        try:
+            return loaded.scalars.get(col.key, col.qualifier, col.step)
+        except ValueError as e:
+            cli.error(str(e))
+    else:
+        raise AssertionError(col)
+
+
+def _flag_val(name, loaded):
+    param = (loaded.attrs.get("parameters") or {}).get(name)
+    if isinstance(param, dict):
+        return param.get("value")
+    return param
+
+
+def _attr_val(name, loaded):
+    attrs = loaded.attrs
+    if name == "run":
+        return loaded.run.short_id
+    elif name == "operation":
+        return attrs.get("opdef")
+    elif name == "started":
+        return _format_timestamp(attrs.get("initialized"))
+    elif name == "time":
+        return _format_duration(
+            attrs.get("initialized"), attrs.get("stopped"))
+    elif name == "status":
+        return loaded.status
+    elif name == "sourcecode":
+        digest = attrs.get("sourcecode_digest")
+        return digest[:8] if digest else None
+    else:
+        return attrs.get(name)
+
+
+def _format_timestamp(ts):
+    if not ts:
+        return None
+    return datetime.datetime.fromtimestamp(
+        timestamp.timestamp_seconds(ts)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _format_duration(started, stopped):
+    if not started or not stopped:
+        return None
+    seconds = int(timestamp.timestamp_seconds(stopped - started))
+    m, s = divmod(seconds, 60)
+    h, m = divmod(m, 60)
+    return "%d:%02d:%02d" % (h, m, s)
+
+
+def _sort_table(table, runs, args):
+    import numpy as np
+    if not len(table):
+        return table
+    sort_col = args.min or args.max
+    if sort_col:
+        try:
+            col = table.col(sort_col)
+        except KeyError:
+            cli.error(
+                "no such column '%s'\n"
+                "Try 'tracker compare --table' to show column names."
+                % sort_col)
+        indices = sorted_indices(col, bool(args.max), args.top)
+    else:
+        # Most recently started runs first.
+        started = np.array(
+            [loaded.attrs["initialized"] or 0 for loaded in runs],
+            dtype=np.int64)
+        indices = sorted_indices(started, True, args.top)
+    return table.take(indices)
+
+
+def _format_val(val):
+    if val is None:
+        return ""
+    if isinstance(val, float):
+        return "%g" % val
+    return str(val)
@@ -24,7 +24,6 @@ from tracker.utils import cli
 from tracker.utils import click_utils
 from tracker.utils import command
 from tracker.utils import config
-from tracker.utils import path as pathlib
 
 log = logging.getLogger(__name__)
 
@@ -32,15 +31,8 @@ DEFAULT_DIFF_CMD = "diff -ru"
 
 
 def _get_all_trials():
-    experiments = config.get_project_config().get("experiments")
-    run_ids = []
-
-    for exp in experiments:
-        # Will always return tracker home on host machine!
-        runs_dir = pathlib.experiment_runs_dir(exp)
-        run_ids.extend(pathlib.get_immediate_subdirectories(runs_dir))
-
-    return [run_id[:8] for run_id in run_ids]
+    # Will always return tracker home on host machine!
+    return [run_id[:8] for run_id in runlib.get_all_run_ids()]
 
 
 def get_all_trials(ctx, args, incomplete):
@@ -59,6 +51,12 @@ def diff_params(fn):
             metavar="[RUN1 [RUN2]]",
             nargs=-1,
             autocompletion=get_all_trials),
+        click.Option(
+            ("-w", "--where"),
+            metavar="EXPR",
+            help=(
+                "Diff the latest two trials matching a filter "
+                "expression when RUN1 and RUN2 are omitted.")),
         click.Option(
             ("-a", "--attrs"),
             is_flag=True,
@@ -105,7 +103,9 @@ def diff(ctx, args):
     """ Diff two runs.
 
         If `RUN1` and `RUN2` are omitted, the latest two runs are
-        diffed.
+        diffed. Use `--where` to diff the latest two runs matching a
+        filter expression (see 'tracker compare --help' for filter
+        syntax).
 
         If `RUN1` or `RUN2` is specified, both must be specified.
 
@@ -136,11 +136,26 @@ def _diff_runs(args):
 
     for path in _diff_paths(args):
         _diff(
-            os.path.join(run1, path),
-            os.path.join(run2, path),
+            _run_diff_path(run1, path),
+            _run_diff_path(run2, path),
             args)
 
 
+def _run_diff_path(run_dir, path):
+    """Returns path in run_dir, using packed attrs where applicable.
+
+    Runs with packed attributes have no per-attribute files so the
+    packed attributes file is diffed instead.
+    """
+    attrs_dir = os.path.join(".tracker", "attrs")
+    packed_attrs = os.path.join(run_dir, ".tracker", runlib.PACKED_ATTRS)
+    if (path.startswith(attrs_dir)
+            and not os.path.exists(os.path.join(run_dir, attrs_dir))
+            and os.path.exists(packed_attrs)):
+        return packed_attrs
+    return os.path.join(run_dir, path)
+
+
 def _diff(path1, path2, args):
     cmd_base = command.shlex_split(_diff_cmd(args))
     cmd = cmd_base + [path1, path2]
@@ -180,8 +195,7 @@ def _diff_paths(args):
 def _maybe_apply_default_runs(args):
     n_runs = len(args.runs)
     if n_runs == 0:
-        raise NotImplementedError
-        # args.run = ("2", "1")
+        args.runs = _latest_two_runs(args.where)
     elif n_runs == 1:
         cli.out(
             "The `diff` command requires two runs.\n"
@@ -198,6 +212,29 @@ def _maybe_apply_default_runs(args):
         assert n_runs == 2, args
 
 
+def _latest_two_runs(where):
+    runs = _candidate_runs(where)
+    if len(runs) < 2:
+        cli.error(
+            "The `diff` command requires two runs but %i %s found."
+            % (len(runs), "was" if len(runs) == 1 else "were"))
+    runs.sort(key=lambda run: run.get("initialized") or 0)
+    return (runs[-2].id, runs[-1].id)
+
+
+def _candidate_runs(where):
+    from tracker import run_filter
+    from tracker.utils import query
+    try:
+        experiments = config.get_project_config().get("experiments")
+    except KeyError:
+        experiments = None
+    try:
+        return run_filter.filter_runs(where, experiments)
+    except query.ParseError as e:
+        cli.error("invalid --where expression %r: %s" % (where, e))
+
+
 def _diff_cmd(args):
     return args.cmd or _config_diff_cmd() or DEFAULT_DIFF_CMD
 
@@ -0,0 +1,26 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Command to manage the run index
+"""
+
+import click
+
+from tracker.utils import click_utils
+
+from .index_rebuild import index_rebuild
+
+
+@click.group(cls=click_utils.Group)
+
+def index():
+    """Manage the index of trials stored in Tracker home.
+    """
+
+
+index.add_command(index_rebuild)
@@ -0,0 +1,36 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Command to rebuild the run index
+"""
+
+import sqlite3
+
+import click
+
+from tracker import run_index
+from tracker.utils import cli
+from tracker.utils import click_utils
+
+
+@click.command("rebuild")
+@click_utils.use_args
+
+def index_rebuild(args):
+    """ Rebuild the run index from the trials on disk.
+
+    The index is updated automatically when trials are started and
+    stopped. Rebuild it if trials have been moved or deleted outside
+    of Tracker.
+    """
+    try:
+        count = run_index.index().rebuild()
+    except sqlite3.Error as e:
+        cli.error("Cannot rebuild run index: %s" % e)
+    else:
+        cli.out("Indexed %i trial(s)" % count)
@@ -17,6 +17,7 @@ from tracker.utils import log
 from tracker.utils import utils
 
 # Custom click commands
+from .attrs import attrs
 from .cd import cd
 from .compare import compare
 from .create import create
@@ -24,12 +25,14 @@ from .diff import diff
 from .experiment import experiment
 from .experiments import experiments
 from .gpus import gpus
+from .index import index
 from .ls import ls
 from .remote import remote
 from .remotes import remotes
 from .rm import rm
 from .run import run
 from .watch import watch
+from .worker import worker
 
 try:
     _home = os.environ["VIRTUAL_ENV"]
@@ -91,6 +94,7 @@ def main(args):
                                      create=True))
 
 
+main.add_command(attrs)
 main.add_command(cd)
 main.add_command(compare)
 main.add_command(create)
@@ -98,9 +102,11 @@ main.add_command(diff)
 main.add_command(experiment)
 main.add_command(experiments)
 main.add_command(gpus)
+main.add_command(index)
 main.add_command(ls)
 main.add_command(remote)
 main.add_command(remotes)
 main.add_command(rm)
 main.add_command(run)
 main.add_command(watch)
+main.add_command(worker)
@@ -11,17 +11,26 @@
 
 import logging
 import os
+import shutil
 
 import click
 
+from tracker import container_pool
+from tracker import early_stopping
 from tracker import operation as oplib
 from tracker import remote as remotelib
+from tracker import run as runlib
+from tracker import run_index
+from tracker import run_queue
+from tracker import scheduler
+from tracker import sweep
 # from tracker import resources
 
 from tracker.utils import cli
 from tracker.utils import click_utils
 from tracker.utils import config
 from tracker.utils import path as pathlib
+from tracker.utils import timestamp
 
 log = logging.getLogger(__name__)
 
@@ -51,11 +60,21 @@ def run_params(fn):
         # click.Option(
         #     ("--no-gpus",), is_flag=True,
         #     help="Disable GPUs for run. Cannot be used with --gpu."),
+        click.Option(
+            ("--queue",), is_flag=True,
+            help=(
+                "Queue trials to be run by 'tracker worker' rather than "
+                "running them.")),
+        click.Option(
+            ("--parallel",), metavar="N", type=int,
+            help=(
+                "Run up to N trials at once. Defaults to one trial per "
+                "device in --gpus, each trial using a single device.")),
         click.Option(
             ("--optimizer",), metavar="ALGORITHM",
             help=(
-                "Optimize the run using the specified algorithm. See "
-                "Optimizing Runs for more information.")),
+                "Choose trials for swept parameters using ALGORITHM: "
+                "grid (default), random or quasi-random.")),
         # click.Option(
         #     ("--optimize",), is_flag=True,
         #     help="Optimize the run using the default optimizer."),
@@ -63,6 +82,11 @@ def run_params(fn):
         #     ("-q", "--quiet",),
         #     help="Do not show output.",
         #     is_flag=True),
+        click.Option(
+            ("--reuse-containers",), is_flag=True,
+            help=(
+                "Run trials with 'docker exec' in containers that are "
+                "kept running across trials.")),
         click.Option(
             ("--run-dir",), metavar="DIR",
             help=(
@@ -74,12 +98,14 @@ def run_params(fn):
         click.Option(
             ("--seed",), metavar="N", type=int,
             help=(
-                "Random seed used when sampling trials or flag values. "
-                "If used with --n-trials all trials will be conducted using "
-                "the same seed.")),
+                "Random seed used when sampling trials. Sweeps with the "
+                "same seed sample the same trials.")),
         click.Option(
             ("--trials",), metavar="N", type=int, default=1,
-            help="Number of trials to conduct on the given experiment."),
+            help=(
+                "Number of trials to conduct on the given experiment. "
+                "For grid search, the number of trials per combination "
+                "of parameter values.")),
     ])
     return fn
 
@@ -94,6 +120,14 @@ def run_params(fn):
 
 def run(ctx, args):
     """Runs an experiment
+
+    Parameters with a list of values or a range (`min` and `max`) in
+    the experiment configuration are swept - a trial is run for each
+    set of values chosen by `--optimizer`. Runs for all trials are
+    created before the first trial starts.
+
+    Operations configured with `early-stopping` stop trials whose
+    metric is worse than that of other trials at the same step.
     """
     # Strip potential operation from experiment name
     exp_name, op_name = _strip_op_name_from_experiment(args)
@@ -115,24 +149,215 @@ def run(ctx, args):
 
     # Load configuration file
     exp_conf = config.load(exp_conf_file)
+    experiment = _op_experiment(exp_name, exp_conf)
 
     # Create operation object
-    op = oplib.Operation(
-        op_name,
-        _op_run_dir(args),
-        _op_experiment(exp_name, exp_conf),
-        _op_remote(args),
-        _op_gpus(args))
+    def init_op(gpus=_op_gpus(args), trial=None, run_dir=None,
+                container=None):
+        return oplib.Operation(
+            op_name,
+            run_dir or _op_run_dir(args),
+            experiment,
+            _op_remote(args),
+            gpus,
+            _trial_parameters(op_name, experiment, trial),
+            container)
+
+    op = init_op()
+
+    # Expand swept parameters into trials
+    try:
+        trials = sweep.trials(
+            op.parameters, args.optimizer, args.trials, args.seed)
+    except sweep.SweepError as e:
+        cli.error(str(e))
+    try:
+        stopper = early_stopping.for_config(
+            op.operation_config.get("early-stopping"))
+    except early_stopping.EarlyStoppingError as e:
+        cli.error(str(e))
 
     # Prompt user to confirm run parameters
-    if args.yes or _confirm_run(args, exp_name, op):
-        for n in range(args.trials):
-            cli.out("Trial {}/{}".format(n + 1, args.trials))
-            # Run the trial
-            _run(args, op)
+    if args.yes or _confirm_run(args, exp_name, op, trials):
+        if args.queue:
+            _queue_trials(args, init_op, trials)
+            return
+        runs = _init_trial_runs(args, op_name, experiment, trials)
+        devices = scheduler.parse_devices(_op_gpus(args))
+        parallel = _trial_parallelism(args, devices, len(trials))
+        _pull_images(args, op, trials)
+        pool = _container_pool(args, op, runs, devices, parallel)
+        monitor = _trial_monitor(stopper, runs)
+        try:
+            if parallel > 1:
+                _run_parallel_trials(
+                    args, init_op, trials, runs, monitor, pool, devices,
+                    parallel)
+                return
+            for n, trial in enumerate(trials):
+                cli.out("Trial {}/{}".format(n + 1, len(trials)))
+                # Run the trial
+                _run_trial(
+                    args, init_op, trial, runs[n], monitor, pool,
+                    _op_gpus(args))
+        finally:
+            if monitor:
+                monitor.close()
+            if pool:
+                pool.close()
+            _remove_unstarted_runs(runs)
+
+
+def _trial_parameters(op_name, experiment, trial):
+    if trial is None:
+        return None
+    return sweep.trial_parameters(
+        experiment["operations"][op_name].get("parameters"), trial)
+
+
+def _init_trial_runs(args, op_name, experiment, trials):
+    """Creates pending runs for trials before starting any of them.
+
+    Returns a list of runs for trials or a list of None if trials
+    aren't run in their own run directories.
+    """
+    if args.run_dir or args.background:
+        return [None] * len(trials)
+    runs_dir = pathlib.experiment_runs_dir(experiment.get("experiment"))
+    runs = []
+    for trial in trials:
+        run_id = runlib.mkid()
+        run = runlib.Run(run_id, os.path.join(runs_dir, run_id))
+        run.init_skeleton()
+        run.write_attr("opdef", op_name)
+        run.write_attr(
+            "parameters", _trial_parameters(op_name, experiment, trial))
+        with open(run.tracker_path(run_queue.PENDING_MARKER), "w") as f:
+            f.write(str(timestamp.timestamp()))
+        runs.append(run)
+    return runs
+
+
+def _run_dir(run):
+    return run.path if run else None
+
+
+def _remove_unstarted_runs(runs):
+    for run in runs:
+        if run and os.path.exists(run.tracker_path(run_queue.PENDING_MARKER)):
+            log.debug("removing unstarted run %s", run.id)
+            shutil.rmtree(run.path, ignore_errors=True)
+            run_index.safe_remove_run(run.id)
+
+
+def _pull_images(args, op, trials):
+    """Pulls missing environment images before starting trials.
+
+    Images are otherwise pulled by each trial that's started before
+    the image is available.
+    """
+    if args.remote or len(trials) < 2:
+        return
+    images = [env.get("image") for env in op.environments if env.get("image")]
+    for image in container_pool.pull_images(images):
+        log.warning("cannot pull image %s", image)
+
+
+def _container_pool(args, op, runs, devices, parallel):
+    if not args.reuse_containers:
+        return None
+    if args.remote or (runs and runs[0] is None):
+        log.warning(
+            "--reuse-containers is not supported with --remote, "
+            "--background or --run-dir, starting a container per trial")
+        return None
+    if len(op.environments) != 1:
+        log.warning(
+            "--reuse-containers requires a single environment, starting "
+            "a container per trial")
+        return None
+    pool = container_pool.ContainerPool(
+        op.environments[0].get("image"), os.path.dirname(runs[0].path))
+    if parallel > 1:
+        gpus = (
+            ["device={}".format(device) for device in devices]
+            or [None] * parallel)
+    else:
+        gpus = [_op_gpus(args)]
+    try:
+        pool.start(gpus)
+    except container_pool.ContainerError as e:
+        log.warning("%s, starting a container per trial", e)
+        pool.close()
+        return None
+    return pool
+
+
+def _trial_monitor(stopper, runs):
+    if stopper is None:
+        return None
+    if runs and runs[0] is None:
+        log.warning(
+            "early-stopping is not supported with --background or "
+            "--run-dir, trials will not be stopped early")
+        return None
+
+    def on_stop(run, stop):
+        cli.out(
+            "Stopping run {}: {} {} is worse than {} at step {}".format(
+                run.short_id, stopper.metric, stop.value, stop.cutoff,
+                stop.step))
+
+    return early_stopping.TrialMonitor(stopper, on_stop)
+
+
+def _queue_trials(args, init_op, trials):
+    for n, trial in enumerate(trials):
+        run = init_op(trial=trial).stage(_run_cmd(args))
+        run_queue.enqueue(run)
+        cli.out("Queued trial {}/{} as run {}".format(
+            n + 1, len(trials), run.short_id))
+    cli.out("Use 'tracker worker' to run queued trials")
+
+
+def _run_trial(args, init_op, trial, run, monitor, pool, gpus):
+    if pool is None:
+        op = init_op(gpus, trial=trial, run_dir=_run_dir(run))
+        return _run(args, op, run, monitor)
+    try:
+        container = pool.acquire(gpus)
+    except container_pool.ContainerError as e:
+        log.warning("%s, starting a container for the trial", e)
+        return _run_trial(args, init_op, trial, run, monitor, None, gpus)
+    exit_status = None
+    try:
+        op = init_op(
+            gpus, trial=trial, run_dir=_run_dir(run), container=container)
+        exit_status = _run(args, op, run, monitor)
+        return exit_status
+    finally:
+        # The processes of stopped trials may still be running and
+        # failed trials may leave the container in an unknown state
+        pool.release(container, gpus, reuse=exit_status == 0)
+
+
+def _run(args, op, run=None, monitor=None):
+    if monitor is None:
+        return op.run(
+            _run_cmd(args),
+            _op_pidfile(args)
+        )
+    monitor.watch(run, op.stop)
+    try:
+        return op.run(
+            _run_cmd(args),
+            _op_pidfile(args)
+        )
+    finally:
+        monitor.unwatch(run)
 
 
-def _run(args, op):
+def _run_cmd(args):
     cmd = ""
 
     if args.gpus:
@@ -148,11 +373,59 @@ def _run(args, op):
     cmd += "docker run"
     # else:
     #    cmd += DEFAULT_EXE
+    return cmd
 
-    op.run(
-        cmd,
-        _op_pidfile(args)
-    )
+
+def _trial_parallelism(args, devices, trials):
+    if trials < 2:
+        return 1
+    if args.background or args.run_dir:
+        if args.parallel:
+            log.warning(
+                "--parallel is not supported with --background or "
+                "--run-dir, running trials one at a time")
+        return 1
+    return min(args.parallel or len(devices) or 1, trials)
+
+
+def _run_parallel_trials(args, init_op, trials, runs, monitor, pool,
+                         devices, parallel):
+    """Runs trials concurrently, each on its own device if any.
+
+    Devices are shared with other Tracker processes through
+    `scheduler.DeviceSlots`.
+    """
+    slots = scheduler.DeviceSlots(devices) if devices else None
+    cli.out(
+        "Running {} trials, up to {} at a time{}".format(
+            len(trials), parallel,
+            " on devices {}".format(", ".join(devices)) if devices else ""))
+
+    def run_trial(n, device):
+        if device is None:
+            gpus = _op_gpus(args)
+            cli.out("Trial {}/{}".format(n + 1, len(trials)))
+        else:
+            gpus = "device={}".format(device)
+            cli.out("Trial {}/{} (device {})".format(
+                n + 1, len(trials), device))
+        return _run_trial(
+            args, init_op, trials[n], runs[n], monitor, pool, gpus)
+
+    results = scheduler.TrialScheduler(run_trial, parallel, slots).run(
+        range(len(trials)))
+    failed = [
+        exit_status for exit_status, run in zip(results, runs)
+        if exit_status and not _stopped_early(run)
+    ]
+    if failed:
+        cli.error(
+            "{} of {} trials failed".format(len(failed), len(trials)),
+            exit_status=failed[0])
+
+
+def _stopped_early(run):
+    return run is not None and run.has_attr("early_stopped")
 
 
 def _strip_op_name_from_experiment(args):
@@ -239,13 +512,13 @@ def _op_gpus(args):
 """
 
 
-def _confirm_run(args, exp_name, op):
+def _confirm_run(args, exp_name, op, trials):
     prompt = (
         "You are about to run {trials}{exp_name}{op_name}{remote_suffix}\n"
         "{parameters}"
         "Continue?"
         .format(
-            trials=_format_trials(args),
+            trials=_format_trials(args, op, trials),
             exp_name=exp_name,
             op_name=_format_operation(op),
             remote_suffix=_format_remote_suffix(args),
@@ -254,9 +527,12 @@ def _confirm_run(args, exp_name, op):
     return cli.confirm(prompt, default=True)
 
 
-def _format_trials(args):
-    if args.trials > 1:
-        return "{} trials of ".format(args.trials)
+def _format_trials(args, op, trials):
+    if sweep.is_sweep(op.parameters):
+        return "{} trials ({}) of ".format(
+            len(trials), sweep.optimizer_for_name(args.optimizer))
+    elif len(trials) > 1:
+        return "{} trials of ".format(len(trials))
     else:
         return ""
 
@@ -272,7 +548,7 @@ def _format_parameters(parameters):
     return "\n".join([
         "   {}: {}".format(
             p,
-            parameters[p].get("value"))
+            sweep.describe(p, parameters[p]))
         for p in sorted(parameters)
     ]) + "\n"
 
@@ -12,15 +12,17 @@
 import logging
 import os
 import sys
-import time
 
 import click
 import psutil
 
 from tracker import run as runlib
+from tracker import run_changes
 from tracker.utils import cli
 from tracker.utils import click_utils
+from tracker.utils import config
 from tracker.utils import path as pathlib
+from tracker.utils import tail
 from tracker.utils import utils
 
 log = logging.getLogger(__name__)
@@ -33,6 +35,14 @@ log = logging.getLogger(__name__)
     help=("Watch the run associated with the specified process. "
           "PID may be a process ID or a path to a file containing "
           "a process ID."))
+@click.option(
+    "-e", "--experiment", "experiments", metavar="EXPERIMENT",
+    multiple=True,
+    help=("Watch running trials of EXPERIMENT. May be used multiple "
+          "times."))
+@click.option(
+    "-w", "--where", metavar="EXPR",
+    help="Watch running trials matching a filter expression.")
 @click.pass_context
 @click_utils.use_args
 
@@ -48,8 +58,21 @@ def watch(ctx, args):
     You may alternatively specify the process ID of the run to watch,
     using `--pid`. ``PID`` may be a process ID or a path to a file
     containing a process ID.
+
+    ### Watch Many Runs:
+
+    Use `--experiment` or `--where` to watch all running trials of an
+    experiment or all running trials matching a filter expression (see
+    'tracker compare --help' for filter syntax). Output lines are
+    prefixed with the short ID of their run. Trials that start while
+    watching are watched as well, until the command is stopped with
+    ``Ctrl-C``.
     """
 
+    if args.experiments or args.where:
+        _watch_runs(args)
+        return
+
     if not args.pid:
         raise NotImplementedError(
             "We currently have no idea how to determine which "
@@ -95,14 +118,18 @@ def _run_for_pid(pid):
     if pid is None:
         return None
 
-    for exp in os.listdir(pathlib.path("experiments")):
-        experiment_dir = os.path.join(pathlib.path("experiments"), exp)
+    run = runlib.RunStatusResolver().run_for_pid(_iter_runs(), pid)
+    if run is None:
+        cli.error("cannot find run for pid %i" % pid)
+        # See list of processes: $ ps -aef --forest
+    return run
+
+
+def _iter_runs():
+    experiments_dir = pathlib.path("experiments")
+    for _exp, experiment_dir in pathlib.iter_dirs(experiments_dir):
         for run_id, run_dir in pathlib.iter_dirs(experiment_dir):
-            run = runlib.Run(run_id, run_dir)
-            if run.pid and (run.pid == pid or _parent_pid(run.pid) == pid):
-                return run
-    cli.error("cannot find run for pid %i" % pid)
-    # See list of processes: $ ps -aef --forest
+            yield runlib.Run(run_id, run_dir)
 
 
 def _try_int(pid):
@@ -112,15 +139,6 @@ def _try_int(pid):
         return None
 
 
-def _parent_pid(pid):
-    try:
-        p = psutil.Process(pid)
-    except psutil.NoSuchProcess:
-        return None
-    else:
-        return p.parent().pid
-
-
 def _watch_run(run):
     try:
         _tail(run)
@@ -139,45 +157,7 @@ def _stopped_msg(run):
 def _tail(run):
     if os.getenv("NO_WATCHING_MSG") != "1":
         cli.out("Watching run %s (pid: %s)" % (run.id, run.pid), err=True)
-    if run.pid is None:
-        _print_output(run)
-        return
-    proc = psutil.Process(run.pid)
-    output_path = run.tracker_path("output")
-    f = None
-    while proc.is_running():
-        f = f or _try_open(output_path)
-        if not f:
-            time.sleep(1.0)
-            continue
-        line = f.readline()
-        if not line:
-            time.sleep(0.1)
-            continue
-        sys.stdout.write(line)
-        sys.stdout.flush()
-
-
-def _print_output(run):
-    output_path = run.tracker_path("output")
-    f = _try_open(output_path)
-    if not f:
-        return
-    while True:
-        line = f.readline()
-        if not line:
-            break
-        sys.stdout.write(line)
-        sys.stdout.flush()
-
-
-def _try_open(path):
-    try:
-        return open(path, "r")
-    except OSError as e:
-        if e.errno != 2:
-            raise
-        return None
+    tail.follow(run.tracker_path("output"), run.pid, sys.stdout)
 
 
 def _print_run_status(run):
@@ -189,3 +169,119 @@ def _print_run_status(run):
 def _handle_no_run_for_pid_arg(pid_arg):
     # Assume pid_arg is a pidfile path.
     cli.error("%s does not exist" % pid_arg)
+
+
+###################################################################
+# Watch many runs
+###################################################################
+
+# Seconds between checks for started runs
+RUN_CHECK_INTERVAL = 1.0
+
+
+def _watch_runs(args):
+    expr = _parse_where(args.where)
+    watcher = RunsWatcher(
+        list(args.experiments) or _project_experiments(), expr)
+    try:
+        while True:
+            watcher.poll(RUN_CHECK_INTERVAL)
+    except KeyboardInterrupt:
+        cli.out(
+            "\nStopped watching %i run(s)" % len(watcher.tailer),
+            err=True)
+    finally:
+        watcher.close()
+
+
+def _parse_where(where):
+    from tracker import run_filter
+    from tracker.utils import query
+    if not where:
+        return None
+    try:
+        return run_filter.parse(where)
+    except query.ParseError as e:
+        cli.error("invalid --where expression %r: %s" % (where, e))
+
+
+def _project_experiments():
+    try:
+        return config.get_project_config().get("experiments")
+    except KeyError:
+        return None
+
+
+class RunsWatcher(object):
+    """Follows the output of running runs in a single process.
+
+    Runs are watched when they're running and match the filter
+    expression `expr`, if specified. Runs that start after the watcher
+    is created are watched when they're detected by `poll`. Output is
+    written to `out` a line at a time, each line prefixed with the
+    short ID of its run.
+    """
+
+    def __init__(self, experiments=None, expr=None, out=None):
+        self.expr = expr
+        self.out = out or sys.stdout
+        self.tailer = tail.Tailer()
+        self._changes = run_changes.RunChangeDetector(experiments)
+        self._runs = {}
+        self._partial_lines = {}
+        self._done = set()
+        self._attach(self._changes.runs())
+
+    def poll(self, timeout=None):
+        """Writes available output, waiting up to timeout seconds."""
+        for run_dir, text, done in self.tailer.poll(timeout):
+            run = self._runs[run_dir]
+            self._write_lines(run, text, done)
+            if done:
+                self._done.add(run_dir)
+                del self._runs[run_dir]
+                _print_run_status(run)
+        changes = self._changes.changes()
+        self._attach(changes.added | changes.modified)
+
+    def _attach(self, run_dirs):
+        # Processes are read once per batch rather than per run
+        resolver = runlib.RunStatusResolver()
+        for run_dir in sorted(run_dirs):
+            if run_dir in self._runs or run_dir in self._done:
+                continue
+            run = runlib.Run(os.path.basename(run_dir), run_dir)
+            if not self._should_watch(run, resolver):
+                continue
+            log.debug("watching run %s (pid %s)", run.id, run.pid)
+            cli.out(
+                "Watching run %s (pid: %s)" % (run.short_id, run.pid),
+                err=True)
+            self._runs[run_dir] = run
+            self.tailer.add(run_dir, run.tracker_path("output"), run.pid)
+
+    def _should_watch(self, run, resolver):
+        if run.pid is None or resolver.status(run) != "running":
+            return False
+        if self.expr is None:
+            return True
+        from tracker import run_filter
+        return run_filter.match(self.expr, run, resolver)
+
+    def _write_lines(self, run, text, done):
+        buf = self._partial_lines.pop(run.path, "") + text
+        lines = buf.split("\n")
+        partial = lines.pop()
+        if partial and done:
+            lines.append(partial)
+        elif partial:
+            self._partial_lines[run.path] = partial
+        if lines:
+            prefix = "%s | " % run.short_id
+            self.out.write("".join(
+                prefix + line + "\n" for line in lines))
+            self.out.flush()
+
+    def close(self):
+        self.tailer.close()
+        self._changes.close()
@@ -0,0 +1,207 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Command to run queued trials
+"""
+
+import json
+import logging
+import os
+import threading
+
+import click
+
+from tracker import early_stopping
+from tracker import operation as oplib
+from tracker import run_index
+from tracker import run_queue
+from tracker import scheduler
+from tracker.utils import cli
+from tracker.utils import click_utils
+from tracker.utils import timestamp
+
+log = logging.getLogger(__name__)
+
+# Seconds between checks for queued trials when the queue is empty
+POLL_INTERVAL = 1.0
+
+
+@click.command("worker")
+@click.option(
+    "--parallel", metavar="N", type=int, default=1,
+    help="Run up to N queued trials at once.")
+@click.option(
+    "--stop-when-empty", is_flag=True,
+    help="Exit when there are no queued trials.")
+@click.pass_context
+@click_utils.use_args
+
+def worker(ctx, args):
+    """Run queued trials.
+
+    Trials queued with 'tracker run --queue' are run in the order they
+    were queued. Any number of workers may run at once - each queued
+    trial is run by exactly one worker. Trials queued with `--gpus` are
+    each run on one of their devices, which are shared with other
+    workers and with 'tracker run --parallel'.
+
+    Workers run until stopped with ``Ctrl-C`` unless
+    `--stop-when-empty` is used. Trials claimed by workers that exited
+    before starting them are queued again when a worker starts.
+    """
+    requeued = run_queue.recover()
+    if requeued:
+        cli.out("Requeued %i trial(s) from stopped workers" % requeued)
+    stop = threading.Event()
+    shared = _Shared()
+    threads = [
+        threading.Thread(
+            target=_work, args=(args, stop, shared), name="worker-%i" % i)
+        for i in range(max(1, args.parallel))
+    ]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        stop.set()
+        cli.out("\nStopping worker once running trials exit", err=True)
+        for t in threads:
+            t.join()
+    finally:
+        shared.close()
+
+
+class _Shared(object):
+    """Device slots and early stopping monitors of worker threads.
+
+    Trials staged with the same devices share slots, and trials of the
+    same experiment operation share a monitor, as trials run by
+    'tracker run' do.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._monitors = {}
+
+    def slots(self, run):
+        devices = tuple(scheduler.parse_devices(run.get("gpus")))
+        if not devices:
+            return None
+        with self._lock:
+            if devices not in self._slots:
+                self._slots[devices] = scheduler.DeviceSlots(devices)
+            return self._slots[devices]
+
+    def monitor(self, run):
+        config = run.get("opconfig", {}).get("early-stopping")
+        try:
+            stopper = early_stopping.for_config(config)
+        except early_stopping.EarlyStoppingError as e:
+            log.warning(
+                "trial %s will not be stopped early: %s", run.short_id, e)
+            return None
+        if stopper is None:
+            return None
+        key = (
+            os.path.dirname(run.path),
+            run.get("opdef"),
+            json.dumps(config, sort_keys=True))
+        with self._lock:
+            if key not in self._monitors:
+                self._monitors[key] = early_stopping.TrialMonitor(
+                    stopper, _on_stop(stopper))
+            return self._monitors[key]
+
+    def close(self):
+        with self._lock:
+            monitors = list(self._monitors.values())
+            self._monitors.clear()
+        for monitor in monitors:
+            monitor.close()
+
+
+def _on_stop(stopper):
+    def on_stop(run, stop):
+        cli.out(
+            "Stopping run {}: {} {} is worse than {} at step {}".format(
+                run.short_id, stopper.metric, stop.value, stop.cutoff,
+                stop.step))
+    return on_stop
+
+
+def _work(args, stop, shared):
+    while not stop.is_set():
+        claim = run_queue.claim()
+        if claim is None:
+            if args.stop_when_empty:
+                return
+            stop.wait(POLL_INTERVAL)
+            continue
+        slots = shared.slots(claim.run)
+        device = _acquire_device(slots, stop) if slots else None
+        if slots and device is None:
+            run_queue.release(claim)
+            return
+        try:
+            _run_claimed(claim.run, device, shared)
+        finally:
+            if device is not None:
+                slots.release(device)
+            run_queue.complete(claim)
+
+
+def _acquire_device(slots, stop):
+    """Returns a device from slots or None if stop is set first."""
+    while not stop.is_set():
+        device = slots.acquire(POLL_INTERVAL)
+        if device is not None:
+            return device
+    return None
+
+
+def _run_claimed(run, device, shared):
+    if device is None:
+        cli.out("Running queued trial %s" % run.short_id)
+        gpus = None
+    else:
+        cli.out("Running queued trial %s (device %s)" % (
+            run.short_id, device))
+        gpus = "device={}".format(device)
+    try:
+        op = oplib.Operation.for_staged_run(run, gpus)
+        monitor = shared.monitor(run)
+        if monitor:
+            monitor.watch(run, op.stop)
+        try:
+            exit_status = op.run_staged()
+        finally:
+            if monitor:
+                monitor.unwatch(run)
+    except Exception as e:
+        log.error("trial %s failed to start: %s", run.short_id, e)
+        _fail_run(run)
+    else:
+        cli.out(
+            "Queued trial %s exited with status %s"
+            % (run.short_id, exit_status))
+
+
+def _fail_run(run):
+    stopped = timestamp.timestamp()
+    run.write_attr("exit_status", 1)
+    run.write_attr("stopped", stopped)
+    run_index.safe_update_run(run, exit_status=1, stopped=stopped)
+    try:
+        os.remove(run.tracker_path("LOCK"))
+    except OSError:
+        pass
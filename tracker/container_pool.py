@@ -0,0 +1,194 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Warm docker containers for running trials
+
+A `ContainerPool` keeps idle containers of an image running so that
+trials are run with `docker exec` rather than paying for container
+creation and startup per trial. Containers are started with the
+directory containing trial runs bind-mounted at `POOL_MOUNT`, so each
+trial runs in its own fresh source code copy, which it sees at
+`workdir(run)`. Containers run as the user and group of the Tracker
+process, so files written by trials are owned by the user rather than
+by the image's default user, which is often root.
+
+Containers are reused by later trials unless a trial fails or is
+stopped, in which case its container is removed - `docker exec`
+doesn't forward signals to the process it runs, and a failed trial may
+leave its container in an unknown state. Containers are removed when the pool
+is closed.
+"""
+
+import collections
+import logging
+import os
+import posixpath
+import subprocess
+import threading
+
+from concurrent import futures
+
+log = logging.getLogger(__name__)
+
+DOCKER = "docker"
+
+POOL_MOUNT = "/runs"
+
+# Command run by idle containers - available in most images
+IDLE_CMD = ("tail", "-f", "/dev/null")
+
+LABEL = "tracker.pool"
+
+# Output is read from pipes, which Python block-buffers by default -
+# run processes unbuffered so output is captured as it's written
+ENV_ARGS = "-e PYTHONUNBUFFERED=1"
+
+
+class ContainerError(Exception):
+    pass
+
+
+class ContainerPool(object):
+    """Idle containers of an image for running trials.
+
+    `mount_dir` is the host directory containing trial runs.
+    Containers are created as needed for each `gpus` value - a
+    `--gpus` docker option value or None.
+    """
+
+    def __init__(self, image, mount_dir, docker=DOCKER):
+        self.image = image
+        self.mount_dir = mount_dir
+        self.docker = docker
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)
+        self._containers = set()
+
+    def start(self, gpus_list):
+        """Starts a container for each item in gpus_list concurrently.
+
+        Containers are released to the pool once started.
+        """
+        if not gpus_list:
+            return
+        with futures.ThreadPoolExecutor(
+                max_workers=len(gpus_list)) as pool:
+            started = list(pool.map(self._create, gpus_list))
+        for gpus, container in zip(gpus_list, started):
+            self.release(container, gpus)
+
+    def acquire(self, gpus=None):
+        """Returns an idle container, starting one as needed."""
+        with self._lock:
+            idle = self._idle[gpus]
+            if idle:
+                return idle.pop()
+        return self._create(gpus)
+
+    def release(self, container, gpus=None, reuse=True):
+        """Returns container to the pool or removes it.
+
+        Containers that may still be running a trial process must not
+        be reused.
+        """
+        if reuse:
+            with self._lock:
+                self._idle[gpus].append(container)
+        else:
+            self._remove(container)
+
+    def _create(self, gpus):
+        args = [
+            self.docker, "run", "-d", "--rm",
+            "--label", LABEL,
+            "--user", "%i:%i" % (os.getuid(), os.getgid()),
+            "-v", "{}:{}".format(self.mount_dir, POOL_MOUNT),
+            "--entrypoint", IDLE_CMD[0],
+        ]
+        if gpus:
+            args.extend(["--gpus", gpus])
+        args.append(self.image)
+        args.extend(IDLE_CMD[1:])
+        log.debug("starting container: %s", args)
+        try:
+            out = subprocess.check_output(args)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise ContainerError(
+                "cannot start container for %s: %s" % (self.image, e))
+        container = out.decode("utf-8").strip().splitlines()[-1]
+        with self._lock:
+            self._containers.add(container)
+        return container
+
+    def _remove(self, container):
+        with self._lock:
+            self._containers.discard(container)
+        log.debug("removing container %s", container)
+        _docker_quiet([self.docker, "rm", "-f", container])
+
+    def close(self):
+        with self._lock:
+            containers = sorted(self._containers)
+            self._containers.clear()
+            self._idle.clear()
+        if containers:
+            _docker_quiet([self.docker, "rm", "-f"] + containers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+def workdir(run):
+    """Returns the source code dir of run in pool containers."""
+    return posixpath.join(POOL_MOUNT, run.id, ".tracker", "sourcecode")
+
+
+def exec_cmd(container, run, cmd, docker=DOCKER):
+    return "{docker} exec {env_args} -w {workdir} {container} {cmd}".format(
+        docker=docker,
+        env_args=ENV_ARGS,
+        workdir=workdir(run),
+        container=container,
+        cmd=cmd)
+
+
+def pull_images(images, docker=DOCKER):
+    """Pulls images that aren't available locally concurrently.
+
+    Returns a list of images that couldn't be pulled.
+    """
+    missing = [
+        image for image in sorted(set(images))
+        if not _image_exists(image, docker)
+    ]
+    if not missing:
+        return []
+    log.info("Pulling %s", ", ".join(missing))
+    with futures.ThreadPoolExecutor(max_workers=len(missing)) as pool:
+        pulled = list(pool.map(
+            lambda image: _docker_quiet([docker, "pull", image]), missing))
+    return [image for image, ok in zip(missing, pulled) if not ok]
+
+
+def _image_exists(image, docker):
+    return _docker_quiet([docker, "image", "inspect", image])
+
+
+def _docker_quiet(args):
+    try:
+        subprocess.check_call(
+            args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        log.debug("cannot run %s: %s", args[0], e)
+        return False
+    except subprocess.CalledProcessError:
+        return False
+    return True
@@ -0,0 +1,326 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Stop trials that perform poorly compared to other trials
+
+Early stopping is configured for an experiment operation with a metric
+logged as an output scalar:
+
+    early-stopping:
+      metric: loss                 # scalar key, [PREFIX#]TAG
+      mode: min                    # or max
+      method: successive-halving   # or median
+      min-step: 1
+      reduction-factor: 3
+      min-trials: 3
+
+Trials are compared at rungs - steps `min-step * reduction-factor ** k`
+for k = 0, 1, ... When a trial reaches a rung, its best metric value
+logged at or before the rung step is recorded (or its first value if
+none was), and it's stopped if the value is worse than the cutoff for
+the rung. The cutoff is computed from the values recorded
+at the rung by every trial so far, so trials are never held back
+waiting for others (asynchronous successive halving):
+
+- `successive-halving` keeps the best `1 / reduction-factor` of trials
+  at each rung
+- `median` keeps trials that are at least as good as the median
+
+Trials aren't stopped at a rung until `min-trials` trials have reached
+it. Steps are the steps scalars are logged at - for runs that don't
+log steps, the number of logged metric values.
+
+`TrialMonitor` reads the metric values that running trials log and
+stops trials as they reach rungs. Values are read from scalar logs and
+TensorFlow event files as with `utils.scalarcache`.
+"""
+
+import collections
+import logging
+import threading
+
+from tracker.utils import scalarcache
+from tracker.utils import scalarlog
+from tracker.utils import tfevent
+
+log = logging.getLogger(__name__)
+
+SUCCESSIVE_HALVING = "successive-halving"
+MEDIAN = "median"
+
+METHODS = (SUCCESSIVE_HALVING, MEDIAN)
+
+MODES = ("min", "max")
+
+DEFAULT_REDUCTION_FACTOR = 3
+
+# Seconds between checks of running trial scalars
+CHECK_INTERVAL = 5.0
+
+Stop = collections.namedtuple("Stop", ["step", "value", "cutoff"])
+
+
+class EarlyStoppingError(ValueError):
+    pass
+
+
+class RungStopper(object):
+    """Decides which trials to stop at rungs."""
+
+    def __init__(self, metric, mode="min", method=SUCCESSIVE_HALVING,
+                 min_step=1, reduction_factor=DEFAULT_REDUCTION_FACTOR,
+                 min_trials=None):
+        self.metric = metric
+        self.mode = mode
+        self.method = method
+        self.min_step = min_step
+        self.reduction_factor = reduction_factor
+        self.min_trials = (
+            min_trials if min_trials is not None else reduction_factor)
+        if method == MEDIAN:
+            self.keep = 0.5
+        else:
+            self.keep = 1.0 / reduction_factor
+        # Rung steps to values recorded at the rung, lower is better
+        self._rungs = collections.defaultdict(list)
+        # Trial keys to the number of rungs they've reached
+        self._reached = {}
+        # Trial keys to their best scores so far
+        self._best = {}
+
+    def rung_step(self, rung):
+        return self.min_step * self.reduction_factor ** rung
+
+    def report(self, key, step, value):
+        """Reports the value of trial key at step.
+
+        Returns a `Stop` if the trial should be stopped or None.
+        """
+        return self.report_values(key, [(step, value)])
+
+    def report_values(self, key, values):
+        """Reports values logged by trial key since its last report.
+
+        `values` is a list of (step, value) in logged order. Each rung
+        the trial reaches is recorded with the best value logged at or
+        before the rung step, or with its first value for rungs before
+        it. Returns a `Stop` if the trial should be stopped or None.
+        """
+        if not values:
+            return None
+        for step, value in values:
+            score = value if self.mode == "min" else -value
+            if key not in self._best:
+                # Rungs before a trial's first value are recorded with
+                # that value
+                self._best[key] = score
+                continue
+            # Values logged after a rung step close the rung
+            stop = self._record_rungs(key, step, inclusive=False)
+            if stop:
+                return stop
+            self._best[key] = min(self._best[key], score)
+        return self._record_rungs(key, values[-1][0], inclusive=True)
+
+    def _record_rungs(self, key, step, inclusive):
+        rung = self._reached.get(key, 0)
+        while (step >= self.rung_step(rung) if inclusive
+               else step > self.rung_step(rung)):
+            rung_step = self.rung_step(rung)
+            rung += 1
+            self._reached[key] = rung
+            score = self._best[key]
+            recorded = self._rungs[rung_step]
+            recorded.append(score)
+            if len(recorded) < self.min_trials:
+                continue
+            cutoff = _quantile(sorted(recorded), self.keep)
+            if score > cutoff:
+                sign = 1 if self.mode == "min" else -1
+                return Stop(rung_step, sign * score, sign * cutoff)
+        return None
+
+
+def _quantile(sorted_vals, q):
+    pos = (len(sorted_vals) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (pos - lo)
+
+
+def for_config(config):
+    """Returns a `RungStopper` for an `early-stopping` config.
+
+    Returns None if config is empty.
+    """
+    if not config:
+        return None
+    if not isinstance(config, dict):
+        raise EarlyStoppingError("early-stopping must be a mapping")
+    metric = config.get("metric")
+    if not metric:
+        raise EarlyStoppingError("early-stopping requires a metric")
+    mode = config.get("mode", "min")
+    if mode not in MODES:
+        raise EarlyStoppingError(
+            "early-stopping mode must be min or max (got '%s')" % mode)
+    method = config.get("method", SUCCESSIVE_HALVING)
+    if method not in METHODS:
+        raise EarlyStoppingError(
+            "early-stopping method must be %s (got '%s')"
+            % (" or ".join(METHODS), method))
+    min_step = _positive_int(config, "min-step", 1)
+    reduction_factor = _positive_int(
+        config, "reduction-factor", DEFAULT_REDUCTION_FACTOR)
+    if reduction_factor < 2:
+        raise EarlyStoppingError(
+            "early-stopping reduction-factor must be at least 2")
+    min_trials = config.get("min-trials")
+    if min_trials is not None:
+        min_trials = _positive_int(config, "min-trials", None)
+    return RungStopper(
+        str(metric), mode, method, min_step, reduction_factor, min_trials)
+
+
+def _positive_int(config, name, default):
+    val = config.get(name, default)
+    if isinstance(val, bool) or not isinstance(val, int) or val < 1:
+        raise EarlyStoppingError(
+            "early-stopping %s must be a positive integer" % name)
+    return val
+
+
+class TrialMonitor(object):
+    """Stops running trials using a `RungStopper`.
+
+    Trials are watched with `watch` while they run. `stop` is called
+    with no arguments from a monitor thread to stop a trial, and
+    `on_stop` (if given) with the trial run and a `Stop`.
+    """
+
+    def __init__(self, stopper, on_stop=None, interval=CHECK_INTERVAL):
+        self.stopper = stopper
+        self.on_stop = on_stop
+        self.interval = interval
+        self._trials = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="trial-monitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def watch(self, run, stop):
+        series = _MetricSeries(run.path, self.stopper.metric)
+        with self._lock:
+            self._trials[run.id] = (run, stop, series)
+
+    def unwatch(self, run):
+        with self._lock:
+            self._trials.pop(run.id, None)
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                log.exception("checking trials for early stopping")
+
+    def check(self):
+        """Stops trials that have reached a rung and perform poorly."""
+        with self._lock:
+            trials = list(self._trials.values())
+        for run, stop, series in trials:
+            result = self.stopper.report_values(run.id, series.read())
+            if result is None:
+                continue
+            self.unwatch(run)
+            run.write_attr("early_stopped", {
+                "metric": self.stopper.metric,
+                "step": result.step,
+                "value": result.value,
+                "cutoff": result.cutoff,
+            })
+            if self.on_stop:
+                self.on_stop(run, result)
+            # Stopping waits for the process to exit
+            t = threading.Thread(target=stop, name="stop-%s" % run.short_id)
+            t.daemon = True
+            t.start()
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+
+
+class _MetricSeries(object):
+    """Reads values of a metric logged by a run.
+
+    `key` is a scalar key in the form `[PREFIX#]TAG`. Without a prefix,
+    values are read from the first prefix (in the order of
+    `scalarcache` lookups) the tag is logged in. Values logged without
+    steps are numbered in the order they're logged, from 1.
+    """
+
+    def __init__(self, run_dir, key):
+        self.run_dir = run_dir
+        self.prefix, self.tag = scalarcache.split_key(key)
+        # Read state by source prefix
+        self._sources = {}
+        self._count = 0
+
+    def read(self):
+        """Returns a list of (step, value) logged since the last read."""
+        values = {}
+        for prefix, dir, kind in scalarcache._iter_sources(self.run_dir):
+            if self.prefix is not None and prefix != self.prefix:
+                continue
+            state = self._sources.setdefault(prefix, {"kind": kind})
+            if state["kind"] != kind:
+                continue
+            values[prefix] = _SOURCE_READERS[kind](dir, state, self.tag)
+        if self.prefix is None:
+            logged = sorted(prefix for prefix in values if values[prefix])
+            if not logged:
+                return []
+            self.prefix = logged[0]
+        result = []
+        for step, value in values.get(self.prefix, []):
+            self._count += 1
+            result.append((step or self._count, value))
+        return result
+
+
+def _read_scalar_log(dir, state, tag):
+    reader = scalarlog.ScalarLogReader(dir)
+    start = state.get("records", 0)
+    records = reader.records(start)
+    state["records"] = start + len(records)
+    tags = reader.tags()
+    if not len(records) or tag not in tags:
+        return []
+    logged = records[records["tag"] == tags.index(tag)]
+    return [
+        (int(step), float(value))
+        for step, value in zip(logged["step"], logged["value"])
+    ]
+
+
+def _read_tfevents(dir, state, tag):
+    reader = tfevent.IncrementalScalarReader(
+        dir, state=state.setdefault("files", {}))
+    return [
+        (step, val) for logged_tag, val, step in reader.poll()
+        if logged_tag == tag
+    ]
+
+
+_SOURCE_READERS = {
+    "scalars": _read_scalar_log,
+    "tfevents": _read_tfevents,
+}
@@ -6,6 +6,7 @@
 
 # -*- coding: utf-8 -*-
 
+import functools
 import logging
 import os
 import subprocess
@@ -16,10 +17,16 @@ import time
 import ruamel.yaml as yaml
 
 # from tracker import parameters
+from tracker import container_pool
 from tracker import resources
 from tracker import run
+from tracker import run_index
+from tracker import run_output
+from tracker import run_queue
 # from tracker.utils import cli
+from tracker.utils import blobs
 from tracker.utils import command
+from tracker.utils import config
 from tracker.utils import exit_code
 from tracker.utils import file as filelib
 from tracker.utils import path as pathlib
@@ -31,8 +38,12 @@ log = logging.getLogger(__name__)
 
 PROC_TERM_TIMEOUT_SECONDS = 30
 
+OUTPUT_CLOSE_TIMEOUT_SECONDS = 5
+
 DEFAULT_DOCKER_COMPOSE_V = "3.7"
 
+DEFAULT_SOURCECODE_DIGEST = "md5"
+
 # DEFAULT_EXEC = "{python} -um tracker.operation_main {main}"
 
 
@@ -56,13 +67,17 @@ class Operation():
                  run_dir=None,
                  exp_conf=None,
                  remote=None,
-                 gpus=None):
+                 gpus=None,
+                 parameters=None,
+                 container=None):
         self.name = name
         self._run_dir = run_dir
         self.experiment_config = exp_conf or {}
         self.operation_config = self._get_operation_config()
         self.environments = self._get_environtment_config()
-        self.parameters = self._get_parameter_config()
+        self.parameters = (
+            parameters if parameters is not None
+            else self._get_parameter_config())
         self.resources = self._get_resource_config()
         self.remote = remote or None
         self.remote_run_dir = None
@@ -70,11 +85,15 @@ class Operation():
         self.cmd = None
         self.run_cmd = None
         self._gpus = gpus
+        self._container = container
         self._started = None
         self._stopped = None
         self._run = None
         self._proc = None
+        self._output = None
         self._exit_status = None
+        self._stop_requested = False
+        self._sourcecode_files = None
 
     @property
     def run_dir(self):
@@ -105,6 +124,63 @@ class Operation():
         finally:
             self._cleanup()
 
+    def stage(self, cmd):
+        """Initializes a run to be started later with `run_staged`.
+
+        The run command is saved in the run `cmd` attribute and the
+        operation config, with the run's parameters, in `opconfig`.
+        Local runs with GPUs also save `cmd` as `base_cmd` and the
+        requested devices as `gpus`, so that the run can be started on
+        a device assigned when it's run. Returns the staged run.
+        """
+        assert self.cmd is None
+        self._validate_executables()
+        self._init_cmd(cmd)
+        self._init_run(self._run_dir)
+        try:
+            self._run.write_attr("cmd", self.cmd)
+            self._run.write_attr("opconfig", self._staged_config())
+            if self._gpus and not self.remote:
+                self._run.write_attr("base_cmd", cmd)
+                self._run.write_attr("gpus", self._gpus)
+            return self._run
+        finally:
+            self._cleanup()
+
+    def _staged_config(self):
+        config = dict(self.operation_config)
+        config["parameters"] = self.parameters
+        return config
+
+    @classmethod
+    def for_staged_run(cls, staged_run, gpus=None):
+        """Returns an operation that runs staged_run.
+
+        The operation is initialized from the operation config saved
+        with the run rather than an experiment config. If gpus is
+        specified, the run is started with gpus in place of the devices
+        it was staged with.
+        """
+        name = staged_run.get("opdef")
+        exp_conf = {"operations": {name: staged_run.get("opconfig", {})}}
+        op = cls(name, staged_run.path, exp_conf, gpus=gpus)
+        op._run = staged_run
+        return op
+
+    def run_staged(self):
+        """Runs the command of a staged run in the foreground."""
+        assert self._run is not None
+        base_cmd = self._run.get("base_cmd")
+        if self._gpus and base_cmd:
+            self._init_cmd(base_cmd)
+            self._init_environments()
+        else:
+            self.cmd = self._run.get("cmd")
+        try:
+            return self.proc()
+        finally:
+            self._cleanup()
+
     def _validate_executables(self):
         for env in self.environments:
             if "/" not in env.get("executable"):
@@ -169,12 +245,15 @@ class Operation():
         log.debug(
             "Copying source code files for run {}".format(self._run.id))
 
+        # Output dir (destination) of the sourcecode
+        dest = self._run.tracker_path("sourcecode")
+
+        store = blobs.BlobStore()
+        files = {}
+
         for env in self.environments:
             exe = env.get("executable")
 
-            # Output dir (destination) of the sourcecode
-            dest = self._run.tracker_path("sourcecode")
-
             # Get root of sourcecode
             root = os.path.dirname(os.path.abspath(exe))
 
@@ -184,9 +263,17 @@ class Operation():
             )
             select = filelib.FileSelect(root, rules)
 
-            # Copy the files
+            # Link the files from the source code store
             log.debug("Copy from: '{}' to: '{}'".format(root, dest))
-            filelib.copytree(dest, select, root)
+            handler = filelib.copytree(
+                dest, select, root,
+                handler_cls=functools.partial(
+                    filelib.BlobCopyHandler, store=store))
+            files.update(handler.finish())
+
+        blobs.write_manifest(
+            self._run.tracker_path("sourcecode.manifest"), files)
+        self._sourcecode_files = files
 
     def _init_remote(self):
         assert self._run is not None
@@ -266,16 +353,23 @@ class Operation():
             raise NotImplementedError
         else:
             assert len(self.environments) == 1
+            run_command = "./" + self._run_command(
+                os.path.join(
+                    *self.environments[0].get("executable")
+                    .split("/")[1:]))
+            if self._container:
+                # Run in a warm container (see `container_pool`)
+                self.cmd = container_pool.exec_cmd(
+                    self._container, self._run, run_command)
+                return
             assert "run" in self.cmd
             self.cmd += " " + self._container_args() \
                 + " " + self.environments[0].get("image") \
-                + " ./" + self._run_command(
-                    os.path.join(
-                        *self.environments[0].get("executable")
-                        .split("/")[1:]))
+                + " " + run_command
 
     def _container_args(self):
-        return "{gpu_arg} {volume_arg}".format(
+        return "{env_arg} {gpu_arg} {volume_arg}".format(
+            env_arg=container_pool.ENV_ARGS,
             gpu_arg="--gpus {}".format(self._gpus) if self._gpus else "",
             volume_arg="-v {}:/code -w /code".format(
                 self.remote_sourcecode_dir
@@ -306,7 +400,13 @@ class Operation():
             return ""
 
     def _init_digest(self):
-        digest = filelib.files_digest(self._run.tracker_path("sourcecode"))
+        alg = _sourcecode_digest_alg()
+        if alg == blobs.DIGEST_ALG and self._sourcecode_files is not None:
+            # Per-file digests were computed while copying
+            digest = filelib.manifest_digest(self._sourcecode_files)
+        else:
+            digest = filelib.files_digest(
+                self._run.tracker_path("sourcecode"), alg)
         self._run.write_attr("sourcecode_digest", digest)
 
     def resolve_resources(self):
@@ -360,12 +460,25 @@ class Operation():
                 args,
                 # env=env,
                 cwd=cwd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
             )
         except OSError as e:
             raise ProcessError(e)
         else:
             self._proc = proc
+            self._output = run_output.RunOutput(
+                self._run, scalars=self._output_scalars())
+            self._output.open(proc)
             _write_proc_lock(self._proc, self._run)
+            _delete_pending_marker(self._run)
+
+    def _output_scalars(self):
+        config = self.operation_config.get("output-scalars")
+        if not config:
+            return None
+        from tracker.utils import summary
+        return summary.OutputScalars(config, self._run.tracker_path())
 
     def _wait_for_proc(self):
         assert self._proc is not None
@@ -374,8 +487,11 @@ class Operation():
             proc_exit_status = self._watch_proc()
         except KeyboardInterrupt:
             proc_exit_status = self._handle_proc_interrupt()
+        if self._stop_requested:
+            proc_exit_status = exit_code.SIGTERM
         self._exit_status = proc_exit_status
         self._stopped = timestamp.timestamp()
+        self._output.wait(OUTPUT_CLOSE_TIMEOUT_SECONDS)
         _delete_proc_lock(self._run)
 
     def _watch_proc(self):
@@ -396,6 +512,28 @@ class Operation():
             utils.kill_process_tree(self._proc.pid, force=True)
         return exit_code.SIGTERM
 
+    def stop(self):
+        """Stops the operation process if it's running.
+
+        The run is recorded as terminated however the process exits.
+        May be called from any thread.
+        """
+        import psutil
+        proc = self._proc
+        if proc is None or proc.poll() is not None:
+            return
+        self._stop_requested = True
+        log.debug("Stopping operation run process %s", proc.pid)
+        try:
+            _gone, alive = utils.kill_process_tree(
+                proc.pid, timeout=PROC_TERM_TIMEOUT_SECONDS)
+            if alive:
+                log.warning(
+                    "Operation process did not exit - stopping forcefully")
+                utils.kill_process_tree(proc.pid, force=True)
+        except psutil.NoSuchProcess:
+            pass
+
     def _finalize_attrs(self):
         assert self._run is not None
         assert self._exit_status is not None
@@ -410,6 +548,14 @@ class Operation():
             return
         self._run.write_attr("exit_status", self._exit_status)
         self._run.write_attr("stopped", self._stopped)
+        run_index.safe_update_run(
+            self._run,
+            exit_status=self._exit_status,
+            stopped=self._stopped)
+        # Scalars are read from output until it's closed, which may be
+        # after processes started by the run process exit
+        self._output.on_close(
+            functools.partial(run_index.safe_index_scalars, self._run))
 
     def _cleanup(self):
         assert self._run is not None
@@ -421,7 +567,10 @@ class Operation():
         self._stopped = None
         self._run = None
         self._proc = None
+        self._output = None
         self._exit_status = None
+        self._stop_requested = False
+        self._sourcecode_files = None
 #
 #     def _proc_env(self):
 #         assert self._run is not None
@@ -602,6 +751,25 @@ def _write(f, data):
 #     } for p in config_parameters if config_parameters[p].get("value")]
 #
 #
+def _sourcecode_digest_alg():
+    """Returns the algorithm used for the sourcecode_digest attr.
+
+    Defaults to md5 so that digests of new runs can be compared with
+    those of existing runs. Set `sourcecode-digest` to `blake2b` under
+    the `run` key of the user configuration to compute the digest from
+    the per-file digests computed while copying source code, which
+    avoids reading the files again.
+    """
+    run_config = config.get_user_config().get("run") or {}
+    alg = run_config.get("sourcecode-digest", DEFAULT_SOURCECODE_DIGEST)
+    if alg not in filelib.DIGEST_ALGS:
+        log.warning(
+            "unsupported sourcecode-digest %r, using %s",
+            alg, DEFAULT_SOURCECODE_DIGEST)
+        return DEFAULT_SOURCECODE_DIGEST
+    return alg
+
+
 def _sort_resolved(resolved):
     return {name: sorted(files) for name, files in resolved.items()}
 
@@ -634,3 +802,10 @@ def _delete_proc_lock(run):
         os.remove(run.tracker_path("LOCK"))
     except OSError:
         pass
+
+
+def _delete_pending_marker(run):
+    try:
+        os.remove(run.tracker_path(run_queue.PENDING_MARKER))
+    except OSError:
+        pass
@@ -9,18 +9,37 @@
 """ Helper class for trials (named run in command)
 """
 
+import contextlib
 import errno
+import json
+import logging
 import os
+import shutil
+import itertools
+import sqlite3
+import threading
 import uuid
 
+from concurrent import futures
+
 import ruamel.yaml as yaml
 
-from tracker import utils
+from tracker import run_index
 from tracker.utils import cli
 from tracker.utils import config
 from tracker.utils import path as pathlib
+from tracker.utils import pid as pidlib
+from tracker.utils import timestamp
+from tracker.utils import utils
 from tracker.utils import yaml as yamllib
 
+log = logging.getLogger(__name__)
+
+PACKED_ATTRS = "attrs.json"
+
+# Unique suffixes for temp files written by this process
+_tmp_ids = itertools.count()
+
 
 class NoSuchRun(ValueError):
     pass
@@ -41,6 +60,7 @@ class Run():
         self.id = id
         self.path = path
         self._tracker_dir = os.path.join(self.path, ".tracker")
+        self._packed_attrs = None
 
     @property
     def short_id(self):
@@ -66,6 +86,13 @@ class Run():
 
     @property
     def status(self):
+        return self.resolve_status(pidlib.pid_exists)
+
+    def resolve_status(self, pid_exists):
+        """Returns run status using pid_exists to check the run process.
+
+        Use `RunStatusResolver` to resolve the status of many runs.
+        """
         if os.path.exists(self.tracker_path("LOCK.remote")):
             return "running"
         elif os.path.exists(self.tracker_path("PENDING")):
@@ -74,16 +101,16 @@ class Run():
             if self.has_attr("exit_status.remote"):
                 return self._remote_exit_status()
             else:
-                return self._local_status()
+                return self._local_status(pid_exists)
 
     @property
     def remote(self):
         remote_lock_file = self.tracker_path("LOCK.remote")
-        return utils.utils.try_read(remote_lock_file, apply=str.strip)
+        return utils.try_read(remote_lock_file, apply=str.strip)
 
     @property
     def timestamp(self):
-        return utils.utils.find_apply([
+        return utils.find_apply([
             lambda: self.get("started"),
             lambda: self.get("initialized"),
             lambda: None
@@ -98,7 +125,7 @@ class Run():
         else:
             return "error"
 
-    def _local_status(self):
+    def _local_status(self, pid_exists):
         pid = self.pid  # side-effect, read once
         if pid is None:
             exit_status = self.get("exit_status")
@@ -110,7 +137,7 @@ class Run():
                 return "terminated"
             else:
                 return "error"
-        elif utils.pid.pid_exists(pid):
+        elif pid_exists(pid):
             return "running"
         else:
             return "terminated"
@@ -124,9 +151,15 @@ class Run():
             return val if val is not None else default
 
     def attr_names(self):
-        return sorted(utils.utils.safe_listdir(self._attrs_dir()))
+        packed = self._packed()
+        if packed is not None:
+            return sorted(packed)
+        return sorted(utils.safe_listdir(self._attrs_dir()))
 
     def has_attr(self, name):
+        packed = self._packed()
+        if packed is not None:
+            return name in packed
         return os.path.exists(self._attr_path(name))
 
     def iter_attrs(self):
@@ -137,6 +170,9 @@ class Run():
                 pass
 
     def __getitem__(self, name):
+        packed = self._packed()
+        if packed is not None:
+            return packed[name]
         try:
             f = open(self._attr_path(name), "r")
         except IOError:
@@ -144,6 +180,28 @@ class Run():
         else:
             return yaml.safe_load(f)
 
+    @property
+    def packed(self):
+        """True if run attributes are stored in a single packed file."""
+        return self._packed() is not None
+
+    def _packed(self):
+        """Returns packed attributes or None if attrs are stored per file.
+
+        Packed attributes are read once per Run object and cached.
+        """
+        if self._packed_attrs is None:
+            self._packed_attrs = _read_packed_attrs(self._packed_attrs_path())
+        if self._packed_attrs is False:
+            return None
+        return self._packed_attrs
+
+    def reload_attrs(self):
+        self._packed_attrs = None
+
+    def _packed_attrs_path(self):
+        return os.path.join(self._tracker_dir, PACKED_ATTRS)
+
     def _attr_path(self, name):
         return os.path.join(self._attrs_dir(), name)
 
@@ -153,11 +211,19 @@ class Run():
     def __repr__(self):
         return "<tracker.run.Run '%s'>" % self.id
 
-    def init_skeleton(self):
-        utils.utils.safe_make_dir(self.tracker_path("attrs"))
+    def init_skeleton(self, packed=None):
+        if packed is None:
+            packed = packed_attrs_enabled()
+        if packed and not os.path.exists(self._attrs_dir()):
+            utils.safe_make_dir(self._tracker_dir)
+            if not self.packed:
+                self._write_packed_attrs({})
+        else:
+            utils.safe_make_dir(self.tracker_path("attrs"))
         if not self.has_attr("initialized"):
             self.write_attr("id", self.id)
-            self.write_attr("initialized", utils.timestamp.timestamp())
+            self.write_attr("initialized", timestamp.timestamp())
+            run_index.safe_add_run(self, initialized=self.get("initialized"))
 
     def tracker_path(self, *subpath):
         if subpath is None:
@@ -165,6 +231,14 @@ class Run():
         return os.path.join(*((self._tracker_dir,) + tuple(subpath)))
 
     def write_attr(self, name, val, raw=False):
+        if name in run_index.INDEXED_ATTRS or name == run_index.FLAGS_ATTR:
+            run_index.safe_index_attr(
+                self, name, yaml.safe_load(val) if raw else val)
+        if self.packed:
+            if raw:
+                val = yaml.safe_load(val)
+            self._update_packed_attrs(name, val)
+            return
         if not raw:
             val = self._encode_attr_val(val)
         with open(self._attr_path(name), "w") as f:
@@ -176,11 +250,57 @@ class Run():
         return yamllib.encode_yaml(val)
 
     def del_attr(self, name):
+        if name in run_index.INDEXED_ATTRS or name == run_index.FLAGS_ATTR:
+            run_index.safe_index_attr(self, name, None)
+        if self.packed:
+            self._update_packed_attrs(name, None, delete=True)
+            return
         try:
             os.remove(self._attr_path(name))
         except OSError:
             pass
 
+    def _update_packed_attrs(self, name, val, delete=False):
+        # Re-read under lock so attrs written by other processes and
+        # threads since the cache was loaded are not lost.
+        with self._packed_attrs_lock():
+            attrs = _read_packed_attrs(self._packed_attrs_path()) or {}
+            if delete:
+                attrs.pop(name, None)
+            else:
+                attrs[name] = val
+            self._write_packed_attrs(attrs)
+
+    @contextlib.contextmanager
+    def _packed_attrs_lock(self):
+        import fcntl
+        with open(self._packed_attrs_path() + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_packed_attrs(self, attrs):
+        path = self._packed_attrs_path()
+        tmp = "%s.%i.%i.tmp" % (path, os.getpid(), next(_tmp_ids))
+        with open(tmp, "w") as f:
+            json.dump(attrs, f, sort_keys=True)
+        os.replace(tmp, path)
+        self._packed_attrs = attrs
+
+    def pack_attrs(self):
+        """Converts per-file attributes into a single packed file.
+
+        Returns False if the run attributes are already packed.
+        """
+        if self.packed:
+            return False
+        attrs = dict(self.iter_attrs())
+        self._write_packed_attrs(attrs)
+        shutil.rmtree(self._attrs_dir(), ignore_errors=True)
+        return True
+
     def iter_files(self, all_files=False, follow_links=False):
         for root, dirs, files in os.walk(self.path, followlinks=follow_links):
             if not all_files and root == self.path:
@@ -206,6 +326,134 @@ class Run():
                     yield os.path.join(rel_root, name)
 
 
+class RunStatusResolver(object):
+    """Resolves the status of a batch of runs.
+
+    The process table is read at most once - the first time a run
+    with a process lock is resolved - and is shared by all runs
+    resolved with the same resolver. Create a new resolver (or call
+    `refresh`) to observe processes started or stopped since.
+    """
+
+    def __init__(self, proc_table=None):
+        self._proc_table = proc_table
+        self._lock = threading.Lock()
+
+    @property
+    def proc_table(self):
+        with self._lock:
+            if self._proc_table is None:
+                self._proc_table = pidlib.ProcessTable.snapshot()
+            return self._proc_table
+
+    def refresh(self):
+        self._proc_table = None
+
+    def status(self, run):
+        return run.resolve_status(self._pid_exists)
+
+    def _pid_exists(self, pid):
+        return self.proc_table.pid_exists(pid)
+
+    def statuses(self, runs):
+        """Returns a list of (run, status) tuples for runs."""
+        return [(run, self.status(run)) for run in runs]
+
+    def run_for_pid(self, runs, pid):
+        """Returns the run in runs started by or as process pid.
+
+        Returns None if there is no such run.
+        """
+        for run in runs:
+            run_pid = run.pid
+            if run_pid is None:
+                continue
+            if (run_pid == pid
+                    or self.proc_table.parent_pid(run_pid) == pid):
+                return run
+        return None
+
+
+class RunLoader(object):
+    """Loads data for runs using a bounded pool of worker threads.
+
+    `load` is called with a run and returns the data for that run.
+    Loading runs is mostly independent file I/O - reading attributes,
+    checking status and reading scalars - so it parallelizes well,
+    particularly when Tracker home is on a network file system.
+
+    At most `workers * PENDING_PER_WORKER` runs are submitted to the
+    pool at a time so loading many runs doesn't queue a future per
+    run up front.
+    """
+
+    PENDING_PER_WORKER = 4
+
+    def __init__(self, load, workers=None):
+        self.load = load
+        self.workers = workers or _default_loader_workers()
+
+    def iter_loaded(self, runs):
+        """Yields (i, data) for runs as they're loaded.
+
+        `i` is the index of the loaded run in runs. Results are
+        yielded in completion order.
+        """
+        runs = iter(enumerate(runs))
+        max_pending = self.workers * self.PENDING_PER_WORKER
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {}
+            while True:
+                for i, run in runs:
+                    pending[pool.submit(self.load, run)] = i
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                done, _ = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED)
+                for f in done:
+                    yield pending.pop(f), f.result()
+
+    def load_all(self, runs):
+        """Returns a list of data for runs in the order of runs."""
+        runs = list(runs)
+        loaded = [None] * len(runs)
+        for i, data in self.iter_loaded(runs):
+            loaded[i] = data
+        return loaded
+
+
+def _default_loader_workers():
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def _read_packed_attrs(path):
+    """Returns attrs from a packed attrs file.
+
+    Returns False if the file does not exist so that a missing file
+    can be cached.
+    """
+    try:
+        f = open(path, "r")
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return False
+    with f:
+        return json.load(f)
+
+
+def packed_attrs_enabled():
+    """Returns True if new runs should store attrs in a packed file.
+
+    Enabled by setting `attrs-format` to `packed` under the `run` key
+    of the user configuration.
+    """
+    run_config = config.get_user_config().get("run") or {}
+    return run_config.get("attrs-format") == "packed"
+
+
 def mkid():
     return uuid.uuid4().hex
 
@@ -224,12 +472,34 @@ def run_dir_for_id(run_id):
 
 def _path_for_id(run_id):
     experiments = config.get_project_config().get("experiments")
+
+    path = _indexed_path_for_id(run_id, experiments)
+    if path:
+        return path
+
     run_dirs = _get_all_run_dirs(experiments)
 
     try:
-        return next(x for x in run_dirs if run_id in x)
+        path = next(x for x in run_dirs if run_id in x)
     except StopIteration:
         raise NoSuchRun(run_id)
+    else:
+        run_index.safe_add_run(Run(os.path.basename(path), path))
+        return path
+
+
+def _indexed_path_for_id(run_id, experiments):
+    try:
+        matches = run_index.ensure_built().find(run_id, experiments)
+    except sqlite3.Error as e:
+        log.warning("cannot read run index: %s", e)
+        return None
+    for indexed_id, path in matches:
+        if os.path.isdir(path):
+            return path
+        log.debug("removing deleted run %s from index", indexed_id)
+        run_index.safe_remove_run(indexed_id)
+    return None
 
 
 def _get_all_run_dirs(experiments):
@@ -248,6 +518,12 @@ def _get_all_run_dirs(experiments):
 
 def get_all_run_ids():
     experiments = config.get_project_config().get("experiments")
+
+    try:
+        return run_index.ensure_built().run_ids(experiments)
+    except sqlite3.Error as e:
+        log.warning("cannot read run index: %s", e)
+
     run_ids = []
 
     for exp in experiments:
@@ -0,0 +1,308 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Detect runs added, removed or modified on disk
+
+A run is modified when files are created, removed or written in its
+run directory, its `.tracker` directory or its attributes, other than
+the scalar cache, which is written when runs are read. Changes
+are detected with inotify where it's available. Otherwise, and when
+inotify watches can't be added (e.g. when the per-user watch limit is
+reached), the mtimes of run and attribute directories are compared
+with those of the previous check. Polling doesn't detect existing
+files that are rewritten in place, such as appended logs, so callers
+that need the latest values of running runs should reload those
+regardless.
+"""
+
+import collections
+import errno
+import logging
+import os
+
+from tracker import run as runlib
+from tracker.utils import inotify
+from tracker.utils import path as pathlib
+from tracker.utils import scalarcache
+
+log = logging.getLogger(__name__)
+
+# Run dirs added, removed and modified since the previous check
+Changes = collections.namedtuple("Changes", ["added", "removed", "modified"])
+
+_DIR_EVENTS = (
+    inotify.IN_CREATE
+    | inotify.IN_DELETE
+    | inotify.IN_MOVED_FROM
+    | inotify.IN_MOVED_TO
+    | inotify.IN_ONLYDIR)
+
+_RUN_EVENTS = (
+    _DIR_EVENTS
+    | inotify.IN_MODIFY
+    | inotify.IN_CLOSE_WRITE
+    | inotify.IN_ATTRIB)
+
+_CREATED = inotify.IN_CREATE | inotify.IN_MOVED_TO
+
+_DELETED = inotify.IN_DELETE | inotify.IN_MOVED_FROM
+
+# Files in the run `.tracker` dir written when runs are read
+_IGNORED_TRACKER_FILES = (
+    scalarcache.CACHE_FILENAME,
+    scalarcache.CACHE_FILENAME + ".tmp",
+)
+
+# Run subdirectories that are watched when they're created
+_WATCHED_SUBDIRS = {
+    ("run", ".tracker"): "tracker",
+    ("tracker", "attrs"): "attrs",
+}
+
+
+class RunChangeDetector(object):
+    """Reports changes to runs since the previous call to `changes`.
+
+    Runs are watched from when the detector is created. `experiments`
+    is an optional list of experiment names to limit the watched runs
+    to. Set `use_inotify` to False to always poll.
+    """
+
+    def __init__(self, experiments=None, experiments_dir=None,
+                 use_inotify=True):
+        self.experiments_dir = experiments_dir or pathlib.path("experiments")
+        self.experiments = (
+            set(experiments) if experiments is not None else None)
+        self._backend = None
+        if use_inotify and inotify.available():
+            try:
+                self._backend = _InotifyBackend(self)
+            except OSError as e:
+                log.debug("cannot watch runs with inotify: %s", e)
+        if self._backend is None:
+            self._backend = _PollBackend(self)
+
+    @property
+    def polling(self):
+        return isinstance(self._backend, _PollBackend)
+
+    def changes(self):
+        """Returns `Changes` since the previous call.
+
+        Each attribute of the result is a set of run directories.
+        """
+        try:
+            return self._backend.changes()
+        except OSError as e:
+            return self._fall_back_to_polling(e)
+
+    def _fall_back_to_polling(self, e):
+        # Events may have been lost, so every known run is reported
+        # as modified.
+        log.warning("cannot watch runs (%s), polling for changes", e)
+        known = self._backend.runs()
+        self._backend.close()
+        self._backend = _PollBackend(self)
+        runs = self._backend.runs()
+        return Changes(runs - known, known - runs, runs & known)
+
+    def runs(self):
+        """Returns the set of run directories known to the detector."""
+        return self._backend.runs()
+
+    def close(self):
+        self._backend.close()
+
+    def _watched_experiment(self, name):
+        return self.experiments is None or name in self.experiments
+
+    def _experiment_dirs(self):
+        return [
+            path for name, path in pathlib.iter_dirs(self.experiments_dir)
+            if self._watched_experiment(name) and os.path.isdir(path)
+        ]
+
+
+def _run_dirs(exp_dir):
+    return [
+        path for _name, path in pathlib.iter_dirs(exp_dir)
+        if os.path.isdir(path)
+    ]
+
+
+###################################################################
+# Polling
+###################################################################
+
+class _PollBackend(object):
+
+    def __init__(self, detector):
+        self._detector = detector
+        self._sigs = self._scan()
+
+    def _scan(self):
+        return {
+            run_dir: _run_sig(run_dir)
+            for exp_dir in self._detector._experiment_dirs()
+            for run_dir in _run_dirs(exp_dir)
+        }
+
+    def runs(self):
+        return set(self._sigs)
+
+    def changes(self):
+        prev = self._sigs
+        self._sigs = sigs = self._scan()
+        return Changes(
+            set(sigs) - set(prev),
+            set(prev) - set(sigs),
+            set(
+                run_dir for run_dir, sig in sigs.items()
+                if run_dir in prev and prev[run_dir] != sig))
+
+    def close(self):
+        pass
+
+
+def _run_sig(run_dir):
+    # The `.tracker` dir itself is skipped as its mtime changes when
+    # scalar caches are written by readers. The process lock is
+    # checked so that runs are modified when they start and stop.
+    tracker_dir = os.path.join(run_dir, ".tracker")
+    return tuple(
+        _mtime(path) for path in (
+            run_dir,
+            os.path.join(tracker_dir, "attrs"),
+            os.path.join(tracker_dir, runlib.PACKED_ATTRS),
+            os.path.join(tracker_dir, "LOCK")))
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+###################################################################
+# inotify
+###################################################################
+
+class _InotifyBackend(object):
+
+    def __init__(self, detector):
+        self._detector = detector
+        self._inotify = inotify.Inotify()
+        # Watch descriptors to (kind, path, run_dir)
+        self._watches = {}
+        self._runs = set()
+        if not os.path.isdir(detector.experiments_dir):
+            self.close()
+            raise OSError(
+                errno.ENOENT, "no such directory", detector.experiments_dir)
+        try:
+            self._watch("root", detector.experiments_dir)
+            for exp_dir in detector._experiment_dirs():
+                self._add_experiment(exp_dir)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, kind, path, run_dir=None):
+        mask = _RUN_EVENTS if run_dir else _DIR_EVENTS
+        try:
+            wd = self._inotify.add_watch(path, mask)
+        except OSError as e:
+            # Paths that don't exist yet are watched when created.
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise
+        self._watches[wd] = (kind, path, run_dir)
+
+    def _add_experiment(self, exp_dir):
+        self._watch("experiment", exp_dir)
+        for run_dir in _run_dirs(exp_dir):
+            self._add_run(run_dir)
+
+    def _add_run(self, run_dir):
+        self._runs.add(run_dir)
+        tracker_dir = os.path.join(run_dir, ".tracker")
+        self._watch("run", run_dir, run_dir)
+        self._watch("tracker", tracker_dir, run_dir)
+        self._watch("attrs", os.path.join(tracker_dir, "attrs"), run_dir)
+
+    def runs(self):
+        return set(self._runs)
+
+    def changes(self):
+        prev = set(self._runs)
+        touched = set()
+        for wd, mask, _cookie, name in self._inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                log.debug("inotify queue overflow, rescanning runs")
+                touched.update(self._resync())
+                continue
+            watch = self._watches.get(wd)
+            if watch is None:
+                continue
+            if mask & inotify.IN_IGNORED:
+                del self._watches[wd]
+                continue
+            touched.update(self._handle_event(watch, mask, name))
+        runs = self._runs
+        return Changes(
+            runs - prev,
+            prev - runs,
+            touched & prev & runs)
+
+    def _handle_event(self, watch, mask, name):
+        kind, path, run_dir = watch
+        child = os.path.join(path, name)
+        if kind == "root":
+            if not self._detector._watched_experiment(name):
+                return ()
+            if mask & _CREATED and os.path.isdir(child):
+                self._add_experiment(child)
+            elif mask & _DELETED:
+                self._remove_runs(
+                    [r for r in self._runs if os.path.dirname(r) == child])
+            return ()
+        elif kind == "experiment":
+            if mask & _CREATED and os.path.isdir(child):
+                self._add_run(child)
+                # A run replaced by a move is modified rather than new.
+                return (child,)
+            elif mask & _DELETED:
+                self._remove_runs([child])
+                return (child,)
+            return ()
+        if kind == "tracker" and name in _IGNORED_TRACKER_FILES:
+            return ()
+        subdir_kind = _WATCHED_SUBDIRS.get((kind, name))
+        if subdir_kind and mask & _CREATED:
+            self._watch(subdir_kind, child, run_dir)
+        return (run_dir,)
+
+    def _remove_runs(self, run_dirs):
+        for run_dir in run_dirs:
+            self._runs.discard(run_dir)
+
+    def _resync(self):
+        # Events were lost - watch any runs that were missed and
+        # report all runs as touched.
+        found = set()
+        for exp_dir in self._detector._experiment_dirs():
+            self._watch("experiment", exp_dir)
+            found.update(_run_dirs(exp_dir))
+        self._remove_runs(self._runs - found)
+        for run_dir in found - self._runs:
+            self._add_run(run_dir)
+        return found
+
+    def close(self):
+        self._inotify.close()
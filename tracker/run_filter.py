@@ -0,0 +1,317 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Select trials (runs) with filter expressions
+
+Filter expressions use the query column syntax to compare run values
+to constants, for example:
+
+    status = completed and =lr < 0.01 and max accuracy > 0.9
+
+Predicates on indexed values - the run id, operation, label, exit
+status, flags and scalars of stopped runs - are translated to SQL and
+evaluated against the run index, so only candidate runs are read from
+disk. The full expression is then evaluated for each candidate.
+"""
+
+import logging
+import os
+
+from tracker import run as runlib
+from tracker import run_index
+from tracker.utils import query
+from tracker.utils import scalarcache
+
+log = logging.getLogger(__name__)
+
+# Attribute columns that may be referenced without a leading dot
+FILTER_ATTRS = ("exit_status", "label", "operation", "run", "status")
+
+# Indexed attribute names for attribute columns
+_INDEXED_ATTR_COLS = {
+    "operation": "opdef",
+    "label": "label",
+}
+
+_SQL_OPS = {
+    "=": "=",
+    "!=": "!=",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+}
+
+
+def parse(s):
+    """Returns the filter expression for s.
+
+    Raises `query.ParseError` if s is not a valid expression.
+    """
+    return _normalize(query.parse_where(s).expr)
+
+
+def _normalize(expr):
+    """Replaces unqualified scalars named as FILTER_ATTRS with attrs."""
+    if isinstance(expr, query.Compare):
+        col = expr.col
+        if (isinstance(col, query.Scalar)
+                and col.key in FILTER_ATTRS
+                and not col.qualifier
+                and not col.step):
+            col = query.Attr(col.key)
+        if (isinstance(col, query.Attr)
+                and col.name == "run"
+                and expr.op in ("=", "!=")):
+            # Run ids are compared as written - converting to a
+            # number drops leading zeros and changes exponents
+            return _RunIdCompare(col, expr.op, expr.text)
+        expr.col = col
+    elif isinstance(expr, (query.And, query.Or)):
+        expr.left = _normalize(expr.left)
+        expr.right = _normalize(expr.right)
+    elif isinstance(expr, query.Not):
+        expr.expr = _normalize(expr.expr)
+    return expr
+
+
+class _RunIdCompare(query.Compare):
+    """Compares run ids by prefix, as with run arguments."""
+
+    def test(self, val):
+        match = val is not None and val.startswith(str(self.value))
+        return match if self.op == "=" else not match
+
+
+def filter_runs(s, experiments=None, workers=None):
+    """Returns a list of runs matching the filter expression s.
+
+    If s is empty, returns all runs. Runs are returned in index (id)
+    order.
+    """
+    expr = parse(s) if s else None
+    sql, params, _exact = to_sql(expr) if expr else (None, [], True)
+    log.debug("filter %s pushed down as %r %r", expr, sql, params)
+    index = (
+        run_index.ensure_scalars() if _uses_scalars(expr)
+        else run_index.ensure_built())
+    candidates = [
+        runlib.Run(os.path.basename(path), path)
+        for _id, path in index.select(sql, params, experiments)
+        if os.path.isdir(path)
+    ]
+    if expr is None:
+        return candidates
+    resolver = runlib.RunStatusResolver()
+
+    def test(run):
+        return match(expr, run, resolver)
+
+    matches = runlib.RunLoader(test, workers).load_all(candidates)
+    return [run for run, matched in zip(candidates, matches) if matched]
+
+
+def _uses_scalars(expr):
+    if isinstance(expr, query.Compare):
+        return isinstance(expr.col, query.Scalar)
+    elif isinstance(expr, (query.And, query.Or)):
+        return _uses_scalars(expr.left) or _uses_scalars(expr.right)
+    elif isinstance(expr, query.Not):
+        return _uses_scalars(expr.expr)
+    return False
+
+
+def match(expr, run, resolver=None):
+    """Returns True if run matches the parsed filter expression expr.
+
+    Use `parse` to parse filter expressions.
+    """
+    resolver = resolver or runlib.RunStatusResolver()
+    return query.eval_filter(expr, _RunValues(run, resolver).col_val)
+
+
+###################################################################
+# Predicate pushdown
+###################################################################
+
+def to_sql(expr):
+    """Returns a tuple of (sql, params, exact) for expr.
+
+    `sql` is an SQL expression over the index `runs` table that
+    selects a superset of the runs matching expr, or None if expr
+    can't be narrowed with the index. `exact` is True if sql selects
+    exactly the matching runs, which is required to push down the
+    negation of an expression.
+    """
+    if isinstance(expr, query.Compare):
+        return _compare_sql(expr)
+    elif isinstance(expr, query.And):
+        return _and_sql(to_sql(expr.left), to_sql(expr.right))
+    elif isinstance(expr, query.Or):
+        return _or_sql(to_sql(expr.left), to_sql(expr.right))
+    elif isinstance(expr, query.Not):
+        sql, params, exact = to_sql(expr.expr)
+        if sql is None or not exact:
+            return None, [], False
+        return "NOT (%s)" % sql, params, True
+    else:
+        raise TypeError(expr)
+
+
+def _and_sql(left, right):
+    l_sql, l_params, l_exact = left
+    r_sql, r_params, r_exact = right
+    exact = l_exact and r_exact
+    if l_sql is None:
+        return r_sql, r_params, exact
+    if r_sql is None:
+        return l_sql, l_params, exact
+    return "(%s) AND (%s)" % (l_sql, r_sql), l_params + r_params, exact
+
+
+def _or_sql(left, right):
+    l_sql, l_params, l_exact = left
+    r_sql, r_params, r_exact = right
+    if l_sql is None or r_sql is None:
+        return None, [], False
+    return (
+        "(%s) OR (%s)" % (l_sql, r_sql),
+        l_params + r_params,
+        l_exact and r_exact)
+
+
+def _compare_sql(expr):
+    col = expr.col
+    if isinstance(col, query.Attr):
+        return _attr_sql(col.name, expr.op, expr.value)
+    elif isinstance(col, query.Flag):
+        return (
+            _value_sql("run_flags", col.name, expr.op, expr.value),
+            _value_params(col.name, expr.value),
+            True)
+    elif isinstance(col, query.Scalar):
+        return _scalar_sql(col, expr.op, expr.value)
+    else:
+        raise TypeError(col)
+
+
+def _attr_sql(name, op, value):
+    if name == "run" and op in ("=", "!="):
+        prefix = str(value)
+        sql = "id >= ? AND id < ?"
+        if op == "!=":
+            sql = "NOT (%s)" % sql
+        return sql, [prefix, run_index.prefix_upper_bound(prefix)], True
+    elif name == "status" and op == "=" and value == "completed":
+        # Completed runs have a zero exit status unless they're
+        # remote, in which case the local exit status may be unset.
+        return "exit_status = 0 OR exit_status IS NULL", [], False
+    elif name == "exit_status" and query.numeric_val(value) is not None:
+        return (
+            "exit_status IS NOT NULL AND exit_status %s ?" % _SQL_OPS[op],
+            [value],
+            True)
+    elif name in _INDEXED_ATTR_COLS:
+        attr = _INDEXED_ATTR_COLS[name]
+        return (
+            _value_sql("run_attrs", attr, op, value),
+            _value_params(attr, value),
+            True)
+    return None, [], False
+
+
+def _value_sql(table, name, op, value):
+    col = "value_num" if query.numeric_val(value) is not None \
+        else "value_text"
+    return (
+        "EXISTS (SELECT 1 FROM %s v WHERE v.run_id = runs.id "
+        "AND v.name = ? AND v.%s %s ?)" % (table, col, _SQL_OPS[op]))
+
+
+def _value_params(name, value):
+    num = query.numeric_val(value)
+    return [name, num if num is not None else value]
+
+
+def _scalar_sql(col, op, value):
+    # Scalars are compared numerically in the index, so string
+    # constants can't be pushed down.
+    if query.numeric_val(value) is None:
+        return None, [], False
+    agg_sql = _scalar_agg_sql(col)
+    if agg_sql is None:
+        return None, [], False
+    prefix, tag = scalarcache.split_key(col.key)
+    params = [tag]
+    prefix_sql = ""
+    if prefix is not None:
+        prefix_sql = " AND s.prefix = ?"
+        params.append(prefix)
+    # Scalars of runs that haven't stopped aren't indexed, so those
+    # runs are always candidates.
+    sql = (
+        "stopped IS NULL OR EXISTS (SELECT 1 FROM run_scalars s "
+        "WHERE s.run_id = runs.id AND s.tag = ?%s AND %s %s ?)"
+        % (prefix_sql, agg_sql, _SQL_OPS[op]))
+    return sql, params + [value], False
+
+
+def _scalar_agg_sql(col):
+    qualifier = col.qualifier or scalarcache.DEFAULT_QUALIFIER
+    if qualifier == "avg":
+        return None if col.step else "s.total / s.count"
+    if qualifier in ("total", "count"):
+        return None if col.step else "s.%s" % qualifier
+    return "s.%s_step" % qualifier if col.step else "s.%s" % qualifier
+
+
+###################################################################
+# Run values
+###################################################################
+
+class _RunValues(object):
+    """Column values of a run, read as they're needed."""
+
+    def __init__(self, run, resolver):
+        self.run = run
+        self.resolver = resolver
+        self._status = None
+        self._scalars = None
+
+    @property
+    def status(self):
+        if self._status is None:
+            self._status = self.resolver.status(self.run)
+        return self._status
+
+    @property
+    def scalars(self):
+        if self._scalars is None:
+            self._scalars = scalarcache.for_run(
+                self.run.path, self.status == "running")
+        return self._scalars
+
+    def col_val(self, col):
+        if isinstance(col, query.Attr):
+            return self._attr_val(col.name)
+        elif isinstance(col, query.Flag):
+            param = (self.run.get(run_index.FLAGS_ATTR) or {}).get(col.name)
+            return run_index.flag_val(param)
+        elif isinstance(col, query.Scalar):
+            return self.scalars.get(col.key, col.qualifier, col.step)
+        else:
+            raise TypeError(col)
+
+    def _attr_val(self, name):
+        if name == "run":
+            return self.run.id
+        elif name == "status":
+            return self.status
+        elif name == "operation":
+            return self.run.get("opdef")
+        return self.run.get(name)
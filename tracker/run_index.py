@@ -0,0 +1,494 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Persistent index of trials (runs) stored in Tracker home
+
+The index is a cache of what is on disk under
+``TRACKER_HOME/experiments``. Run directories remain the source of
+truth: lookups that miss the index fall back to scanning the
+experiment directories and entries pointing to deleted runs are
+dropped when they're encountered.
+
+Besides run locations, the index holds the values used to filter runs
+(see `run_filter`): the `opdef` and `label` attributes, flags and the
+scalar aggregates of stopped runs.
+
+Building the index on first use (`ensure_built`) only reads run
+attributes, so run lookups don't read the scalars of every run.
+Scalars are indexed by `ensure_scalars` when they're first needed, and
+by `RunIndex.rebuild`.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+
+from tracker.utils import path as pathlib
+from tracker.utils import query
+from tracker.utils import scalarcache
+
+log = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.db"
+
+# Incremented when the schema changes to trigger an index rebuild
+SCHEMA_VERSION = "2"
+
+# Run attributes stored in the index
+INDEXED_ATTRS = ("opdef", "label")
+
+FLAGS_ATTR = "parameters"
+
+SHORT_ID_LEN = 8
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    short_id TEXT NOT NULL,
+    experiment TEXT,
+    path TEXT NOT NULL,
+    initialized INTEGER,
+    stopped INTEGER,
+    exit_status INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_short_id ON runs (short_id);
+CREATE INDEX IF NOT EXISTS runs_experiment ON runs (experiment);
+CREATE TABLE IF NOT EXISTS run_attrs (
+    run_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value_num REAL,
+    value_text TEXT,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS run_attrs_name ON run_attrs (name, value_text);
+CREATE TABLE IF NOT EXISTS run_flags (
+    run_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value_num REAL,
+    value_text TEXT,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS run_flags_num ON run_flags (name, value_num);
+CREATE INDEX IF NOT EXISTS run_flags_text ON run_flags (name, value_text);
+CREATE TABLE IF NOT EXISTS run_scalars (
+    run_id TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    first REAL,
+    first_step INTEGER,
+    last REAL,
+    last_step INTEGER,
+    min REAL,
+    min_step INTEGER,
+    max REAL,
+    max_step INTEGER,
+    total REAL,
+    count INTEGER,
+    PRIMARY KEY (run_id, prefix, tag)
+);
+CREATE INDEX IF NOT EXISTS run_scalars_tag ON run_scalars (tag);
+"""
+
+_SCALAR_COLS = (
+    "first", "first_step", "last", "last_step", "min", "min_step",
+    "max", "max_step", "total", "count",
+)
+
+_RUN_COLS = ("initialized", "stopped", "exit_status")
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class RunIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False)
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @property
+    def built(self):
+        with self._lock:
+            row = self._db().execute(
+                "SELECT value FROM meta WHERE key = 'built'").fetchone()
+        return row is not None and row[0] == SCHEMA_VERSION
+
+    @property
+    def scalars_built(self):
+        with self._lock:
+            row = self._db().execute(
+                "SELECT value FROM meta WHERE key = 'scalars'").fetchone()
+        return row is not None and row[0] == SCHEMA_VERSION
+
+    def add(self, run_id, path, experiment=None, **attrs):
+        cols = ("id", "short_id", "experiment", "path") + _RUN_COLS
+        vals = (
+            run_id, run_id[:SHORT_ID_LEN], experiment, path
+        ) + tuple(attrs.get(name) for name in _RUN_COLS)
+        with self._lock:
+            with self._db() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO runs (%s) VALUES (%s)"
+                    % (", ".join(cols), ", ".join("?" * len(cols))),
+                    vals)
+
+    def update(self, run_id, **attrs):
+        names = [name for name in _RUN_COLS if name in attrs]
+        if not names:
+            return
+        with self._lock:
+            with self._db() as db:
+                db.execute(
+                    "UPDATE runs SET %s WHERE id = ?"
+                    % ", ".join("%s = ?" % name for name in names),
+                    tuple(attrs[name] for name in names) + (run_id,))
+
+    def remove(self, run_id):
+        with self._lock:
+            with self._db() as db:
+                db.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+                _delete_run_values(db, run_id)
+
+    def set_attr(self, run_id, name, val):
+        """Stores the value of an indexed run attribute.
+
+        Setting the flags attribute replaces the run's indexed flags.
+        """
+        with self._lock:
+            with self._db() as db:
+                _insert_attr(db, run_id, name, val)
+
+    def set_scalars(self, run_id, cache):
+        """Replaces the run's scalars with the aggregates in cache.
+
+        `cache` is a `scalarcache.ScalarCache`.
+        """
+        with self._lock:
+            with self._db() as db:
+                db.execute(
+                    "DELETE FROM run_scalars WHERE run_id = ?", (run_id,))
+                _insert_scalars(db, run_id, cache)
+
+    def select(self, where=None, params=(), experiments=None):
+        """Returns a list of (id, path) tuples for runs matching where.
+
+        `where` is an SQL expression evaluated for each row of the
+        `runs` table, which may refer to the run value tables.
+        """
+        sql = "SELECT id, path FROM runs WHERE (%s)" % (where or "1")
+        sql, params = _filter_experiments(sql, list(params), experiments)
+        with self._lock:
+            return self._db().execute(sql + " ORDER BY id", params).fetchall()
+
+    def find(self, prefix, experiments=None):
+        """Returns a list of (id, path) tuples for runs starting with prefix.
+
+        The lookup is a range scan over the primary key so it costs
+        O(log n) regardless of the number of indexed runs.
+        """
+        sql = "SELECT id, path FROM runs WHERE id >= ? AND id < ?"
+        params = [prefix, prefix_upper_bound(prefix)]
+        sql, params = _filter_experiments(sql, params, experiments)
+        with self._lock:
+            return self._db().execute(sql + " ORDER BY id", params).fetchall()
+
+    def runs(self, experiments=None, latest_first=False):
+        """Returns a list of (id, path) tuples for indexed runs.
+
+        Runs are ordered by id or, if `latest_first` is True, by
+        initialized time with the most recent run first.
+        """
+        sql, params = _filter_experiments(
+            "SELECT id, path FROM runs WHERE 1", [], experiments)
+        order = " ORDER BY initialized DESC, id" if latest_first \
+            else " ORDER BY id"
+        with self._lock:
+            return self._db().execute(sql + order, params).fetchall()
+
+    def unstopped_runs(self, experiments=None):
+        """Returns a list of (id, path) tuples for runs without a stop time.
+
+        These are runs that are running or pending, or that were
+        interrupted before they could be finalized.
+        """
+        sql, params = _filter_experiments(
+            "SELECT id, path FROM runs WHERE stopped IS NULL",
+            [], experiments)
+        with self._lock:
+            return self._db().execute(sql + " ORDER BY id", params).fetchall()
+
+    def flag_names(self, experiments=None):
+        """Returns a sorted list of flag names used by indexed runs."""
+        return self._names(
+            "SELECT DISTINCT f.name FROM run_flags f "
+            "JOIN runs ON runs.id = f.run_id WHERE 1",
+            experiments)
+
+    def scalar_tags(self, prefix="", experiments=None):
+        """Returns a sorted list of indexed scalar tags for prefix."""
+        return self._names(
+            "SELECT DISTINCT s.tag FROM run_scalars s "
+            "JOIN runs ON runs.id = s.run_id WHERE s.prefix = ?",
+            experiments, [prefix])
+
+    def _names(self, sql, experiments, params=None):
+        sql, params = _filter_experiments(sql, params or [], experiments)
+        with self._lock:
+            rows = self._db().execute(sql, params).fetchall()
+        return sorted(name for name, in rows)
+
+    def run_ids(self, experiments=None):
+        return [run_id for run_id, _path in self.runs(experiments)]
+
+    def rebuild(self, experiments_dir=None, scalars=True):
+        """Replaces the index content with the runs found on disk.
+
+        If scalars is False, run scalars aren't indexed until
+        `index_scalars` is called. Returns the number of indexed runs.
+        """
+        from tracker import run as runlib
+        experiments_dir = experiments_dir or pathlib.path("experiments")
+        runs = [
+            (runlib.Run(run_id, run_dir), exp_name)
+            for exp_name, exp_dir in pathlib.iter_dirs(experiments_dir)
+            if os.path.isdir(exp_dir)
+            for run_id, run_dir in pathlib.iter_dirs(exp_dir)
+            if os.path.isdir(run_dir)
+        ]
+        cols = ("id", "short_id", "experiment", "path") + _RUN_COLS
+        with self._lock:
+            with self._db() as db:
+                for table in ("runs", "run_attrs", "run_flags", "run_scalars"):
+                    db.execute("DELETE FROM %s" % table)
+                db.executemany(
+                    "INSERT OR REPLACE INTO runs (%s) VALUES (%s)"
+                    % (", ".join(cols), ", ".join("?" * len(cols))),
+                    [_entry_for_run(run, exp_name) for run, exp_name in runs])
+                for run, _exp_name in runs:
+                    _insert_run_values(db, run, scalars)
+                db.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) "
+                    "VALUES ('built', ?)", (SCHEMA_VERSION,))
+                _set_scalars_built(db, scalars)
+        return len(runs)
+
+    def index_scalars(self):
+        """Indexes the scalar aggregates of all stopped runs."""
+        with self._lock:
+            runs = self._db().execute(
+                "SELECT id, path FROM runs WHERE stopped IS NOT NULL "
+                "ORDER BY id").fetchall()
+        caches = [
+            (run_id, scalarcache.for_run(path))
+            for run_id, path in runs
+            if os.path.isdir(path)
+        ]
+        with self._lock:
+            with self._db() as db:
+                for run_id, cache in caches:
+                    db.execute(
+                        "DELETE FROM run_scalars WHERE run_id = ?",
+                        (run_id,))
+                    _insert_scalars(db, run_id, cache)
+                _set_scalars_built(db, True)
+
+
+def prefix_upper_bound(prefix):
+    if not prefix:
+        return u"\U0010ffff"
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _filter_experiments(sql, params, experiments):
+    if experiments is None:
+        return sql, params
+    experiments = list(experiments)
+    sql += " AND experiment IN (%s)" % ", ".join("?" * len(experiments))
+    return sql, params + experiments
+
+
+def _entry_for_run(run, experiment):
+    return (
+        run.id,
+        run.short_id,
+        experiment,
+        run.path,
+    ) + tuple(run.get(name) for name in _RUN_COLS)
+
+
+def _delete_run_values(db, run_id):
+    for table in ("run_attrs", "run_flags", "run_scalars"):
+        db.execute("DELETE FROM %s WHERE run_id = ?" % table, (run_id,))
+
+
+def _set_scalars_built(db, built):
+    if built:
+        db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) "
+            "VALUES ('scalars', ?)", (SCHEMA_VERSION,))
+    else:
+        db.execute("DELETE FROM meta WHERE key = 'scalars'")
+
+
+def _insert_run_values(db, run, scalars=True):
+    for name in INDEXED_ATTRS + (FLAGS_ATTR,):
+        val = run.get(name)
+        if val is not None:
+            _insert_attr(db, run.id, name, val)
+    # Scalars of runs that haven't stopped are read when filtering.
+    if scalars and run.get("stopped") is not None:
+        _insert_scalars(db, run.id, scalarcache.for_run(run.path))
+
+
+def _insert_attr(db, run_id, name, val):
+    if name == FLAGS_ATTR:
+        db.execute("DELETE FROM run_flags WHERE run_id = ?", (run_id,))
+        db.executemany(
+            "INSERT OR REPLACE INTO run_flags "
+            "(run_id, name, value_num, value_text) VALUES (?, ?, ?, ?)",
+            [(run_id, flag) + _indexed_val(flag_val(param))
+             for flag, param in sorted((val or {}).items())])
+    elif val is None:
+        db.execute(
+            "DELETE FROM run_attrs WHERE run_id = ? AND name = ?",
+            (run_id, name))
+    else:
+        db.execute(
+            "INSERT OR REPLACE INTO run_attrs "
+            "(run_id, name, value_num, value_text) VALUES (?, ?, ?, ?)",
+            (run_id, name) + _indexed_val(val))
+
+
+def flag_val(param):
+    if isinstance(param, dict):
+        return param.get("value")
+    return param
+
+
+def _indexed_val(val):
+    """Returns a tuple of numeric and text values for val.
+
+    Values are indexed so that they compare in SQL as they do with
+    `query.Compare` - numbers numerically and other values as text.
+    """
+    if val is None:
+        return None, None
+    return query.numeric_val(val), query.text_val(val)
+
+
+def _insert_scalars(db, run_id, cache):
+    cols = ("run_id", "prefix", "tag") + _SCALAR_COLS
+    db.executemany(
+        "INSERT OR REPLACE INTO run_scalars (%s) VALUES (%s)"
+        % (", ".join(cols), ", ".join("?" * len(cols))),
+        [
+            (run_id, prefix, tag)
+            + tuple(agg.get(name) for name in _SCALAR_COLS)
+            for prefix, tag, agg in cache.aggregates()
+        ])
+
+
+def index():
+    """Returns the run index for the current Tracker home."""
+    global _index
+    path = pathlib.path(INDEX_FILENAME)
+    with _index_lock:
+        if _index is None or _index.path != path:
+            _index = RunIndex(path)
+        return _index
+
+
+def run_experiment(run_path):
+    """Returns the experiment name for a run located in Tracker home.
+
+    Returns None if the run directory is not located under the
+    experiments directory (e.g. when created with `--run-dir`).
+    """
+    exp_dir = os.path.dirname(os.path.abspath(run_path))
+    experiments_dir = os.path.abspath(pathlib.path("experiments"))
+    if os.path.dirname(exp_dir) != experiments_dir:
+        return None
+    return os.path.basename(exp_dir)
+
+
+def safe_add_run(run, **attrs):
+    try:
+        index().add(run.id, run.path, run_experiment(run.path), **attrs)
+    except sqlite3.Error as e:
+        log.warning("cannot add run %s to index: %s", run.id, e)
+
+
+def safe_update_run(run, **attrs):
+    try:
+        index().update(run.id, **attrs)
+    except sqlite3.Error as e:
+        log.warning("cannot update run %s in index: %s", run.id, e)
+
+
+def safe_index_attr(run, name, val):
+    try:
+        index().set_attr(run.id, name, val)
+    except sqlite3.Error as e:
+        log.warning("cannot index %s for run %s: %s", name, run.id, e)
+
+
+def safe_index_scalars(run):
+    """Indexes the scalar aggregates of a stopped run."""
+    try:
+        index().set_scalars(run.id, scalarcache.for_run(run.path))
+    except (sqlite3.Error, OSError, ValueError) as e:
+        log.warning("cannot index scalars for run %s: %s", run.id, e)
+
+
+def safe_remove_run(run_id):
+    try:
+        index().remove(run_id)
+    except sqlite3.Error as e:
+        log.warning("cannot remove run %s from index: %s", run_id, e)
+
+
+def ensure_built():
+    """Builds the index from disk if it has never been built.
+
+    Run scalars aren't indexed - use `ensure_scalars` before using
+    indexed scalars.
+    """
+    run_index = index()
+    if not run_index.built:
+        log.debug("building run index in %s", run_index.path)
+        run_index.rebuild(scalars=False)
+    return run_index
+
+
+def ensure_scalars():
+    """Builds the index including run scalars as needed."""
+    run_index = ensure_built()
+    if not run_index.scalars_built:
+        log.debug("indexing run scalars in %s", run_index.path)
+        run_index.index_scalars()
+    return run_index
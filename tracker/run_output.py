@@ -0,0 +1,349 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Capture and read run output
+
+Output written by a run process to stdout and stderr is read from
+pipes by a pump thread, which tees it to the terminal and appends it to
+`.tracker/output`. Output is read in chunks as it becomes available and
+the output file is flushed whenever the pipes are idle, at least every
+`FLUSH_INTERVAL` seconds and whenever its buffer is full, so memory use
+is bounded and `tracker watch` sees output promptly. Output of the two
+streams is interleaved in the output file at line boundaries only -
+line ends are newlines or carriage returns, and incomplete lines are
+held back until they're ended or reach `CHUNK_SIZE`.
+
+A line index is written alongside the output in `.tracker/output.index`
+as little-endian uint64 byte offsets of every `INDEX_STRIDE`th line
+(lines `INDEX_STRIDE`, `2 * INDEX_STRIDE`, ...). `OutputReader` uses
+the index to seek to a line without scanning the output from its start.
+
+If `RunOutput` is given output scalars (see `summary.OutputScalars`),
+complete output lines are parsed for scalars as they're captured, so
+scalars are available while the run is running.
+"""
+
+import io
+import logging
+import os
+import selectors
+import struct
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+OUTPUT_FILE = "output"
+INDEX_FILE = "output.index"
+
+INDEX_STRIDE = 64
+
+INDEX_ENTRY = struct.Struct("<Q")
+
+CHUNK_SIZE = 64 * 1024
+
+BUFFER_SIZE = 1024 * 1024
+
+FLUSH_INTERVAL = 1.0
+
+
+class RunOutput(object):
+    """Captures the output of a run process.
+
+    The process must be started with stdout and stderr pipes. Call
+    `wait` after the process exits to wait for remaining output to be
+    written.
+
+    `scalars` is an optional `summary.OutputScalars`, which is closed
+    once the output is closed.
+    """
+
+    def __init__(self, run, quiet=False, scalars=None):
+        self.run = run
+        self.quiet = quiet
+        self.scalars = scalars
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._on_close = []
+
+    def open(self, proc):
+        assert self._thread is None
+        pump = _OutputPump(
+            self.run.tracker_path(OUTPUT_FILE),
+            self.run.tracker_path(INDEX_FILE),
+            [
+                (proc.stdout, None if self.quiet else 1),
+                (proc.stderr, None if self.quiet else 2),
+            ],
+            self.scalars)
+        self._thread = threading.Thread(
+            target=self._pump, args=(pump,), name="run-output")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _pump(self, pump):
+        try:
+            pump.run()
+        finally:
+            with self._lock:
+                self._closed = True
+                callbacks, self._on_close = self._on_close, []
+            for callback in callbacks:
+                callback()
+
+    def wait(self, timeout=None):
+        """Waits for output to be written.
+
+        Output pipes may be held open by processes started by the run
+        process, in which case output is still written when `wait`
+        times out. Returns True if output is closed.
+        """
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            log.warning(
+                "run output is still open after the run process exited")
+            return False
+        return True
+
+    def on_close(self, callback):
+        """Calls callback with no arguments once output is closed.
+
+        callback is called immediately if output is already closed and
+        otherwise from the output thread.
+        """
+        with self._lock:
+            if not self._closed:
+                self._on_close.append(callback)
+                return
+        callback()
+
+
+class _OutputPump(object):
+
+    def __init__(self, output_path, index_path, streams, scalars=None):
+        self._output = io.open(output_path, "ab", buffering=BUFFER_SIZE)
+        self._index = io.open(index_path, "ab")
+        self._streams = streams
+        self._scalars = scalars
+        # Incomplete last lines by stream fd, used to parse scalars
+        self._partial = {}
+        # Incomplete last lines by stream fd not yet written to output
+        self._unwritten = {}
+        self._offset = self._output.tell()
+        self._lines, self._next_mark = _resume_index(
+            index_path, self._offset)
+        self._last_flush = time.time()
+
+    def run(self):
+        sel = selectors.DefaultSelector()
+        for stream, term_fd in self._streams:
+            if stream is not None:
+                sel.register(stream.fileno(), selectors.EVENT_READ, term_fd)
+        try:
+            while sel.get_map():
+                events = sel.select(0)
+                if not events:
+                    self._flush()
+                    events = sel.select()
+                for key, _mask in events:
+                    chunk = os.read(key.fd, CHUNK_SIZE)
+                    if not chunk:
+                        sel.unregister(key.fd)
+                        self._write(self._unwritten.pop(key.fd, b""))
+                        self._parse_scalars(key.fd, b"\n")
+                        continue
+                    if key.data is not None and not _write_term(
+                            key.data, chunk):
+                        # Stop writing to a closed terminal.
+                        sel.modify(key.fd, selectors.EVENT_READ, None)
+                    self._write_lines(key.fd, chunk)
+                    self._parse_scalars(key.fd, chunk)
+        except Exception:
+            log.exception("capturing run output")
+        finally:
+            sel.close()
+            for fd in sorted(self._unwritten):
+                self._write(self._unwritten.pop(fd))
+            for stream, _term_fd in self._streams:
+                if stream is not None:
+                    stream.close()
+            self._output.close()
+            self._index.close()
+            if self._scalars:
+                self._scalars.close()
+
+    def _write_lines(self, fd, chunk):
+        data = self._unwritten.pop(fd, b"") + chunk
+        end = max(data.rfind(b"\n"), data.rfind(b"\r")) + 1
+        if not end:
+            if len(data) < CHUNK_SIZE:
+                self._unwritten[fd] = data
+                return
+            end = len(data)
+        if end < len(data):
+            self._unwritten[fd] = data[end:]
+        self._write(data[:end])
+
+    def _write(self, chunk):
+        if not chunk:
+            return
+        self._output.write(chunk)
+        self._index_chunk(chunk)
+        self._offset += len(chunk)
+        if time.time() - self._last_flush >= FLUSH_INTERVAL:
+            self._flush()
+
+    def _index_chunk(self, chunk):
+        lines = self._lines + chunk.count(b"\n")
+        if lines < self._next_mark:
+            self._lines = lines
+            return
+        start = 0
+        while True:
+            i = chunk.find(b"\n", start)
+            if i == -1:
+                break
+            start = i + 1
+            self._lines += 1
+            if self._lines == self._next_mark:
+                self._index.write(INDEX_ENTRY.pack(self._offset + start))
+                self._next_mark += INDEX_STRIDE
+
+    def _parse_scalars(self, fd, chunk):
+        if not self._scalars:
+            return
+        # Progress output ends lines with carriage returns
+        data = self._partial.pop(fd, b"") + chunk.replace(b"\r", b"\n")
+        lines = data.split(b"\n")
+        partial = lines.pop()
+        if partial and len(partial) <= CHUNK_SIZE:
+            self._partial[fd] = partial
+        self._scalars.write_lines([
+            line.decode("utf-8", "replace") for line in lines if line
+        ])
+
+    def _flush(self):
+        self._output.flush()
+        self._index.flush()
+        if self._scalars:
+            self._scalars.flush()
+        self._last_flush = time.time()
+
+
+def _write_term(fd, data):
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    except OSError as e:
+        log.debug("cannot write output to fd %i: %s", fd, e)
+        return False
+    return True
+
+
+def _resume_index(index_path, output_size):
+    """Returns (lines, next_mark) for output appended to an index."""
+    if not output_size:
+        return 0, INDEX_STRIDE
+    # Output is appended to when a run is restarted. Lines are counted
+    # from the last indexed line.
+    offsets = _read_index(index_path)
+    start = offsets[-1] if offsets else 0
+    lines = len(offsets) * INDEX_STRIDE
+    with open(os.path.join(os.path.dirname(index_path), OUTPUT_FILE),
+              "rb") as f:
+        f.seek(start)
+        lines += sum(chunk.count(b"\n") for chunk in _iter_chunks(f))
+    return lines, (lines // INDEX_STRIDE + 1) * INDEX_STRIDE
+
+
+def _read_index(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except IOError:
+        return []
+    count = len(data) // INDEX_ENTRY.size
+    return [
+        INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size)[0]
+        for i in range(count)
+    ]
+
+
+def _iter_chunks(f):
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+class OutputReader(object):
+    """Reads lines of captured run output."""
+
+    def __init__(self, run):
+        self.path = run.tracker_path(OUTPUT_FILE)
+        self.index_path = run.tracker_path(INDEX_FILE)
+
+    def line_offset(self, line):
+        """Returns the byte offset of line (from 0) or None.
+
+        Returns None if the output has fewer lines.
+        """
+        entry, skip = divmod(line, INDEX_STRIDE)
+        start = 0
+        if entry:
+            entry, start = self._index_entry(entry)
+            skip = line - entry * INDEX_STRIDE
+        try:
+            f = open(self.path, "rb")
+        except IOError:
+            return None
+        with f:
+            f.seek(start)
+            for _ in range(skip):
+                if not f.readline().endswith(b"\n"):
+                    return None
+            pos = f.tell()
+            if not f.read(1):
+                return None
+            return pos
+
+    def _index_entry(self, entry):
+        """Returns (entry, offset) for the nearest indexed entry.
+
+        Entries are numbered from 1 - entry 0 is the output start.
+        """
+        try:
+            f = open(self.index_path, "rb")
+        except IOError:
+            return 0, 0
+        with f:
+            count = os.fstat(f.fileno()).st_size // INDEX_ENTRY.size
+            entry = min(entry, count)
+            if not entry:
+                return 0, 0
+            f.seek((entry - 1) * INDEX_ENTRY.size)
+            return entry, INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))[0]
+
+    def lines(self, start=0, end=None):
+        """Yields decoded output lines from start up to end."""
+        offset = self.line_offset(start)
+        if offset is None:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            line = start
+            while end is None or line < end:
+                raw = f.readline()
+                if not raw:
+                    break
+                yield raw.decode("utf-8", "replace").rstrip("\n")
+                line += 1
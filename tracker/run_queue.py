@@ -0,0 +1,195 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Queue of pending runs
+
+Queued runs are staged runs - initialized with the command to run -
+that have a `PENDING` marker and an entry in `TRACKER_HOME/queue`.
+Entries are named by the time they were queued so they're claimed in
+order, and contain the run directory.
+
+A run is claimed by renaming its entry into `queue/claimed` with the
+claiming process ID as a suffix. Rename is atomic, so each entry is
+claimed by exactly one process however many workers are running. The
+claimant writes the run process lock with its own process ID before
+removing the `PENDING` marker, so the run is never seen as stopped
+while it's being started. Entries claimed by processes that exit
+before the run stops are returned to the queue by `recover`.
+"""
+
+import collections
+import errno
+import logging
+import os
+
+from tracker import run as runlib
+from tracker.utils import path as pathlib
+from tracker.utils import pid as pidlib
+from tracker.utils import timestamp
+from tracker.utils import utils
+
+log = logging.getLogger(__name__)
+
+QUEUE_DIR = "queue"
+CLAIMED_DIR = "claimed"
+
+PENDING_MARKER = "PENDING"
+
+Claim = collections.namedtuple("Claim", ["run", "path"])
+
+
+def queue_dir():
+    return pathlib.path(QUEUE_DIR)
+
+
+def claimed_dir():
+    return os.path.join(queue_dir(), CLAIMED_DIR)
+
+
+def enqueue(run):
+    """Marks run as pending and adds it to the queue.
+
+    run must be staged with its command in the `cmd` attribute.
+    """
+    ts = timestamp.timestamp()
+    with open(run.tracker_path(PENDING_MARKER), "w") as f:
+        f.write(str(ts))
+    utils.safe_make_dir(claimed_dir())
+    name = "%020i-%s" % (ts, run.id)
+    tmp = os.path.join(queue_dir(), ".%s.tmp" % name)
+    with open(tmp, "w") as f:
+        f.write(run.path)
+    os.rename(tmp, os.path.join(queue_dir(), name))
+    log.debug("queued run %s", run.id)
+
+
+def queued():
+    """Returns a list of queued runs in the order they were queued."""
+    runs = []
+    for name in _entry_names(queue_dir()):
+        path = _read_entry(os.path.join(queue_dir(), name))
+        if path:
+            runs.append(runlib.Run(os.path.basename(path), path))
+    return runs
+
+
+def _entry_names(dir):
+    return sorted(
+        name for name in utils.safe_listdir(dir)
+        if not name.startswith(".") and name != CLAIMED_DIR
+    )
+
+
+def _read_entry(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+
+
+def claim():
+    """Claims the next queued run.
+
+    Returns a `Claim` or None if the queue is empty. Call `complete`
+    with the claim once the run has stopped.
+    """
+    pid = os.getpid()
+    for name in _entry_names(queue_dir()):
+        claim_path = os.path.join(claimed_dir(), "%s.%i" % (name, pid))
+        try:
+            os.rename(os.path.join(queue_dir(), name), claim_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # Claimed by another worker.
+            continue
+        run_dir = _read_entry(claim_path)
+        if not run_dir or not os.path.isdir(run_dir):
+            log.warning("queued run %s no longer exists, skipping", run_dir)
+            os.remove(claim_path)
+            continue
+        run = runlib.Run(os.path.basename(run_dir), run_dir)
+        with open(run.tracker_path("LOCK"), "w") as f:
+            f.write(str(pid))
+        _remove_pending_marker(run)
+        log.debug("claimed run %s", run.id)
+        return Claim(run, claim_path)
+    return None
+
+
+def _remove_pending_marker(run):
+    try:
+        os.remove(run.tracker_path(PENDING_MARKER))
+    except OSError:
+        pass
+
+
+def complete(claim):
+    try:
+        os.remove(claim.path)
+    except OSError:
+        pass
+
+
+def release(claim):
+    """Returns a claimed run that wasn't started to the queue."""
+    entry_name = os.path.basename(claim.path).rpartition(".")[0]
+    _requeue(claim.run, claim.path, entry_name)
+
+
+def _requeue(run, claim_path, entry_name):
+    with open(run.tracker_path(PENDING_MARKER), "w") as f:
+        f.write(str(timestamp.timestamp()))
+    try:
+        os.remove(run.tracker_path("LOCK"))
+    except OSError:
+        pass
+    os.rename(claim_path, os.path.join(queue_dir(), entry_name))
+
+
+def recover():
+    """Returns runs claimed by processes that have exited to the queue.
+
+    Runs that stopped are not requeued. Returns the number of
+    requeued runs.
+    """
+    requeued = 0
+    claimed = claimed_dir()
+    for name in _entry_names(claimed):
+        entry_name, _, pid = name.rpartition(".")
+        try:
+            pid = int(pid)
+        except ValueError:
+            continue
+        if pidlib.pid_exists(pid):
+            continue
+        # Take over the claim so that it's recovered only once.
+        claim_path = os.path.join(
+            claimed, "%s.%i" % (entry_name, os.getpid()))
+        try:
+            os.rename(os.path.join(claimed, name), claim_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            continue
+        run_dir = _read_entry(claim_path)
+        if not run_dir or not os.path.isdir(run_dir):
+            os.remove(claim_path)
+            continue
+        run = runlib.Run(os.path.basename(run_dir), run_dir)
+        if run.has_attr("exit_status") or run.status == "running":
+            os.remove(claim_path)
+            continue
+        log.warning("requeuing run %s claimed by exited process %i",
+                    run.id, pid)
+        _requeue(run, claim_path, entry_name)
+        requeued += 1
+    return requeued
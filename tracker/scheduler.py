@@ -0,0 +1,198 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Run trials concurrently on GPU device slots
+
+`TrialScheduler` runs up to `max_parallel` trials at once. When it's
+given `DeviceSlots`, each trial is assigned a device for as long as it
+runs, and trials wait for a free device.
+
+Device slots are recorded in `TRACKER_HOME/device-slots.json`, which is
+only changed while holding an exclusive lock on
+`device-slots.json.lock`, so concurrent `tracker run` commands share
+the same devices. A slot is held by a process ID - slots held by
+processes that no longer exist are free.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+from concurrent import futures
+
+from tracker.utils import path as pathlib
+from tracker.utils import pid as pidlib
+
+log = logging.getLogger(__name__)
+
+SLOTS_FILE = "device-slots.json"
+
+# Seconds between checks for slots released by other processes
+SLOT_POLL_INTERVAL = 1.0
+
+
+class DeviceSlots(object):
+    """GPU devices shared by Tracker processes."""
+
+    def __init__(self, devices, path=None):
+        self.devices = list(devices)
+        self.path = path or pathlib.path(SLOTS_FILE)
+        self._released = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Returns a free device, waiting for one as needed.
+
+        Returns None if timeout seconds pass without a free device.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            device = self._try_acquire()
+            if device is not None:
+                log.debug("acquired device %s", device)
+                return device
+            wait = SLOT_POLL_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    return None
+            with self._released:
+                self._released.wait(wait)
+
+    def _try_acquire(self):
+        with self._locked_slots() as slots:
+            for device in self.devices:
+                if device not in slots:
+                    slots[device] = {"pid": os.getpid()}
+                    return device
+        return None
+
+    def release(self, device):
+        with self._locked_slots() as slots:
+            slot = slots.get(device)
+            if slot and slot.get("pid") == os.getpid():
+                del slots[device]
+        log.debug("released device %s", device)
+        with self._released:
+            self._released.notify()
+
+    @contextlib.contextmanager
+    def slot(self):
+        device = self.acquire()
+        try:
+            yield device
+        finally:
+            self.release(device)
+
+    def held(self):
+        """Returns a dict of held devices to the pids holding them."""
+        with self._locked_slots() as slots:
+            return {device: slot["pid"] for device, slot in slots.items()}
+
+    @contextlib.contextmanager
+    def _locked_slots(self):
+        import fcntl
+        dir = os.path.dirname(self.path)
+        if dir and not os.path.exists(dir):
+            os.makedirs(dir)
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                slots = _prune_slots(_read_slots(self.path))
+                before = dict(slots)
+                yield slots
+                if slots != before:
+                    _write_slots(self.path, slots)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_slots(path):
+    try:
+        f = open(path, "r")
+    except IOError:
+        return {}
+    with f:
+        try:
+            return json.load(f)
+        except ValueError as e:
+            log.warning("ignoring invalid device slots %s: %s", path, e)
+            return {}
+
+
+def _prune_slots(slots):
+    return {
+        device: slot for device, slot in slots.items()
+        if isinstance(slot.get("pid"), int) and pidlib.pid_exists(slot["pid"])
+    }
+
+
+def _write_slots(path, slots):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(slots, f)
+    os.replace(tmp, path)
+
+
+class TrialScheduler(object):
+    """Runs trials with up to `max_parallel` at once.
+
+    `run_trial` is called with a trial and the device assigned to it,
+    or None if the scheduler doesn't have device slots, and returns
+    the trial result.
+    """
+
+    def __init__(self, run_trial, max_parallel, slots=None):
+        self.run_trial = run_trial
+        self.max_parallel = max(1, max_parallel)
+        self.slots = slots
+
+    def run(self, trials):
+        """Returns a list of results for trials in the order of trials.
+
+        If a trial raises an exception, trials that haven't started are
+        cancelled and the exception is raised once running trials
+        finish.
+        """
+        trials = list(trials)
+        results = [None] * len(trials)
+        with futures.ThreadPoolExecutor(
+                max_workers=self.max_parallel) as pool:
+            pending = {
+                pool.submit(self._run_trial, trial): i
+                for i, trial in enumerate(trials)
+            }
+            try:
+                for f in futures.as_completed(pending):
+                    results[pending[f]] = f.result()
+            except BaseException:
+                for f in pending:
+                    f.cancel()
+                raise
+        return results
+
+    def _run_trial(self, trial):
+        if self.slots is None:
+            return self.run_trial(trial, None)
+        with self.slots.slot() as device:
+            return self.run_trial(trial, device)
+
+
+def parse_devices(gpus):
+    """Returns a list of device IDs for a `--gpus` value.
+
+    `all` is all local GPUs.
+    """
+    if gpus is None:
+        return []
+    if gpus.strip() == "all":
+        from tracker.utils import gpu
+        return gpu.device_ids()
+    return [device.strip() for device in gpus.split(",") if device.strip()]
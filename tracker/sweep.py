@@ -0,0 +1,295 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Expand experiment parameters into trials
+
+Parameters in an experiment operation are either fixed or swept. A
+parameter is swept when its `value` is a list or when it's a range
+given by `min` and `max`:
+
+    parameters:
+      batch_size:
+        value: [32, 64, 128]      # each value in turn
+      lr:
+        min: 0.0001
+        max: 0.1
+        distribution: log-uniform # or uniform (default)
+      epochs:
+        min: 5
+        max: 20
+        step: 5                   # 5, 10, 15, 20
+
+Ranges of integers are sampled as integers. Ranges with a step are
+sampled from their steps.
+
+Trials are generated by an optimizer:
+
+- `grid` runs every combination of swept values. Ranges must have a
+  step. This is the default.
+- `random` samples each parameter independently.
+- `quasi-random` samples from a Halton sequence, which covers the
+  parameter space more evenly than random samples for the same number
+  of trials. The sequence is randomly shifted so that sweeps with
+  different seeds sample different points.
+
+Sampling is reproducible for a given seed.
+"""
+
+import itertools
+import logging
+import math
+import random
+
+log = logging.getLogger(__name__)
+
+GRID = "grid"
+RANDOM = "random"
+QUASI_RANDOM = "quasi-random"
+
+OPTIMIZERS = {
+    "grid": GRID,
+    "random": RANDOM,
+    "quasi-random": QUASI_RANDOM,
+    "halton": QUASI_RANDOM,
+}
+
+DISTRIBUTIONS = ("uniform", "log-uniform")
+
+# Keys of a parameter config that define a sweep rather than a value
+_SWEEP_KEYS = ("min", "max", "step", "distribution")
+
+
+class SweepError(ValueError):
+    pass
+
+
+class _Dimension(object):
+    """A swept parameter."""
+
+    def __init__(self, name, values=None, min=None, max=None, step=None,
+                 distribution=None):
+        self.name = name
+        self.values = values
+        self.min = min
+        self.max = max
+        self.step = step
+        self.log = distribution == "log-uniform"
+        self.integer = (
+            values is None
+            and step is None
+            and not self.log
+            and isinstance(min, int)
+            and isinstance(max, int))
+        if values is None and step is not None:
+            self.values = _steps(min, max, step)
+
+    def grid_values(self):
+        if self.values is None:
+            raise SweepError(
+                "cannot grid search parameter '%s': ranges must have a step "
+                "(use --optimizer random or quasi-random to sample the range)"
+                % self.name)
+        return self.values
+
+    def sample(self, u):
+        """Returns the value at u, a float in [0, 1)."""
+        if self.values is not None:
+            return self.values[min(int(u * len(self.values)),
+                                   len(self.values) - 1)]
+        if self.integer:
+            return min(self.min + int(u * (self.max - self.min + 1)),
+                       self.max)
+        if self.log:
+            lo, hi = math.log(self.min), math.log(self.max)
+            return math.exp(lo + u * (hi - lo))
+        return self.min + u * (self.max - self.min)
+
+    def describe(self):
+        if self.values is not None and self.step is None:
+            return "[%s]" % ", ".join(str(val) for val in self.values)
+        desc = "%s to %s" % (self.min, self.max)
+        if self.step is not None:
+            desc += " step %s" % self.step
+        if self.log:
+            desc += " (log-uniform)"
+        return desc
+
+
+def _steps(min, max, step):
+    count = int(math.floor((max - min) / step + 1e-9)) + 1
+    if all(isinstance(x, int) for x in (min, max, step)):
+        return [min + i * step for i in range(count)]
+    # Round away float error so that values print as they're written
+    return [round(min + i * step, 12) for i in range(count)]
+
+
+def _dimension(name, config):
+    if not isinstance(config, dict):
+        return None
+    value = config.get("value")
+    if isinstance(value, list):
+        if not value:
+            raise SweepError("parameter '%s' has no values" % name)
+        return _Dimension(name, values=list(value))
+    if not any(key in config for key in _SWEEP_KEYS):
+        return None
+    if "min" not in config or "max" not in config:
+        raise SweepError(
+            "parameter '%s' must have both min and max" % name)
+    lo = _number(name, "min", config["min"])
+    hi = _number(name, "max", config["max"])
+    step = config.get("step")
+    if step is not None:
+        step = _number(name, "step", step)
+        if step <= 0:
+            raise SweepError("parameter '%s' step must be positive" % name)
+    distribution = config.get("distribution", "uniform")
+    if distribution not in DISTRIBUTIONS:
+        raise SweepError(
+            "parameter '%s' has unsupported distribution '%s' (expected %s)"
+            % (name, distribution, " or ".join(DISTRIBUTIONS)))
+    if lo > hi:
+        raise SweepError(
+            "parameter '%s' min must not be greater than max" % name)
+    if distribution == "log-uniform" and lo <= 0:
+        raise SweepError(
+            "parameter '%s' min must be positive for a log-uniform "
+            "distribution" % name)
+    return _Dimension(name, min=lo, max=hi, step=step,
+                      distribution=distribution)
+
+
+def _number(name, key, val):
+    if isinstance(val, bool):
+        raise SweepError("parameter '%s' %s must be a number" % (name, key))
+    if isinstance(val, (int, float)):
+        return val
+    try:
+        # YAML loads values like 1e-4 as strings
+        return float(val)
+    except (TypeError, ValueError):
+        raise SweepError("parameter '%s' %s must be a number" % (name, key))
+
+
+def dimensions(parameters):
+    """Returns a list of swept parameters sorted by name."""
+    dims = []
+    for name in sorted(parameters or {}):
+        dim = _dimension(name, parameters[name])
+        if dim is not None:
+            dims.append(dim)
+    return dims
+
+
+def is_sweep(parameters):
+    return bool(dimensions(parameters))
+
+
+def describe(name, config):
+    """Returns a description of a parameter value or sweep."""
+    dim = _dimension(name, config)
+    if dim is not None:
+        return dim.describe()
+    if isinstance(config, dict):
+        return config.get("value")
+    return config
+
+
+def optimizer_for_name(name):
+    if name is None:
+        return GRID
+    try:
+        return OPTIMIZERS[name.lower()]
+    except KeyError:
+        raise SweepError(
+            "unsupported optimizer '%s' (expected one of %s)"
+            % (name, ", ".join(sorted(OPTIMIZERS))))
+
+
+def trials(parameters, optimizer=None, count=1, seed=None):
+    """Returns a list of trials for parameters.
+
+    Each trial is a dict of swept parameter names to values. For grid
+    search, each combination is repeated count times. Other optimizers
+    return count samples.
+    """
+    optimizer = optimizer_for_name(optimizer)
+    dims = dimensions(parameters)
+    if not dims:
+        return [{} for _ in range(count)]
+    if optimizer == GRID:
+        return _grid(dims, count)
+    rng = random.Random(seed)
+    if optimizer == RANDOM:
+        points = ([rng.random() for _ in dims] for _ in range(count))
+    else:
+        points = _halton(len(dims), count, rng)
+    return [
+        {dim.name: dim.sample(u) for dim, u in zip(dims, point)}
+        for point in points
+    ]
+
+
+def _grid(dims, count):
+    combos = itertools.product(*[dim.grid_values() for dim in dims])
+    return [
+        {dim.name: val for dim, val in zip(dims, combo)}
+        for combo in combos
+        for _ in range(count)
+    ]
+
+
+def _halton(dims, count, rng):
+    bases = _primes(dims)
+    # The sequence starts at 0 rather than skipping it as unshifted
+    # sequences do, so the first base ** k points of each dimension
+    # are evenly spaced
+    shift = [rng.random() for _ in range(dims)]
+    for i in range(count):
+        yield [
+            (_radical_inverse(i, base) + offset) % 1.0
+            for base, offset in zip(bases, shift)
+        ]
+
+
+def _radical_inverse(i, base):
+    inv = 0.0
+    f = 1.0 / base
+    while i:
+        i, digit = divmod(i, base)
+        inv += digit * f
+        f /= base
+    return inv
+
+
+def _primes(count):
+    primes = []
+    n = 2
+    while len(primes) < count:
+        if all(n % p for p in primes if p * p <= n):
+            primes.append(n)
+        n += 1
+    return primes
+
+
+def trial_parameters(parameters, trial):
+    """Returns parameters with values for trial.
+
+    Sweep keys are removed from swept parameters, so the result is a
+    parameter config for a single run.
+    """
+    resolved = {}
+    for name, config in (parameters or {}).items():
+        if name in trial:
+            config = {
+                key: val for key, val in (config or {}).items()
+                if key not in _SWEEP_KEYS
+            }
+            config["value"] = trial[name]
+        resolved[name] = config
+    return resolved
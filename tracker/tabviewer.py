@@ -25,11 +25,18 @@
 
 import curses
 import logging
+import threading
 
 from tabview import tabview
 
 ViewerBase = tabview.Viewer
 
+# Number of rows loaded at a time by a RowProvider
+PAGE_SIZE = 100
+
+# Number of rows used to estimate column widths for a RowProvider
+WIDTH_SAMPLE_SIZE = 200
+
 
 viewer_help = """
 F1 or ?                  Show this help
@@ -81,20 +88,36 @@ class Viewer(ViewerBase):
     max_header_width = 12
     max_data_width = 20
 
+    provider = None
+
     def __init__(self, *args, **kw):
         assert self.get_data is not None
         assert self.get_detail is not None
         with StatusWin("Reading data"):
             data, logs = self._init_data()
         self.logs = logs
+        provider = Viewer.provider
+        if provider is not None:
+            # Only a sample of rows is read up front - the full data
+            # is read from the provider as rows are viewed.
+            data = [provider.header] + provider[:WIDTH_SAMPLE_SIZE]
         args = (args[0], data) + args[2:]
         kw["column_widths"] = self._column_widths(data)
         # pylint: disable=non-parent-init-called
         ViewerBase.__init__(self, *args, **kw)
+        if provider is not None and len(provider):
+            self.data = provider
+            provider.start_background_load()
 
     def _init_data(self):
+        if Viewer.provider is not None:
+            Viewer.provider.stop()
+            Viewer.provider = None
         # pylint: disable=not-callable
         data, logs = self.get_data()
+        if isinstance(data, RowProvider):
+            Viewer.provider = data
+            return None, logs
         return tabview.process_data(data), logs
 
     def _column_widths(self, data):
@@ -194,6 +217,97 @@ class Viewer(ViewerBase):
         self.resize()
 
 
+class RowProvider(object):
+    """Sequence of viewer rows that are loaded a page at a time.
+
+    `header` is the list of column headers, `count` the number of rows
+    and `load_rows` a function that's called with a start and end row
+    index and returns the list of rows in that range, each a list of
+    strings.
+
+    Pages are loaded when rows in them are first accessed. Call
+    `start_background_load` to load the remaining pages in a
+    background thread.
+
+    The viewer sorts rows by creating new lists, which reads all
+    rows, and may insert or remove a header row, which is supported
+    by reading all rows into a list.
+    """
+
+    def __init__(self, header, count, load_rows, page_size=PAGE_SIZE):
+        self.header = header
+        self.count = count
+        self.load_rows = load_rows
+        self.page_size = page_size
+        self._pages = {}
+        self._rows = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def __len__(self):
+        if self._rows is not None:
+            return len(self._rows)
+        return self.count
+
+    def __getitem__(self, i):
+        if self._rows is not None:
+            return self._rows[i]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError(i)
+        page, offset = divmod(i, self.page_size)
+        return self._page(page)[offset]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _page(self, page):
+        with self._lock:
+            rows = self._pages.get(page)
+            if rows is None:
+                start = page * self.page_size
+                end = min(start + self.page_size, self.count)
+                rows = self._pages[page] = [
+                    [str(val) for val in row]
+                    for row in self.load_rows(start, end)
+                ]
+            return rows
+
+    def insert(self, i, row):
+        self._all_rows().insert(i, row)
+
+    def index(self, row):
+        return self._all_rows().index(row)
+
+    def __delitem__(self, i):
+        del self._all_rows()[i]
+
+    def _all_rows(self):
+        if self._rows is None:
+            self._rows = list(self)
+        return self._rows
+
+    def start_background_load(self):
+        thread = threading.Thread(target=self._load_all_pages)
+        thread.daemon = True
+        thread.start()
+
+    def _load_all_pages(self):
+        pages = (self.count + self.page_size - 1) // self.page_size
+        for page in range(pages):
+            if self._stopped.is_set():
+                break
+            self._page(page)
+
+    def stop(self):
+        """Stops loading pages in the background."""
+        self._stopped.set()
+
+
 class StatusWin(object):
 
     def __init__(self, msg):
@@ -221,7 +335,7 @@ def view_runs(get_data_cb, get_detail_cb, actions):
     Viewer.actions = actions
     tabview.Viewer = Viewer
     tabview.view(
-        [[]],
+        [[""]],
         column_width="max",
         info="Guild run comparison",
     )
@@ -0,0 +1,165 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Content-addressed store for run source code files
+
+Files are stored once under ``TRACKER_HOME/blobs`` keyed by the digest
+of their content. Run source code directories are populated by linking
+blobs into place - reflinks where the file system supports them,
+otherwise hard links, falling back to plain copies.
+
+Blobs are read-only. Linked files share the blob's inode, so they must
+not be modified in place (see `utils.file.chmod_plus_x`, which breaks
+the link before changing file modes).
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+
+from tracker.utils import path as pathlib
+from tracker.utils import utils
+
+log = logging.getLogger(__name__)
+
+DIGEST_ALG = "blake2b"
+
+# Name of the stat cache of file content digests
+DIGEST_CACHE = "blake2b_digests"
+
+BUF_SIZE = 1024 * 1024
+
+# Linux ioctl to clone a file (reflink) - see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def new_hash():
+    return hashlib.blake2b()
+
+
+def file_digest(path):
+    """Returns the content digest of path as used for blobs."""
+    h = new_hash()
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(BUF_SIZE)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+class BlobStore(object):
+
+    def __init__(self, root=None):
+        self.root = root or pathlib.path("blobs")
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def has(self, digest):
+        return os.path.exists(self.blob_path(digest))
+
+    def add(self, src):
+        """Adds the content of src to the store.
+
+        Content is hashed and copied to the store in a single pass
+        over the file. Returns the content digest.
+        """
+        tmp = self._tmp_path()
+        h = new_hash()
+        with open(src, "rb") as f_in:
+            with open(tmp, "wb") as f_out:
+                while True:
+                    buf = f_in.read(BUF_SIZE)
+                    if not buf:
+                        break
+                    h.update(buf)
+                    f_out.write(buf)
+        digest = h.hexdigest()
+        self._commit(tmp, digest, os.stat(src).st_mode)
+        return digest
+
+    def _tmp_path(self):
+        tmp_dir = os.path.join(self.root, "tmp")
+        utils.safe_make_dir(tmp_dir)
+        return os.path.join(
+            tmp_dir,
+            "%i-%i" % (os.getpid(), threading.current_thread().ident))
+
+    def _commit(self, tmp, digest, src_mode):
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            os.remove(tmp)
+            return
+        utils.safe_make_dir(os.path.dirname(path))
+        os.chmod(tmp, _blob_mode(src_mode))
+        os.replace(tmp, path)
+
+    def link(self, digest, dest):
+        """Creates dest with the content of blob digest."""
+        src = self.blob_path(digest)
+        if os.path.lexists(dest):
+            os.remove(dest)
+        for link_f in (_reflink, os.link):
+            try:
+                link_f(src, dest)
+            except (OSError, IOError, ImportError) as e:
+                log.debug("cannot link %s to %s: %s", src, dest, e)
+            else:
+                return
+        shutil.copyfile(src, dest)
+
+
+def _blob_mode(src_mode):
+    write_bits = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+    return (stat.S_IMODE(src_mode) | stat.S_IRUSR) & ~write_bits
+
+
+def _reflink(src, dest):
+    import fcntl
+    with open(src, "rb") as f_src:
+        with open(dest, "wb") as f_dest:
+            try:
+                fcntl.ioctl(f_dest.fileno(), FICLONE, f_src.fileno())
+            except (OSError, IOError):
+                f_dest.close()
+                os.remove(dest)
+                raise
+    shutil.copymode(src, dest)
+
+
+def write_manifest(path, files):
+    """Writes a source code manifest.
+
+    `files` is a dict of relative file paths to content digests.
+    """
+    with open(path, "w") as f:
+        json.dump(
+            {"alg": DIGEST_ALG, "files": files},
+            f, sort_keys=True, indent=1)
+
+
+def read_manifest(path):
+    """Returns the files dict of a source code manifest.
+
+    Returns None if the manifest does not exist.
+    """
+    try:
+        f = open(path, "r")
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    with f:
+        return json.load(f).get("files")
@@ -9,7 +9,8 @@
 """ Utility classes to manage source code files and filters
 """
 
-import chardet
+import codecs
+import errno
 import fnmatch
 import glob
 import hashlib
@@ -17,9 +18,14 @@ import logging
 import os
 import re
 import shutil
+import stat
 
 import six
 
+from concurrent import futures
+
+from tracker.utils import blobs
+from tracker.utils import statcache
 from tracker.utils import utils
 
 
@@ -28,6 +34,9 @@ log = logging.getLogger(__name__)
 MAX_DEFAULT_SOURCECODE_FILE_SIZE = 1024 * 1024
 MAX_DEFAULT_SOURCECODE_COUNT = 100
 
+# Use chardet to classify files that are not valid UTF-8
+DETECT_ENCODING = False
+
 _text_ext = set([
     ".csv",
     ".md",
@@ -70,47 +79,68 @@ class FileSelect():
     def __init__(self, root, rules):
         self.root = root
         self.rules = rules
+        self._file_rules = [rule for rule in rules if rule.type != "dir"]
+        self._dir_rules = [rule for rule in rules if rule.type == "dir"]
 
     def select_file(self, src_root, relpath):
         """Apply rules to file located under src_root with relpath.
 
-        All rules are applied to the file. The last rule to apply
-        (i.e. its `test` method returns a non-None value) determines
-        whether or not the file is selected - selected if test returns
-        True, not selected if returns False.
+        The last rule to apply (i.e. its `test` method returns a
+        non-None value) determines whether or not the file is selected
+        - selected if test returns True, not selected if returns
+        False. Rules are therefore evaluated last-to-first and
+        evaluation stops at the first rule that applies. Rules before
+        it are not tested and their match counts (see `max_matches`)
+        are not incremented.
 
         If no rules return a non-None value, the file is not selected.
 
+        The file is stat'ed at most once and only if a rule tests its
+        size or type.
+
         Returns a tuple of the selected flag (True or False) and list
-        of applied rules and their results (two-tuples).
+        of evaluated rules and their results (two-tuples).
         """
-        rule_results = [
-            (rule.test(src_root, relpath), rule)
-            for rule in self.rules
-            if rule.type != "dir"]
-        selected = self._last_non_none_result(rule_results)
-        return selected is True, rule_results
-
-    @staticmethod
-    def _last_non_none_result(results):
-        for val, _rule in reversed(results):
-            if val is not None:
-                return val
-        return None
+        path_stat = _PathStat(os.path.join(src_root, relpath))
+        rule_results = []
+        for rule in reversed(self._file_rules):
+            result = rule.test(src_root, relpath, path_stat)
+            rule_results.append((result, rule))
+            if result is not None:
+                rule_results.reverse()
+                return result is True, rule_results
+        rule_results.reverse()
+        return False, rule_results
 
     def prune_dirs(self, src_root, relroot, dirs):
         for name in list(dirs):
-            last_rule_result = None
             relpath = os.path.join(relroot, name)
-            for rule in self.rules:
-                if rule.type != "dir":
-                    continue
+            for rule in reversed(self._dir_rules):
                 rule_result = rule.test(src_root, relpath)
                 if rule_result is not None:
-                    last_rule_result = rule_result
-            if last_rule_result is False:
-                log.debug("skipping directory %s", relpath)
-                dirs.remove(name)
+                    if rule_result is False:
+                        log.debug("skipping directory %s", relpath)
+                        dirs.remove(name)
+                    break
+
+
+class _PathStat(object):
+    """Lazily stat'ed path shared by the rules testing a file."""
+
+    __slots__ = ("path", "_st")
+
+    def __init__(self, path):
+        self.path = path
+        self._st = None
+
+    def get(self):
+        """Returns os.stat_result for path or None if path doesn't exist."""
+        if self._st is None:
+            try:
+                self._st = os.stat(self.path)
+            except OSError:
+                self._st = False
+        return self._st or None
 
 
 class FileSelectRule(object):
@@ -146,13 +176,23 @@ class FileSelectRule(object):
 
     @staticmethod
     def _regex_match_f(patterns):
-        compiled = [re.compile(p) for p in patterns]
-        return lambda path: any((p.match(path) for p in compiled))
+        try:
+            compiled = re.compile("|".join("(?:%s)" % p for p in patterns))
+        except re.error:
+            # Patterns that can't be combined (e.g. with inline global
+            # flags) are matched one at a time.
+            compiled_list = [re.compile(p) for p in patterns]
+            return lambda path: any((p.match(path) for p in compiled_list))
+        return lambda path: compiled.match(path) is not None
 
     @staticmethod
     def _fnmatch_f(patterns):
-        match = fnmatch.fnmatch
-        return lambda path: any((match(path, p) for p in patterns))
+        # Equivalent to fnmatch.fnmatch for each pattern but with all
+        # patterns translated and compiled once into a single regex.
+        normcase = os.path.normcase
+        compiled = re.compile("|".join(
+            "(?:%s)" % fnmatch.translate(normcase(p)) for p in patterns))
+        return lambda path: compiled.match(normcase(path)) is not None
 
     @staticmethod
     def _validate_type(type):
@@ -170,61 +210,64 @@ class FileSelectRule(object):
     def reset_matches(self):
         self._matches = 0
 
-    def test(self, src_root, relpath):
-        fullpath = os.path.join(src_root, relpath)
-        tests = [
-            lambda: self._test_max_matches(),
-            lambda: self._test_patterns(relpath),
-            lambda: self._test_type(fullpath),
-            lambda: self._test_size(fullpath),
-        ]
-        for test in tests:
-            if not test():
+    def test(self, src_root, relpath, path_stat=None):
+        if (self.max_matches is not None
+                and self._matches >= self.max_matches):
+            return None
+        if not self._patterns_match(relpath):
+            return None
+        if self.type is not None or self._tests_size:
+            if path_stat is None:
+                path_stat = _PathStat(os.path.join(src_root, relpath))
+            # Size is tested first as it only requires a stat while
+            # testing type may read the file.
+            if not self._test_size(path_stat):
+                return None
+            if not self._test_type(path_stat):
                 return None
         self._matches += 1
         return self.result
 
-    def _test_max_matches(self):
-        if self.max_matches is None:
-            return True
-        return self._matches < self.max_matches
-
-    def _test_patterns(self, path):
-        return self._patterns_match(path)
+    @property
+    def _tests_size(self):
+        return self.size_gt is not None or self.size_lt is not None
 
-    def _test_type(self, path):
+    def _test_type(self, path_stat):
         if self.type is None:
             return True
         if self.type == "text":
-            return self._test_text_file(path)
+            return self._test_text_file(path_stat)
         elif self.type == "binary":
-            return self._test_binary_file(path)
+            return self._test_binary_file(path_stat)
         elif self.type == "dir":
-            return self._test_dir(path)
+            return self._test_dir(path_stat.path)
         else:
             assert False, self.type
 
     @staticmethod
-    def _test_text_file(path):
-        return safe_is_text_file(path)
+    def _test_text_file(path_stat):
+        return safe_is_text_file(path_stat.path, st=path_stat.get())
 
     @staticmethod
-    def _test_binary_file(path):
-        return not safe_is_text_file(path)
+    def _test_binary_file(path_stat):
+        return not safe_is_text_file(path_stat.path, st=path_stat.get())
 
     def _test_dir(self, path):
         if not os.path.isdir(path):
             return False
         if self.sentinel:
-            return glob.glob(os.path.join(path, self.sentinel))
+            if glob.has_magic(self.sentinel):
+                return glob.glob(os.path.join(path, self.sentinel))
+            return os.path.exists(os.path.join(path, self.sentinel))
         return True
 
-    def _test_size(self, path):
-        if self.size_gt is None and self.size_lt is None:
+    def _test_size(self, path_stat):
+        if not self._tests_size:
             return True
-        size = safe_filesize(path)
-        if size is None:
+        st = path_stat.get()
+        if st is None:
             return True
+        size = st.st_size
         if self.size_gt and size > self.size_gt:
             return True
         if self.size_lt and size < self.size_lt:
@@ -271,6 +314,67 @@ class FileCopyHandler(object):
     def handle_copy_error(_e, _src, _dest):
         return False
 
+    def finish(self):
+        pass
+
+
+class BlobCopyHandler(FileCopyHandler):
+    """Copy handler that stores files in a content-addressed blob store.
+
+    Selected files are added to `store` and linked into dest. File
+    digests are cached by stat signature so unchanged files are
+    neither re-read nor re-copied. Files are processed by a thread
+    pool while the source tree is walked; call `finish()` to wait
+    for all files and get a dict of relative paths to digests.
+    """
+
+    def __init__(self, src_root, dest_root, select, store, workers=None):
+        super(BlobCopyHandler, self).__init__(src_root, dest_root, select)
+        self.store = store
+        self._digests = statcache.cache(blobs.DIGEST_CACHE)
+        self._executor = futures.ThreadPoolExecutor(max_workers=workers)
+        self._pending = []
+
+    def copy(self, path, _rule_results):
+        self._pending.append(
+            (path, self._executor.submit(self._copy_blob, path)))
+
+    def _copy_blob(self, path):
+        src = os.path.abspath(os.path.join(self.src_root, path))
+        dest = os.path.join(self.dest_root, path)
+        utils.safe_make_dir(os.path.dirname(dest))
+        try:
+            st = os.stat(src)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        digest = self._digests.get(src, st)
+        if digest is None or not self.store.has(digest):
+            digest = self.store.add(src)
+            self._digests.put(src, digest, st)
+        self.store.link(digest, dest)
+        return digest
+
+    def finish(self):
+        files = {}
+        try:
+            for path, future in self._pending:
+                try:
+                    digest = future.result()
+                except (IOError, OSError) as e:
+                    src = os.path.join(self.src_root, path)
+                    dest = os.path.join(self.dest_root, path)
+                    if not self.handle_copy_error(e, src, dest):
+                        raise
+                else:
+                    if digest is not None:
+                        files[path] = digest
+        finally:
+            self._executor.shutdown()
+            self._pending = []
+        return files
+
 
 def copytree(
         dest,
@@ -317,6 +421,7 @@ def copytree(
                 handler.copy(relpath, results)
             else:
                 handler.ignore(relpath, results)
+    return handler
 
 
 def _copytree_src(root_start, select):
@@ -332,10 +437,35 @@ def _relpath(path, start):
     return os.path.relpath(path, start)
 
 
-def files_digest(root):
+def files_digest(root, alg="md5", workers=None):
+    """Returns a digest of the files under root.
+
+    `alg` is either "md5" or "blake2b". The md5 digest is computed
+    over the paths and content of all files in a single stream and is
+    compatible with digests of earlier versions.
+
+    The blake2b digest is computed over the paths and per-file
+    content digests (see `manifest_digest`). Per-file digests are
+    computed in parallel using a pool of `workers` threads and are
+    cached by stat signature, so unchanged files are not re-read.
+    """
     files = _files_for_digest(root)
     if not files:
         return None
+    if alg == "md5":
+        return _md5_files_digest(root, files)
+    elif alg == blobs.DIGEST_ALG:
+        return manifest_digest(_file_digests(root, files, workers))
+    else:
+        raise ValueError(
+            "invalid digest algorithm %r: expected one of %s"
+            % (alg, ", ".join(DIGEST_ALGS)))
+
+
+DIGEST_ALGS = ("md5", blobs.DIGEST_ALG)
+
+
+def _md5_files_digest(root, files):
     md5 = hashlib.md5()
     for path in files:
         relpath = os.path.relpath(path, root)
@@ -346,6 +476,46 @@ def files_digest(root):
     return md5.hexdigest()
 
 
+def _file_digests(root, files, workers):
+    cache = statcache.cache(blobs.DIGEST_CACHE)
+
+    def digest(path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        cached = cache.get(path, st)
+        if cached is not None:
+            return cached
+        val = blobs.file_digest(path)
+        cache.put(path, val, st)
+        return val
+
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        digests = executor.map(digest, files)
+        return {
+            os.path.relpath(path, root): val
+            for path, val in zip(files, digests)
+        }
+
+
+def manifest_digest(files):
+    """Returns a blake2b digest for a dict of paths to content digests.
+
+    `files` is typically the result of `BlobCopyHandler.finish()`,
+    which lets the digest of copied source code be computed without
+    reading the files again. The result is the same as
+    `files_digest(root, "blake2b")` for the copied files.
+    """
+    if not files:
+        return None
+    h = hashlib.blake2b()
+    for relpath in sorted(files):
+        h.update(_encode_file_path_for_digest(relpath))
+        h.update(b"\x00")
+        h.update(files[relpath].encode("ascii"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
 def _files_for_digest(root):
     all = []
     for path, _dirs, files in os.walk(root, followlinks=False):
@@ -369,12 +539,36 @@ def _file_bytes_digest_update(path, d):
             d.update(buf)
 
 
-def is_text_file(path, ignore_ext=False):
+def is_text_file(
+        path,
+        ignore_ext=False,
+        detect_encoding=None,
+        cache=None,
+        st=None):
+    """Returns True if path is a text file.
+
+    Files are classified by extension unless `ignore_ext` is True,
+    then by a sample of their content: samples containing NUL bytes
+    are binary and valid UTF-8 samples are text. Other samples are
+    classified by their ratio of non-printable characters.
+
+    If `detect_encoding` is True, chardet is used to detect the
+    encoding of samples that are not valid UTF-8. This is slow and
+    disabled by default (see `DETECT_ENCODING`).
+
+    `cache` is an optional `statcache.StatCache` used to memoize
+    results for files that must be sampled, along with whether
+    encodings were detected. `st` is an optional
+    `os.stat_result` for path, which is otherwise stat'ed.
+    """
     # Adapted from https://github.com/audreyr/binaryornot under the
     # BSD 3-clause License
-    if not os.path.exists(path):
-        raise OSError("%s does not exist" % path)
-    if not os.path.isfile(path):
+    if st is None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise OSError("%s does not exist" % path)
+    if not stat.S_ISREG(st.st_mode):
         return False
     if not ignore_ext:
         ext = os.path.splitext(path)[1].lower()
@@ -382,6 +576,26 @@ def is_text_file(path, ignore_ext=False):
             return True
         if ext in _binary_ext:
             return False
+    if detect_encoding is None:
+        detect_encoding = DETECT_ENCODING
+    if cache is None:
+        return _is_text_sample(path, detect_encoding)
+    cache_path = os.path.abspath(path)
+    # Results depend on whether encodings are detected, so the mode is
+    # cached with the result
+    mode = "detect" if detect_encoding else ""
+    cached = cache.get(cache_path, st)
+    if cached is not None:
+        cached_result, _, cached_mode = cached.partition(":")
+        if cached_mode == mode:
+            return cached_result == "text"
+    result = _is_text_sample(path, detect_encoding)
+    cache.put(
+        cache_path, "%s:%s" % ("text" if result else "binary", mode), st)
+    return result
+
+
+def _is_text_sample(path, detect_encoding):
     try:
         with open(path, 'rb') as f:
             sample = f.read(1024)
@@ -389,42 +603,61 @@ def is_text_file(path, ignore_ext=False):
         return False
     if not sample:
         return True
+    if b'\x00' in sample:
+        return False
+    is_utf8 = _is_utf8_prefix(sample)
     low_chars = sample.translate(None, _printable_ascii)
     nontext_ratio1 = float(len(low_chars)) / float(len(sample))
     high_chars = sample.translate(None, _printable_high_ascii)
     nontext_ratio2 = float(len(high_chars)) / float(len(sample))
+    mostly_high_chars = nontext_ratio1 > 0.3 and nontext_ratio2 < 0.05
     likely_binary = (
-        (nontext_ratio1 > 0.3 and nontext_ratio2 < 0.05)
+        mostly_high_chars
         or (nontext_ratio1 > 0.8 and nontext_ratio2 > 0.8)
     )
+    if likely_binary:
+        # Text in non-latin scripts is mostly high chars and is
+        # distinguished from binary data by being valid UTF-8.
+        return (
+            (is_utf8 and mostly_high_chars)
+            or (detect_encoding and _decodable_with_detected_encoding(sample))
+        )
+    if is_utf8:
+        return True
+    if detect_encoding and _decodable_with_detected_encoding(sample):
+        return True
+    return b'\xff' not in sample
+
+
+def _is_utf8_prefix(sample):
+    # The sample may end in the middle of a multi-byte character so
+    # it's decoded as a prefix of the file.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        decoder.decode(sample, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _decodable_with_detected_encoding(sample):
+    import chardet
     detected_encoding = chardet.detect(sample)
-    decodable_as_unicode = False
     if (detected_encoding["confidence"] > 0.9
             and detected_encoding["encoding"] != "ascii"):
         try:
-            try:
-                sample.decode(encoding=detected_encoding["encoding"])
-            except TypeError:
-                str(sample, encoding=detected_encoding["encoding"])
-            decodable_as_unicode = True
-        except LookupError:
-            pass
-        except UnicodeDecodeError:
+            sample.decode(encoding=detected_encoding["encoding"])
+        except (LookupError, UnicodeDecodeError):
             pass
-    if likely_binary:
-        return decodable_as_unicode
-    else:
-        if decodable_as_unicode:
-            return True
         else:
-            if b'\x00' in sample or b'\xff' in sample:
-                return False
-        return True
+            return True
+    return False
 
 
-def safe_is_text_file(path, ignore_ext=False):
+def safe_is_text_file(path, ignore_ext=False, st=None):
     try:
-        return is_text_file(path, ignore_ext)
+        return is_text_file(
+            path, ignore_ext, cache=statcache.cache("text_files"), st=st)
     except OSError as e:
         log.warning("could not check for text file %s: %s", path, e)
         return False
@@ -517,7 +750,7 @@ def get_umask():
 
 
 def chmod_plus_x(path):
-    import stat
+    break_hardlink(path)
     os.chmod(
         path,
         os.stat(path).st_mode
@@ -530,3 +763,17 @@ def chmod_plus_x(path):
             & ~get_umask()
         )
     )
+
+
+def break_hardlink(path):
+    """Replaces path with a private copy if it's linked elsewhere.
+
+    Used before modifying files that may be linked from the source
+    code blob store.
+    """
+    if os.stat(path).st_nlink <= 1:
+        return
+    tmp = path + ".tracker-tmp"
+    shutil.copyfile(path, tmp)
+    shutil.copymode(path, tmp)
+    os.replace(tmp, path)
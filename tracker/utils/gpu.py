@@ -102,6 +102,28 @@ class GPU():
                 return cmd
 
 
+def device_ids():
+    """Returns the list of local NVIDIA GPU indexes.
+
+    Returns an empty list if nvidia-smi isn't available.
+    """
+    try:
+        nvidia_smi = utils.which("nvidia-smi")
+    except OSError:
+        nvidia_smi = None
+    if not nvidia_smi:
+        return []
+    try:
+        out = subprocess.check_output(
+            [nvidia_smi, "--format=csv,noheader", "--query-gpu=index"])
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    return [
+        line.strip() for line in out.decode("utf-8").splitlines()
+        if line.strip()
+    ]
+
+
 def _read_csv_lines(raw_in):
     csv_in = raw_in if sys.version_info[0] == 2 else io.TextIOWrapper(raw_in)
     return list(csv.reader(csv_in))
@@ -0,0 +1,161 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Minimal Linux inotify interface
+
+Uses the C library through ctypes, so no extension module is
+required. `available()` is False on other platforms and when the C
+library doesn't provide inotify, in which case callers should fall
+back to polling.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+
+log = logging.getLogger(__name__)
+
+# Event masks - see inotify(7)
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+_READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library("c") or "libc.so.6"
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+def available():
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        libc = _get_libc()
+    except OSError:
+        return False
+    return hasattr(libc, "inotify_init1")
+
+
+class Inotify(object):
+    """An inotify instance.
+
+    Events are read without blocking unless a timeout is given to
+    `read_events`. Raises OSError if the instance can't be created,
+    for example when the per-user instance limit is reached.
+    """
+
+    def __init__(self):
+        self._libc = _get_libc()
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            _raise_errno()
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """Returns the watch descriptor for path.
+
+        Raises OSError if path can't be watched. ENOSPC is raised when
+        the per-user watch limit is reached.
+        """
+        wd = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            _raise_errno(path)
+        return wd
+
+    def rm_watch(self, wd):
+        if self._libc.inotify_rm_watch(self.fd, wd) < 0:
+            log.debug("error removing inotify watch %s", wd)
+
+    def read_events(self, timeout=0):
+        """Returns a list of pending events.
+
+        Each event is a tuple of (wd, mask, cookie, name) where name
+        is the name of the file in the watched directory or an empty
+        string for events on the watched path itself. If timeout is
+        non-zero, waits up to timeout seconds for events (None waits
+        indefinitely).
+        """
+        if timeout != 0:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return []
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, _READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            events.extend(_decode_events(buf))
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+def _decode_events(buf):
+    pos = 0
+    while pos + _EVENT_HEADER.size <= len(buf):
+        wd, mask, cookie, name_len = _EVENT_HEADER.unpack_from(buf, pos)
+        pos += _EVENT_HEADER.size
+        name = buf[pos:pos + name_len].rstrip(b"\0")
+        pos += name_len
+        yield wd, mask, cookie, os.fsdecode(name)
+
+
+def _raise_errno(path=None):
+    err = ctypes.get_errno()
+    if path is None:
+        raise OSError(err, os.strerror(err))
+    raise OSError(err, os.strerror(err), path)
@@ -23,3 +23,38 @@ def pid_exists(pid):
             log.exception("Importing psutil")
         return False
     return psutil.pid_exists(pid)
+
+
+class ProcessTable(object):
+    """Snapshot of the process table taken with a single scan.
+
+    Use in place of `pid_exists` and `psutil.Process(pid).parent()`
+    when checking many pids so that the process table is read once
+    rather than once per pid.
+    """
+
+    def __init__(self, ppids):
+        self._ppids = ppids
+
+    @classmethod
+    def snapshot(cls):
+        try:
+            import psutil
+        except Exception as e:
+            log.warning("Cannot read process table: %s", e)
+            if log.getEffectiveLevel() <= logging.DEBUG:
+                log.exception("Importing psutil")
+            return cls({})
+        ppids = {}
+        for proc in psutil.process_iter(["pid", "ppid"]):
+            ppids[proc.info["pid"]] = proc.info["ppid"]
+        return cls(ppids)
+
+    def pid_exists(self, pid):
+        return pid in self._ppids
+
+    def parent_pid(self, pid):
+        return self._ppids.get(pid)
+
+    def __len__(self):
+        return len(self._ppids)
@@ -15,6 +15,8 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import operator
+
 from six.moves import shlex_quote as q
 
 
@@ -28,7 +30,7 @@ class Select(object):
         self.cols = cols
 
     def __repr__(self):
-        return "<guild.query.Select %s>" % [str(c) for c in self.cols]
+        return "<tracker.query.Select %s>" % [str(c) for c in self.cols]
 
 
 class Col(object):
@@ -103,6 +105,164 @@ class Flag(Col):
         return self.named_as or self.name
 
 
+class Where(object):
+
+    def __init__(self, expr):
+        self.expr = expr
+
+    def __repr__(self):
+        return "<tracker.query.Where %s>" % self.expr
+
+
+class Compare(object):
+    """Filter predicate comparing a column value to a constant.
+
+    Numeric constants are compared to numeric values and other
+    constants to string values. Missing values and values of a
+    different type never match. `text` is the constant as written,
+    before conversion to a number.
+    """
+
+    def __init__(self, col, op, value, text=None):
+        self.col = col
+        self.op = op
+        self.value = value
+        self.text = text if text is not None else str(value)
+
+    def __str__(self):
+        return "%s %s %s" % (self.col, self.op, q(str(self.value)))
+
+    def test(self, val):
+        if val is None:
+            return False
+        if isinstance(self.value, (int, float)):
+            val = numeric_val(val)
+            if val is None:
+                return False
+            return COMPARE_OPS[self.op](val, self.value)
+        return COMPARE_OPS[self.op](text_val(val), self.value)
+
+
+class And(object):
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def __str__(self):
+        return "(%s and %s)" % (self.left, self.right)
+
+
+class Or(object):
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def __str__(self):
+        return "(%s or %s)" % (self.left, self.right)
+
+
+class Not(object):
+
+    def __init__(self, expr):
+        self.expr = expr
+
+    def __str__(self):
+        return "not %s" % self.expr
+
+
+COMPARE_OPS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def numeric_val(val):
+    """Returns val as a float if it's a number, otherwise None."""
+    if isinstance(val, bool) or not isinstance(val, (int, float)):
+        return None
+    return float(val)
+
+
+def text_val(val):
+    """Returns val as a string for comparison with string constants."""
+    if isinstance(val, bool):
+        return "true" if val else "false"
+    return str(val)
+
+
+def eval_filter(expr, col_val):
+    """Returns True if expr matches.
+
+    `col_val` is a function that returns the value of a column.
+    """
+    if isinstance(expr, Compare):
+        return expr.test(col_val(expr.col))
+    elif isinstance(expr, And):
+        return eval_filter(expr.left, col_val) and eval_filter(
+            expr.right, col_val)
+    elif isinstance(expr, Or):
+        return eval_filter(expr.left, col_val) or eval_filter(
+            expr.right, col_val)
+    elif isinstance(expr, Not):
+        return not eval_filter(expr.expr, col_val)
+    else:
+        raise TypeError(expr)
+
+
+class ExtractionPlan(object):
+    """Values that must be read from runs to extract a set of columns.
+
+    `attrs` is the set of attribute names, `flags` the set of flag
+    names and `scalars` a dict of scalar keys to the set of
+    `(qualifier, step)` tuples requested for each key. A qualifier of
+    None means the default qualifier.
+    """
+
+    def __init__(self, attrs=None, flags=None, scalars=None):
+        self.attrs = attrs or set()
+        self.flags = flags or set()
+        self.scalars = scalars or {}
+
+    def __repr__(self):
+        return (
+            "<tracker.query.ExtractionPlan attrs=%s flags=%s scalars=%s>"
+            % (sorted(self.attrs), sorted(self.flags), sorted(self.scalars)))
+
+    @property
+    def needs_scalars(self):
+        return bool(self.scalars)
+
+    def add(self, col):
+        if isinstance(col, Attr):
+            self.attrs.add(col.name)
+        elif isinstance(col, Flag):
+            self.flags.add(col.name)
+        elif isinstance(col, Scalar):
+            self.scalars.setdefault(col.key, set()).add(
+                (col.qualifier, col.step))
+        else:
+            raise TypeError(col)
+
+
+def compile_plan(cols):
+    """Returns an ExtractionPlan for cols.
+
+    `cols` may be a `Select` or a list of columns.
+    """
+    if isinstance(cols, Select):
+        cols = cols.cols
+    plan = ExtractionPlan()
+    for col in cols:
+        plan.add(col)
+    return plan
+
+
 def parse(s):
     from . import qparse
     p = qparse.parser()
@@ -111,3 +271,7 @@ def parse(s):
 
 def parse_colspec(colspec):
     return parse("select %s" % colspec)
+
+
+def parse_where(s):
+    return parse("where %s" % s)
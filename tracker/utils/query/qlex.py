@@ -17,17 +17,20 @@ from __future__ import division
 
 import sys
 
-from guild import _lex
+from ply import lex
 
 reserved = (
-    "SELECT",
+    "SELECT", "WHERE",
     "MIN", "MAX", "FIRST", "LAST", "AVG", "TOTAL", "COUNT",
-    "STEP", "AS"
+    "STEP", "AS",
+    "AND", "OR", "NOT",
 )
 
 tokens = reserved + (
     "SCALAR_PREFIX", "ATTR_PREFIX", "FLAG_PREFIX",
     "COMMA", "DOT", "EQUALS",
+    "NE", "LE", "GE", "LT", "GT",
+    "LPAREN", "RPAREN",
     "UNQUOTED",
     "QUOTED",
 )
@@ -65,11 +68,46 @@ def t_EQUALS(t):
     return t
 
 
+def t_NE(t):
+    r"!="
+    return t
+
+
+def t_LE(t):
+    r"<="
+    return t
+
+
+def t_GE(t):
+    r">="
+    return t
+
+
+def t_LT(t):
+    r"<"
+    return t
+
+
+def t_GT(t):
+    r">"
+    return t
+
+
+def t_LPAREN(t):
+    r"\("
+    return t
+
+
+def t_RPAREN(t):
+    r"\)"
+    return t
+
+
 reserved_map = {name.lower(): name for name in reserved}
 
 
 def t_UNQUOTED(t):
-    r"[^'\",\n][^ ,\n]*"
+    r"[^'\",\n()<>=!][^ ,\n()<>=!]*"
     t.type = reserved_map.get(t.value, "UNQUOTED")
     return t
 
@@ -86,5 +124,16 @@ def t_error(t):
     assert False, t
 
 
+_master_lexer = None
+
+
 def lexer():
-    return _lex.lex(module=sys.modules[__name__])
+    """Returns a new lexer.
+
+    Lexer rules are compiled once and new lexers are cloned from the
+    compiled lexer.
+    """
+    global _master_lexer
+    if _master_lexer is None:
+        _master_lexer = lex.lex(module=sys.modules[__name__])
+    return _master_lexer.clone()
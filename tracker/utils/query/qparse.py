@@ -15,20 +15,32 @@
 from __future__ import absolute_import
 from __future__ import division
 
-import yaml
+import sys
+import threading
 
-from guild import _yacc
+import ruamel.yaml as yaml
+
+from ply import yacc
 
 from . import Select, Scalar, Attr, Flag
+from . import Where, Compare, And, Or, Not
 from . import ParseError
 
 from . import qlex
 
 tokens = qlex.tokens
 
+precedence = (
+    ("left", "OR"),
+    ("left", "AND"),
+    ("right", "NOT"),
+)
+
 
 def p_query(p):
-    """query : select_stmt"""
+    """query : select_stmt
+             | where_stmt
+    """
     p[0] = p[1]
 
 
@@ -150,6 +162,68 @@ def p_quoted_term(p):
     p[0] = yaml.safe_load(p[1])
 
 
+def p_where_stmt(p):
+    """where_stmt : WHERE filter_expr"""
+    p[0] = Where(p[2])
+
+
+def p_filter_and(p):
+    """filter_expr : filter_expr AND filter_expr"""
+    p[0] = And(p[1], p[3])
+
+
+def p_filter_or(p):
+    """filter_expr : filter_expr OR filter_expr"""
+    p[0] = Or(p[1], p[3])
+
+
+def p_filter_not(p):
+    """filter_expr : NOT filter_expr"""
+    p[0] = Not(p[2])
+
+
+def p_filter_group(p):
+    """filter_expr : LPAREN filter_expr RPAREN"""
+    p[0] = p[2]
+
+
+def p_filter_compare(p):
+    """filter_expr : col compare_op filter_value"""
+    value, text = p[3]
+    p[0] = Compare(p[1], p[2], value, text)
+
+
+def p_compare_op(p):
+    """compare_op : EQUALS
+                  | NE
+                  | LT
+                  | LE
+                  | GT
+                  | GE
+    """
+    p[0] = p[1]
+
+
+def p_unquoted_filter_value(p):
+    """filter_value : UNQUOTED"""
+    p[0] = _filter_value(p[1]), p[1]
+
+
+def p_quoted_filter_value(p):
+    """filter_value : QUOTED"""
+    value = yaml.safe_load(p[1])
+    p[0] = value, str(value)
+
+
+def _filter_value(s):
+    for convert in (int, float):
+        try:
+            return convert(s)
+        except ValueError:
+            pass
+    return s
+
+
 def p_error(t):
     if t is None:
         raise ParseError("query string cannot be empty")
@@ -158,12 +232,32 @@ def p_error(t):
         % (t.value, t.lineno, t.lexpos))
 
 
+# LR tables are generated once per process and shared by parsers.
+# PLY parsers keep parse state on the parser object, so parsing with
+# the shared parser is serialized.
+_lr_parser = None
+_lr_parser_lock = threading.Lock()
+_parse_lock = threading.Lock()
+
+
+def _shared_lr_parser():
+    global _lr_parser
+    with _lr_parser_lock:
+        if _lr_parser is None:
+            _lr_parser = yacc.yacc(
+                module=sys.modules[__name__],
+                debug=False,
+                write_tables=False)
+        return _lr_parser
+
+
 class parser(object):
 
     def __init__(self):
         self._l = qlex.lexer()
-        self._p = _yacc.yacc(debug=False, write_tables=False)
+        self._p = _shared_lr_parser()
 
     def parse(self, s):
-        self._l.lineno = 1
-        return self._p.parse(s, self._l)
+        with _parse_lock:
+            self._l.lineno = 1
+            return self._p.parse(s, self._l)
@@ -0,0 +1,289 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Per-run cache of scalar aggregates
+
+For each scalar tag logged by a run, the cache holds the aggregates
+used by compare columns - `first`, `last`, `min`, `max`, `total` and
+`count` along with the steps of `first`, `last`, `min` and `max`
+(`avg` is derived from `total` and `count`).
+
+The cache is stored in the run's `.tracker/scalars.cache` together
+with the read position of each scalar source, so a refresh only reads
+scalars appended since the previous one. Scalar sources are native
+scalar logs (see `utils.scalarlog`) and TensorFlow event files. A
+directory containing a scalar log is read from the log only, as
+writers may log the same scalars to both formats.
+"""
+
+import json
+import logging
+import os
+
+from tracker.utils import scalarlog
+from tracker.utils import tfevent
+
+log = logging.getLogger(__name__)
+
+CACHE_FILENAME = "scalars.cache"
+
+CACHE_VERSION = 1
+
+QUALIFIERS = ("first", "last", "min", "max", "avg", "total", "count")
+
+DEFAULT_QUALIFIER = "last"
+
+# Subdirectories of the run `.tracker` dir that never contain scalars
+_SKIP_TRACKER_DIRS = ("attrs", "sourcecode")
+
+
+class ScalarCache(object):
+
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self.path = os.path.join(run_dir, ".tracker", CACHE_FILENAME)
+        self._data = _load(self.path)
+
+    @property
+    def final(self):
+        """True if the cache was last refreshed after the run stopped."""
+        return self._data["final"]
+
+    def refresh(self, final=False):
+        """Reads scalars appended since the last refresh.
+
+        Set `final` when the run is no longer running to skip
+        further refreshes via `for_run`.
+        """
+        sources = self._data["sources"]
+        tags = self._data["tags"]
+        found = set()
+        for prefix, dir, kind in _iter_sources(self.run_dir):
+            found.add(prefix)
+            source = sources.get(prefix)
+            if source is None or source["kind"] != kind:
+                source = sources[prefix] = {"kind": kind}
+                tags.pop(prefix, None)
+            reader = _SOURCE_READERS[kind]
+            reader(dir, source, tags.setdefault(prefix, {}))
+        for prefix in set(sources) - found:
+            del sources[prefix]
+            tags.pop(prefix, None)
+        self._data["final"] = final
+        self._save()
+
+    def _save(self):
+        tracker_dir = os.path.dirname(self.path)
+        if not os.path.isdir(tracker_dir):
+            return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self._data, f)
+            os.replace(tmp, self.path)
+        except (IOError, OSError) as e:
+            log.warning("cannot write scalar cache %s: %s", self.path, e)
+
+    def tags(self):
+        """Yields (prefix, tag) for cached scalars."""
+        for prefix, prefix_tags in sorted(self._data["tags"].items()):
+            for tag in sorted(prefix_tags):
+                yield prefix, tag
+
+    def aggregates(self):
+        """Yields (prefix, tag, aggregates) for cached scalars.
+
+        `aggregates` is a dict of `first`, `last`, `min`, `max`,
+        `total` and `count` along with `<qualifier>_step` for the
+        first four.
+        """
+        tags = self._data["tags"]
+        for prefix, tag in self.tags():
+            yield prefix, tag, tags[prefix][tag]
+
+    def get(self, key, qualifier=None, step=False):
+        """Returns a scalar aggregate or None if key is not logged.
+
+        `key` is a scalar key in the form `[PREFIX#]TAG` as used by
+        `query.Scalar`. If a prefix isn't specified, the tag is
+        looked up in the run root prefix first and then in the
+        remaining prefixes in order. If `step` is True, returns the
+        step associated with the aggregate rather than its value.
+        """
+        agg = self._find(key)
+        if agg is None:
+            return None
+        return _agg_value(agg, qualifier or DEFAULT_QUALIFIER, step)
+
+    def _find(self, key):
+        prefix, tag = split_key(key)
+        tags = self._data["tags"]
+        if prefix is not None:
+            return tags.get(prefix, {}).get(tag)
+        for prefix in sorted(tags):
+            agg = tags[prefix].get(tag)
+            if agg is not None:
+                return agg
+        return None
+
+
+def _load(path):
+    try:
+        f = open(path, "r")
+    except IOError:
+        return _empty()
+    with f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            log.warning("ignoring invalid scalar cache %s: %s", path, e)
+            return _empty()
+    if data.get("version") != CACHE_VERSION:
+        return _empty()
+    return data
+
+
+def _empty():
+    return {
+        "version": CACHE_VERSION,
+        "final": False,
+        "sources": {},
+        "tags": {},
+    }
+
+
+def _iter_sources(run_dir):
+    for root, dirs, files in os.walk(run_dir):
+        rel_root = os.path.relpath(root, run_dir)
+        if rel_root == ".tracker":
+            for name in _SKIP_TRACKER_DIRS:
+                if name in dirs:
+                    dirs.remove(name)
+        prefix = _source_prefix(rel_root)
+        if scalarlog.SCALARS_FILE in files:
+            yield prefix, root, "scalars"
+        elif any(tfevent._is_event_file(name) for name in files):
+            yield prefix, root, "tfevents"
+
+
+def _source_prefix(rel_root):
+    if rel_root in (".", ".tracker"):
+        return ""
+    return rel_root
+
+
+def split_key(key):
+    parts = key.split("#", 1)
+    if len(parts) == 2:
+        return parts
+    return None, parts[0]
+
+
+def _read_scalar_log(dir, source, tags):
+    import numpy as np
+    reader = scalarlog.ScalarLogReader(dir)
+    start = source.get("records", 0)
+    count = reader.record_count()
+    if count < start:
+        log.debug("scalar log in %s was replaced, re-reading", dir)
+        tags.clear()
+        start = 0
+    # Records can be appended after they're counted, so the next read
+    # starts after the records actually read
+    records = reader.records(start)
+    if len(records):
+        tag_names = reader.tags()
+        order = np.argsort(records["tag"], kind="stable")
+        grouped = records[order]
+        tag_ids, group_starts = np.unique(grouped["tag"], return_index=True)
+        group_ends = list(group_starts[1:]) + [len(grouped)]
+        for tag_id, i, j in zip(tag_ids, group_starts, group_ends):
+            group = grouped[i:j]
+            tag = tag_names[tag_id]
+            tags[tag] = _merge(tags.get(tag), group["value"], group["step"])
+    source["records"] = start + len(records)
+
+
+def _read_tfevents(dir, source, tags):
+    import numpy as np
+    reader = tfevent.IncrementalScalarReader(
+        dir, state=source.setdefault("files", {}))
+    by_tag = {}
+    for tag, val, step in reader.poll():
+        vals, steps = by_tag.setdefault(tag, ([], []))
+        vals.append(val)
+        steps.append(step)
+    for tag, (vals, steps) in by_tag.items():
+        tags[tag] = _merge(
+            tags.get(tag),
+            np.array(vals, dtype=float),
+            np.array(steps, dtype=int))
+
+
+_SOURCE_READERS = {
+    "scalars": _read_scalar_log,
+    "tfevents": _read_tfevents,
+}
+
+
+def _merge(agg, vals, steps):
+    """Returns agg updated with vals and steps in logged order."""
+    import numpy as np
+    if agg is None:
+        agg = {
+            "first": float(vals[0]),
+            "first_step": int(steps[0]),
+            "min": None,
+            "min_step": None,
+            "max": None,
+            "max_step": None,
+            "total": 0.0,
+            "count": 0,
+        }
+    agg["last"] = float(vals[-1])
+    agg["last_step"] = int(steps[-1])
+    agg["count"] += len(vals)
+    valid = ~np.isnan(vals)
+    if not valid.any():
+        return agg
+    vals = vals[valid]
+    steps = steps[valid]
+    agg["total"] += float(vals.sum())
+    i_min = int(vals.argmin())
+    if agg["min"] is None or vals[i_min] < agg["min"]:
+        agg["min"] = float(vals[i_min])
+        agg["min_step"] = int(steps[i_min])
+    i_max = int(vals.argmax())
+    if agg["max"] is None or vals[i_max] > agg["max"]:
+        agg["max"] = float(vals[i_max])
+        agg["max_step"] = int(steps[i_max])
+    return agg
+
+
+def _agg_value(agg, qualifier, step):
+    if qualifier not in QUALIFIERS:
+        raise ValueError("unsupported scalar qualifier: %s" % qualifier)
+    if qualifier == "avg":
+        if step or not agg["count"]:
+            return None
+        return agg["total"] / agg["count"]
+    if qualifier in ("total", "count"):
+        return None if step else agg[qualifier]
+    return agg["%s_step" % qualifier if step else qualifier]
+
+
+def for_run(run_dir, running=False):
+    """Returns the scalar cache for run_dir, refreshed as needed.
+
+    Caches of runs that were stopped when last refreshed aren't
+    refreshed again, so reading them costs a single file read.
+    """
+    cache = ScalarCache(run_dir)
+    if running or not cache.final:
+        cache.refresh(final=not running)
+    return cache
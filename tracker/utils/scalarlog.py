@@ -0,0 +1,219 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Native scalar log
+
+Scalars are stored in two append-only files in a log directory:
+
+- `scalars` - a header followed by fixed size little-endian records
+  of (tag id uint32, step int64, wall time float64, value float64)
+- `scalars.tags` - the tag dictionary, one JSON encoded tag per line
+  where the line number (from 0) is the tag id
+
+Neither TensorFlow nor TensorBoard is required to write or read the
+log. Readers map the records file into a NumPy structured array.
+"""
+
+import json
+import logging
+import os
+import struct
+import time
+
+log = logging.getLogger(__name__)
+
+SCALARS_FILE = "scalars"
+TAGS_FILE = "scalars.tags"
+
+HEADER = b"TRKSCL01"
+
+RECORD = struct.Struct("<Iqdd")
+
+RECORD_DTYPE = [
+    ("tag", "<u4"),
+    ("step", "<i8"),
+    ("time", "<f8"),
+    ("value", "<f8"),
+]
+
+
+class ScalarLogWriter(object):
+    """Buffered writer for a scalar log.
+
+    Records are written when `max_buffer` records are pending, when
+    `flush_secs` have passed since the last write, or when `flush()`
+    or `close()` is called. Tags are written to the dictionary as soon
+    as they're seen so that records never reference unknown tags.
+    """
+
+    def __init__(self, logdir, max_buffer=1024, flush_secs=5):
+        self.logdir = logdir
+        self.max_buffer = max_buffer
+        self.flush_secs = flush_secs
+        self._tags = None
+        self._buffer = []
+        self._last_flush = time.time()
+        self._f = None
+        self._tags_f = None
+
+    def _open(self):
+        if self._f is not None:
+            return
+        if not os.path.isdir(self.logdir):
+            os.makedirs(self.logdir)
+        self._tags = {
+            tag: i for i, tag in enumerate(read_tags(self.logdir))
+        }
+        self._tags_f = open(os.path.join(self.logdir, TAGS_FILE), "a")
+        path = os.path.join(self.logdir, SCALARS_FILE)
+        self._f = open(path, "ab")
+        if self._f.tell() == 0:
+            self._f.write(HEADER)
+        else:
+            _truncate_partial_record(self._f)
+
+    def add_scalar(self, tag, val, step=None, wall_time=None):
+        self._open()
+        self._buffer.append(RECORD.pack(
+            self._tag_id(tag),
+            int(step) if step is not None else 0,
+            wall_time if wall_time is not None else time.time(),
+            float(val)))
+        if (len(self._buffer) >= self.max_buffer
+                or time.time() - self._last_flush >= self.flush_secs):
+            self.flush()
+
+    def add_scalars(self, vals, step=None, wall_time=None):
+        """Adds a dict of tags to values logged at the same step."""
+        wall_time = wall_time if wall_time is not None else time.time()
+        for tag, val in sorted(vals.items()):
+            self.add_scalar(tag, val, step, wall_time)
+
+    def add_batch(self, scalars, wall_time=None):
+        """Adds a list of (tag, val, step) logged at the same time.
+
+        Writes are checked once for the batch rather than per scalar.
+        """
+        self._open()
+        wall_time = wall_time if wall_time is not None else time.time()
+        pack = RECORD.pack
+        tag_id = self._tag_id
+        self._buffer.extend([
+            pack(
+                tag_id(tag),
+                int(step) if step is not None else 0,
+                wall_time,
+                float(val))
+            for tag, val, step in scalars
+        ])
+        if (len(self._buffer) >= self.max_buffer
+                or time.time() - self._last_flush >= self.flush_secs):
+            self.flush()
+
+    def _tag_id(self, tag):
+        try:
+            return self._tags[tag]
+        except KeyError:
+            tag_id = self._tags[tag] = len(self._tags)
+            self._tags_f.write(json.dumps(tag) + "\n")
+            self._tags_f.flush()
+            return tag_id
+
+    def flush(self):
+        if self._buffer:
+            self._f.write(b"".join(self._buffer))
+            self._buffer = []
+        if self._f is not None:
+            self._f.flush()
+        self._last_flush = time.time()
+
+    def close(self):
+        if self._f is None:
+            return
+        self.flush()
+        self._f.close()
+        self._tags_f.close()
+        self._f = None
+        self._tags_f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+def _truncate_partial_record(f):
+    # A writer that was killed may have left a partial record.
+    size = f.tell()
+    partial = (size - len(HEADER)) % RECORD.size
+    if partial:
+        log.warning(
+            "truncating partial scalar record in %s", f.name)
+        f.truncate(size - partial)
+        f.seek(0, os.SEEK_END)
+
+
+def read_tags(logdir):
+    """Returns the list of tags in logdir, indexed by tag id."""
+    try:
+        f = open(os.path.join(logdir, TAGS_FILE), "r")
+    except IOError:
+        return []
+    with f:
+        return [json.loads(line) for line in f if line.endswith("\n")]
+
+
+class ScalarLogReader(object):
+
+    def __init__(self, logdir):
+        self.logdir = logdir
+
+    @property
+    def path(self):
+        return os.path.join(self.logdir, SCALARS_FILE)
+
+    def record_count(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        return max(size - len(HEADER), 0) // RECORD.size
+
+    def records(self, start=0):
+        """Returns a NumPy structured array of records from start.
+
+        `start` is a record index, which lets callers read only the
+        records appended since a previous read. The array is memory
+        mapped - copy it to keep values after the log is changed.
+        Fields are `tag`, `step`, `time` and `value`.
+        """
+        import numpy as np
+        dtype = np.dtype(RECORD_DTYPE)
+        count = self.record_count() - start
+        if count <= 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(
+            self.path,
+            dtype=dtype,
+            mode="r",
+            offset=len(HEADER) + start * RECORD.size,
+            shape=(count,))
+
+    def tags(self):
+        return read_tags(self.logdir)
+
+    def __iter__(self):
+        """Yields (tag, val, step) for all scalars in the log."""
+        tags = self.tags()
+        for rec in self.records():
+            yield tags[rec["tag"]], float(rec["value"]), int(rec["step"])
+
+
+def is_scalar_log_dir(dir):
+    return os.path.exists(os.path.join(dir, SCALARS_FILE))
@@ -0,0 +1,114 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Persistent cache of values computed from file contents
+
+Values are keyed by file path and are only returned while the file's
+stat signature (mtime, size, inode, ctime) is unchanged, which lets
+callers skip re-reading files that haven't changed since the value was
+computed. The change time catches files rewritten in place with their
+mtime restored, such as files copied into a reused run directory.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+
+from tracker.utils import path as pathlib
+
+log = logging.getLogger(__name__)
+
+CACHE_FILENAME = "cache.db"
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class StatCache(object):
+
+    def __init__(self, db_path, name):
+        self.db_path = db_path
+        self.name = name
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.db_path, timeout=30, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS %s ("
+                "path TEXT PRIMARY KEY, "
+                "sig TEXT NOT NULL, "
+                "value TEXT)" % self.name)
+            self._conn = conn
+        return self._conn
+
+    def get(self, path, st=None):
+        """Returns the cached value for path or None.
+
+        `st` is an optional `os.stat_result` for path. If it's not
+        specified, path is stat'ed.
+        """
+        sig = _stat_sig(path, st)
+        if sig is None:
+            return None
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT sig, value FROM %s WHERE path = ?" % self.name,
+                    (path,)).fetchone()
+        except sqlite3.Error as e:
+            log.debug("cannot read %s cache: %s", self.name, e)
+            return None
+        if row is None or row[0] != sig:
+            return None
+        return row[1]
+
+    def put(self, path, value, st=None):
+        sig = _stat_sig(path, st)
+        if sig is None:
+            return
+        try:
+            with self._lock:
+                with self._db() as db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO %s (path, sig, value) "
+                        "VALUES (?, ?, ?)" % self.name,
+                        (path, sig, value))
+        except sqlite3.Error as e:
+            log.debug("cannot write %s cache: %s", self.name, e)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _stat_sig(path, st):
+    if st is None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+    return "%i:%i:%i:%i" % (
+        st.st_mtime_ns, st.st_size, st.st_ino, st.st_ctime_ns)
+
+
+def cache(name):
+    """Returns the stat cache `name` for the current Tracker home."""
+    db_path = pathlib.path(CACHE_FILENAME)
+    key = (db_path, name)
+    with _caches_lock:
+        try:
+            return _caches[key]
+        except KeyError:
+            c = _caches[key] = StatCache(db_path, name)
+            return c
@@ -26,6 +26,14 @@ import warnings
 
 import six
 
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+from tracker.utils import scalarlog
 from tracker.utils import utils
 
 log = logging.getLogger(__name__)
@@ -243,25 +251,51 @@ def _Status(status):
 
 
 class OutputScalars(object):
+    """Writes scalars parsed from output lines.
 
-    def __init__(self, config, output_dir, ignore=None):
+    Scalars are written to a native scalar log in `output_dir` (see
+    `tracker.utils.scalarlog`). If `tfevents` is True they're also
+    written as TF event files, which requires TensorBoard.
+
+    Use `write_lines` to parse many lines at once - scalars parsed
+    from the lines are written to the log as a single batch.
+    """
+
+    def __init__(self, config, output_dir, ignore=None, tfevents=False):
         self._patterns = _init_patterns(config)
-        self._writer = SummaryWriter(output_dir)
+        self._matcher = _LineMatcher(self._patterns)
+        self._writer = _OutputScalarsWriter(output_dir, tfevents)
         self._ignore = set(ignore or [])
         self._step = None
 
     def write(self, line):
-        vals = _match_line(line, self._patterns)
-        step = vals.pop("step", None)
-        if step is not None:
-            self._step = step
-        if vals:
+        self.write_lines([line])
+
+    def write_lines(self, lines):
+        batch = []
+        debug = log.isEnabledFor(logging.DEBUG)
+        for line in lines:
+            vals = self._matcher.match(line)
+            if not vals:
+                continue
+            step = vals.pop("step", None)
+            if step is not None:
+                self._step = step
             for key, val in sorted(vals.items()):
-                log.debug("scalar %s val=%s step=%s", key, val, self._step)
+                if debug:
+                    log.debug(
+                        "scalar %s val=%s step=%s", key, val, self._step)
                 if key in self._ignore:
-                    log.debug("skipping %s because it's in ignore list", key)
+                    if debug:
+                        log.debug(
+                            "skipping %s because it's in ignore list", key)
                     continue
-                self._writer.add_scalar(key, val, self._step)
+                batch.append((key, val, self._step))
+        if batch:
+            self._writer.add_batch(batch)
+
+    def flush(self):
+        self._writer.flush()
 
     def close(self):
         self._writer.close()
@@ -271,6 +305,35 @@ class OutputScalars(object):
             sys.stdout.write("{}: {}\n".format(key, p.pattern))
 
 
+class _OutputScalarsWriter(object):
+
+    def __init__(self, output_dir, tfevents):
+        self._writers = [scalarlog.ScalarLogWriter(output_dir)]
+        if tfevents:
+            self._writers.append(SummaryWriter(output_dir))
+
+    def add_scalar(self, tag, val, step=None):
+        for writer in self._writers:
+            writer.add_scalar(tag, val, step)
+
+    def add_batch(self, scalars):
+        """Adds a list of (tag, val, step)."""
+        for writer in self._writers:
+            if isinstance(writer, scalarlog.ScalarLogWriter):
+                writer.add_batch(scalars)
+            else:
+                for tag, val, step in scalars:
+                    writer.add_scalar(tag, val, step)
+
+    def flush(self):
+        for writer in self._writers:
+            writer.flush()
+
+    def close(self):
+        for writer in self._writers:
+            writer.close()
+
+
 def _init_patterns(config):
     if not isinstance(config, list):
         raise TypeError("invalid output scalar config: %r" % config)
@@ -320,6 +383,132 @@ def _replace_aliases(val):
     return val
 
 
+class _LineMatcher(object):
+    """Matches lines against output scalar patterns.
+
+    Equivalent to `_match_line` but avoids running each pattern over
+    every line. A line is only searched by patterns whose required
+    literal text (e.g. `loss=` in `loss=(\\value)`) occurs in the
+    line. Patterns without a required literal are combined into a
+    single alternation where possible, which is used to skip lines
+    that none of them match with a single search.
+    """
+
+    def __init__(self, patterns):
+        self._patterns = patterns
+        self._literal_patterns = []
+        other_patterns = []
+        for key, p in patterns:
+            literal = _required_literal(p)
+            if literal:
+                self._literal_patterns.append((literal, key, p))
+            else:
+                other_patterns.append((key, p))
+        self._other_patterns = other_patterns
+        self._other_combined = _combine_patterns(other_patterns)
+
+    def match(self, line):
+        line = _line_to_match(line)
+        candidates = set(
+            id(p) for literal, _key, p in self._literal_patterns
+            if literal in line)
+        if self._other_patterns and (
+                self._other_combined is None
+                or self._other_combined.search(line)):
+            candidates.update(id(p) for _key, p in self._other_patterns)
+        if not candidates:
+            return {}
+        # Patterns are applied in configured order so that later
+        # patterns take precedence as with `_match_line`.
+        return _match_line(
+            line,
+            [(key, p) for key, p in self._patterns if id(p) in candidates])
+
+
+def _required_literal(p):
+    """Returns the longest literal that any match of p contains.
+
+    Returns None if p doesn't require literal text or if the literal
+    can't be determined.
+    """
+    if p.flags & re.IGNORECASE or not isinstance(p.pattern, str):
+        return None
+    try:
+        parsed = sre_parse.parse(p.pattern, p.flags)
+    except Exception:
+        return None
+    best = ""
+    cur = []
+    for item in _mandatory_items(parsed):
+        if item is not None and item[0] == sre_constants.LITERAL:
+            cur.append(chr(item[1]))
+            continue
+        best = max(best, "".join(cur), key=len)
+        cur = []
+    return max(best, "".join(cur), key=len) or None
+
+
+def _mandatory_items(parsed):
+    # Yields the items of parsed that every match contains in order,
+    # flattening groups. Yields None for other items, which break
+    # literal sequences.
+    for op, av in parsed:
+        if op == sre_constants.SUBPATTERN:
+            _group, add_flags, _del_flags, sub = av
+            if add_flags & re.IGNORECASE:
+                yield None
+            else:
+                for item in _mandatory_items(sub):
+                    yield item
+        elif op == sre_constants.LITERAL:
+            yield op, av
+        else:
+            yield None
+
+
+def _combine_patterns(patterns):
+    """Returns a pattern that matches where any of patterns match.
+
+    Returns None if the patterns can't be combined, e.g. when they use
+    back references or inline flags, or when there's a single pattern.
+    """
+    if len(patterns) < 2:
+        return None
+    if any(_has_group_refs(p) for _key, p in patterns):
+        return None
+    try:
+        return re.compile("|".join(
+            "(?:%s)" % p.pattern for _key, p in patterns))
+    except Exception as e:
+        log.debug("cannot combine output scalar patterns: %s", e)
+        return None
+
+
+def _has_group_refs(p):
+    try:
+        return _parsed_has_group_refs(sre_parse.parse(p.pattern, p.flags))
+    except Exception:
+        return True
+
+
+def _parsed_has_group_refs(parsed):
+    for op, av in parsed:
+        if str(op).startswith("GROUPREF"):
+            return True
+        if any(_parsed_has_group_refs(sub) for sub in _subpatterns(av)):
+            return True
+    return False
+
+
+def _subpatterns(av):
+    if isinstance(av, sre_parse.SubPattern):
+        yield av
+    elif isinstance(av, (list, tuple)):
+        for item in av:
+            for sub in _subpatterns(item):
+                yield sub
+
+
 def _match_line(line, patterns):
     vals = {}
     line = _line_to_match(line)
@@ -0,0 +1,299 @@
+# Copyright (c) 2019, Danish Technological Institute.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+# -*- coding: utf-8 -*-
+
+""" Follow files written by other processes
+
+A `Tailer` follows any number of files, each until the process
+writing it exits. `Tailer.poll` blocks until data is appended to a
+file or a process exits - file changes are reported by inotify and
+process exits by pid file descriptors (see pidfd_open(2)). Where
+either isn't available, files are polled at `POLL_INTERVAL` and
+processes are checked at `PROC_CHECK_INTERVAL`.
+"""
+
+import codecs
+import errno
+import logging
+import os
+import selectors
+import time
+
+import psutil
+
+from tracker.utils import inotify
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Maximum bytes read from a file per poll, so a large backlog doesn't
+# hold back output from other files
+MAX_READ_SIZE = 16 * CHUNK_SIZE
+
+POLL_INTERVAL = 0.1
+
+PROC_CHECK_INTERVAL = 1.0
+
+_FILE_EVENTS = (
+    inotify.IN_MODIFY
+    | inotify.IN_CREATE
+    | inotify.IN_MOVED_TO
+    | inotify.IN_ONLYDIR)
+
+
+class _Source(object):
+
+    def __init__(self, key, path, pid):
+        self.key = key
+        self.path = path
+        self.pid = pid
+        self.pidfd = None
+        self.wd = None
+        self.proc = None
+        self.exited = pid is None
+        self.polled = False
+        self._f = None
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def read(self):
+        """Returns a tuple of (text, more).
+
+        `more` is True if the read stopped at MAX_READ_SIZE.
+        """
+        f = self._open()
+        if f is None:
+            return "", False
+        if os.fstat(f.fileno()).st_size < f.tell():
+            log.debug("%s was truncated, reading from start", self.path)
+            f.seek(0)
+        chunks = []
+        size = 0
+        while size < MAX_READ_SIZE:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return self._decoder.decode(b"".join(chunks)), size >= MAX_READ_SIZE
+
+    def _open(self):
+        if self._f is None:
+            try:
+                self._f = open(self.path, "rb")
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return self._f
+
+    def check_exited(self):
+        if not self.exited and self.pidfd is None:
+            self.exited = not _proc_running(self.proc)
+        return self.exited
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+
+
+def _proc_running(proc):
+    try:
+        return proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+class Tailer(object):
+    """Follows files until the processes writing them exit."""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._sources = {}
+        # Watch descriptors to dicts of file names to source keys - a
+        # directory is watched while it has followed files
+        self._watches = {}
+        # Keys of sources with data to read on the next poll
+        self._ready = set()
+        self._inotify = _init_inotify()
+        if self._inotify:
+            self._selector.register(self._inotify, selectors.EVENT_READ)
+
+    def __len__(self):
+        return len(self._sources)
+
+    def __contains__(self, key):
+        return key in self._sources
+
+    def add(self, key, path, pid=None):
+        """Follows path until process pid exits.
+
+        If pid is None, path is read to its end and the source is
+        reported as done. Data already in path is returned by the
+        next poll.
+        """
+        source = self._sources[key] = _Source(key, path, pid)
+        self._watch_file(source)
+        if pid is not None:
+            self._watch_proc(source)
+        self._ready.add(key)
+
+    def _watch_file(self, source):
+        if not self._inotify:
+            source.polled = True
+            return
+        dir, name = os.path.split(source.path)
+        try:
+            wd = self._inotify.add_watch(dir, _FILE_EVENTS)
+        except OSError as e:
+            log.debug("cannot watch %s (%s), polling", dir, e)
+            source.polled = True
+        else:
+            source.wd = wd
+            self._watches.setdefault(wd, {})[name] = source.key
+
+    def _watch_proc(self, source):
+        try:
+            source.proc = psutil.Process(source.pid)
+        except psutil.NoSuchProcess:
+            source.exited = True
+            return
+        try:
+            source.pidfd = os.pidfd_open(source.pid)
+        except (AttributeError, OSError) as e:
+            log.debug("cannot open pidfd for %s: %s", source.pid, e)
+            return
+        self._selector.register(source.pidfd, selectors.EVENT_READ, source)
+
+    def remove(self, key):
+        source = self._sources.pop(key, None)
+        if source is None:
+            return
+        self._ready.discard(key)
+        if source.wd is not None:
+            self._unwatch_file(source)
+        if source.pidfd is not None:
+            self._selector.unregister(source.pidfd)
+        source.close()
+
+    def _unwatch_file(self, source):
+        names = self._watches[source.wd]
+        name = os.path.basename(source.path)
+        if names.get(name) == source.key:
+            del names[name]
+        if names:
+            return
+        del self._watches[source.wd]
+        self._inotify.rm_watch(source.wd)
+
+    def poll(self, timeout=None):
+        """Returns a list of (key, text, done) for followed files.
+
+        Waits up to timeout seconds (None waits indefinitely) for
+        data to be appended to a file or for a process to exit. Files
+        are `done` once their process has exited and they've been read
+        to the end, at which point they're no longer followed.
+        """
+        events = self._selector.select(self._select_timeout(timeout))
+        for key, _mask in events:
+            if key.fileobj is self._inotify:
+                self._ready.update(self._file_events())
+            else:
+                key.data.exited = True
+                self._ready.add(key.data.key)
+        for source in self._sources.values():
+            if source.polled or source.check_exited():
+                self._ready.add(source.key)
+        return self._read_ready()
+
+    def _select_timeout(self, timeout):
+        if self._ready:
+            return 0
+        interval = None
+        for source in self._sources.values():
+            if source.polled:
+                interval = POLL_INTERVAL
+                break
+            if source.pidfd is None and not source.exited:
+                interval = PROC_CHECK_INTERVAL
+        if interval is None:
+            return timeout
+        return interval if timeout is None else min(interval, timeout)
+
+    def _file_events(self):
+        for wd, _mask, _cookie, name in self._inotify.read_events():
+            key = self._watches.get(wd, {}).get(name)
+            if key is not None:
+                yield key
+
+    def _read_ready(self):
+        ready, self._ready = self._ready, set()
+        results = []
+        for key in sorted(ready, key=str):
+            source = self._sources.get(key)
+            if source is None:
+                continue
+            # Check for exit before reading so that output written
+            # just before the process exited is read.
+            exited = source.exited
+            text, more = source.read()
+            done = exited and not more
+            if more:
+                self._ready.add(key)
+            if text or done:
+                results.append((key, text, done))
+            if done:
+                self.remove(key)
+        return results
+
+    def close(self):
+        for key in list(self._sources):
+            self.remove(key)
+        if self._inotify:
+            self._selector.unregister(self._inotify)
+            self._inotify.close()
+        self._selector.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+def _init_inotify():
+    if not inotify.available():
+        return None
+    try:
+        return inotify.Inotify()
+    except OSError as e:
+        log.debug("cannot use inotify (%s), polling files", e)
+        return None
+
+
+def follow(path, pid, out, timeout=None):
+    """Writes data appended to path to out until process pid exits.
+
+    Returns True if the process exited or False if timeout seconds
+    passed first.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    with Tailer() as tailer:
+        tailer.add(path, path, pid)
+        while True:
+            remaining = deadline - time.time() if deadline else None
+            if remaining is not None and remaining <= 0:
+                return False
+            for _key, text, done in tailer.poll(remaining):
+                if text:
+                    out.write(text)
+                    out.flush()
+                if done:
+                    return True
@@ -23,8 +23,10 @@ from __future__ import division
 
 import glob
 import hashlib
+import json
 import logging
 import os
+import struct
 import warnings
 
 from tracker.utils import utils
@@ -77,33 +79,159 @@ class ScalarReader(object):
     def __iter__(self):
         """Yields (tag, val, step) for all scalars in dir."""
         for event in EventReader(self.dir):
-            for val in event.summary.value:
-                try:
-                    yield utils.try_apply([
-                        self._try_tfevent_v2,
-                        self._try_tfevent_v1
-                    ], event, val)
-                except utils.TryFailed:
-                    log.debug("could not read event summary %s", val)
-
-    @staticmethod
-    def _try_tfevent_v2(event, val):
-        if not val.HasField("tensor") or not _is_float_tensor(val.tensor):
-            raise utils.TryFailed()
+            for scalar in _event_scalars(event):
+                yield scalar
+
+
+def _event_scalars(event):
+    for val in event.summary.value:
         try:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore", Warning)
-                from tensorboard.util.tensor_util import make_ndarray
-        except ImportError as e:
-            log.debug("error importing make_ndarray: %s", e)
-            raise utils.TryFailed()
-        return val.tag, make_ndarray(val.tensor).item(), event.step
-
-    @staticmethod
-    def _try_tfevent_v1(event, val):
-        if not val.HasField("simple_value"):
-            raise utils.TryFailed()
-        return val.tag, val.simple_value, event.step
+            yield utils.try_apply([
+                _try_tfevent_v2,
+                _try_tfevent_v1
+            ], event, val)
+        except utils.TryFailed:
+            log.debug("could not read event summary %s", val)
+
+
+def _try_tfevent_v2(event, val):
+    if not val.HasField("tensor") or not _is_float_tensor(val.tensor):
+        raise utils.TryFailed()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Warning)
+            from tensorboard.util.tensor_util import make_ndarray
+    except ImportError as e:
+        log.debug("error importing make_ndarray: %s", e)
+        raise utils.TryFailed()
+    return val.tag, make_ndarray(val.tensor).item(), event.step
+
+
+def _try_tfevent_v1(event, val):
+    if not val.HasField("simple_value"):
+        raise utils.TryFailed()
+    return val.tag, val.simple_value, event.step
+
+
+class IncrementalScalarReader(object):
+    """Reads scalars appended to the event files in dir since last poll.
+
+    The reader keeps the byte offset of the next record in each event
+    file, so each poll decodes only the records appended since the
+    previous one. Records are read directly from the TFRecord framing
+    and only the event protobufs are decoded with TensorBoard.
+
+    If `state_path` is specified, offsets and the last record read
+    from each file are saved there after each poll and restored when
+    the reader is created, so polling resumes across processes.
+    Alternatively, callers that persist state themselves may provide
+    a `state` dict from a previous reader's `state` attribute.
+    """
+
+    def __init__(self, dir, state_path=None, state=None):
+        self.dir = dir
+        self.state_path = state_path
+        if state is None:
+            state = _load_reader_state(state_path)
+        self.state = state
+
+    def poll(self):
+        """Returns a list of (tag, val, step) for newly appended scalars."""
+        event_pb2 = _event_pb2()
+        if event_pb2 is None:
+            return []
+        scalars = []
+        changed = False
+        for path in sorted(glob.glob(os.path.join(self.dir, "*.tfevents.*"))):
+            name = os.path.basename(path)
+            state = self.state.setdefault(name, {"offset": 0})
+            for offset, data in _iter_records(path, state):
+                event = event_pb2.Event.FromString(data)
+                for tag, val, step in _event_scalars(event):
+                    scalars.append((tag, val, step))
+                    state["last"] = [tag, val, step]
+                state["offset"] = offset
+                changed = True
+        if changed:
+            self._save_state()
+        return scalars
+
+    def __iter__(self):
+        """Yields (tag, val, step) for newly appended scalars."""
+        for scalar in self.poll():
+            yield scalar
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"files": self.state}, f)
+        os.replace(tmp, self.state_path)
+
+
+def _load_reader_state(state_path):
+    if not state_path:
+        return {}
+    try:
+        f = open(state_path, "r")
+    except IOError:
+        return {}
+    with f:
+        try:
+            return json.load(f).get("files", {})
+        except ValueError as e:
+            log.warning("ignoring invalid reader state %s: %s", state_path, e)
+            return {}
+
+
+_RECORD_HEADER = struct.Struct("<QI")
+_RECORD_FOOTER_SIZE = 4
+
+
+def _iter_records(path, state):
+    """Yields (next_offset, data) for complete records from offset.
+
+    Stops at the first incomplete record, which is likely still
+    being written. If the file is smaller than the offset, it's
+    assumed to have been replaced and is read from the start.
+    """
+    try:
+        f = open(path, "rb")
+    except IOError as e:
+        log.debug("cannot open %s: %s", path, e)
+        return
+    with f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        offset = state.get("offset", 0)
+        if size < offset:
+            log.debug("%s was truncated, reading from start", path)
+            offset = 0
+        f.seek(offset)
+        while offset + _RECORD_HEADER.size <= size:
+            length, _len_crc = _RECORD_HEADER.unpack(
+                f.read(_RECORD_HEADER.size))
+            end = (
+                offset + _RECORD_HEADER.size + length + _RECORD_FOOTER_SIZE)
+            if end > size:
+                break
+            data = f.read(length)
+            f.read(_RECORD_FOOTER_SIZE)
+            offset = end
+            yield offset, data
+
+
+def _event_pb2():
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Warning)
+            from tensorboard.compat.proto import event_pb2
+    except ImportError as e:
+        log.debug("error importing event_pb2: %s", e)
+        return None
+    else:
+        return event_pb2
 
 
 def _is_float_tensor(t):